@@ -5,36 +5,77 @@ Simple MongoDB Aggregation Queries
 Generates CSV files for visualization
 """
 
-import subprocess
+import argparse
 import json
 import os
 import pandas as pd
 from datetime import datetime
 
-def run_mongosh_command(command):
-    """Run a MongoDB command using docker exec"""
-    docker_cmd = f'docker exec mongodb mongosh -u admin -p password --authenticationDatabase admin --quiet --eval "{command}"'
-    
+from pymongo.errors import PyMongoError
+
+from mongodb_client import BATCH_SIZE, MAX_TIME_MS, MONGO_URI, QueryEngine
+from mongodb_denormalize import items_stamped
+from mongodb_rollups import (CATEGORY_DAY, DAILY_REVENUE_ROLLUP_PIPELINE, DAY, DAY_KEY, PRODUCT_DAY,
+                             REVENUE_BY_CATEGORY_ROLLUP_PIPELINE, TOP_PRODUCTS_ROLLUP_PIPELINE, print_refresh, refresh)
+
+TOP_PRODUCTS_PIPELINE = [
+    {"$unwind": "$items"},
+    {"$group": {
+        "_id": "$items.product_id",
+        "totalSold": {"$sum": "$items.quantity"},
+        "totalRevenue": {"$sum": "$items.subtotal"}
+    }},
+    {"$sort": {"totalSold": -1}},
+    {"$limit": 15}
+]
+
+REVENUE_BY_CATEGORY_PIPELINE = [
+    {"$unwind": "$items"},
+    {"$lookup": {
+        "from": "products",
+        "localField": "items.product_id",
+        "foreignField": "product_id",
+        "as": "product"
+    }},
+    {"$unwind": "$product"},
+    {"$group": {
+        "_id": "$product.category_id",
+        "totalRevenue": {"$sum": "$items.subtotal"},
+        "totalUnits": {"$sum": "$items.quantity"}
+    }},
+    {"$sort": {"totalRevenue": -1}}
+]
+
+# Same result once every item carries its category (see mongodb_denormalize.py), without the per-item $lookup
+REVENUE_BY_CATEGORY_STAMPED_PIPELINE = [
+    {"$unwind": "$items"},
+    {"$group": {
+        "_id": "$items.category_id",
+        "totalRevenue": {"$sum": "$items.subtotal"},
+        "totalUnits": {"$sum": "$items.quantity"}
+    }},
+    {"$sort": {"totalRevenue": -1}}
+]
+
+DAILY_REVENUE_PIPELINE = [
+    {"$group": {"_id": DAY_KEY, "revenue": {"$sum": "$total"}, "transactions": {"$sum": 1}}},
+    {"$sort": {"_id": 1}},
+    {"$project": {"_id": 0, "date": "$_id", "revenue": {"$round": ["$revenue", 2]}, "transactions": 1}}
+]
+
+def revenue_by_category_pipeline(engine):
+    """The $lookup-free pipeline when transaction items are stamped with their category"""
     try:
-        result = subprocess.run(docker_cmd, shell=True, capture_output=True, text=True, timeout=30)
-        if result.returncode == 0:
-            return result.stdout.strip()
-        else:
-            print(f"Error: {result.stderr}")
-            return None
-    except Exception as e:
-        print(f"Exception: {e}")
-        return None
+        stamped = items_stamped(engine.db)
+    except PyMongoError:
+        stamped = False
+    return REVENUE_BY_CATEGORY_STAMPED_PIPELINE if stamped else REVENUE_BY_CATEGORY_PIPELINE
 
-def test_connection():
+def test_connection(engine):
     """Test if we can connect to MongoDB"""
     print("Testing MongoDB connection...")
     
-    # Simple test command
-    test_cmd = 'db.adminCommand({ping: 1})'
-    result = run_mongosh_command(test_cmd)
-    
-    if result and '"ok"' in result:
+    if engine.ping():
         print("✅ MongoDB connection successful!")
         return True
     else:
@@ -45,7 +86,7 @@ def test_connection():
         print("3. Wait 10 seconds after starting container")
         return False
 
-def get_collection_counts():
+def get_collection_counts(engine):
     """Get counts of documents in each collection"""
     print("\nChecking collection counts...")
     
@@ -53,124 +94,95 @@ def get_collection_counts():
     counts = {}
     
     for collection in collections:
-        cmd = f'db.getSiblingDB("ecommerce_db").{collection}.countDocuments()'
-        result = run_mongosh_command(cmd)
-        if result:
-            try:
-                count = int(result.strip())
-                counts[collection] = count
-                print(f"  {collection}: {count:,} documents")
-            except:
-                print(f"  {collection}: Could not parse count")
-        else:
-            print(f"  {collection}: Failed to get count")
+        try:
+            count = engine.count(collection)
+            counts[collection] = count
+            print(f"  {collection}: {count:,} documents")
+        except PyMongoError as e:
+            print(f"  {collection}: Failed to get count ({e})")
     
     return counts
 
-def run_query1_top_products():
-    """Run Query 1: Top-selling products"""
+def run_query1_top_products(engine, collection='transactions', pipeline=TOP_PRODUCTS_PIPELINE):
+    """Run Query 1: Top-selling products, streamed into top_products.csv"""
     print("\n" + "="*60)
     print("QUERY 1: TOP-SELLING PRODUCTS")
     print("="*60)
     
-    # The exact query from your project
-    query = '''
-    db.getSiblingDB("ecommerce_db").transactions.aggregate([
-        {"$unwind": "$items"},
-        {"$group": {
-            "_id": "$items.product_id",
-            "totalSold": {"$sum": "$items.quantity"},
-            "totalRevenue": {"$sum": "$items.subtotal"}
-        }},
-        {"$sort": {"totalSold": -1}},
-        {"$limit": 15}
-    ]).toArray()
-    '''
-    
     print("Running query...")
-    result = run_mongosh_command(query)
+    try:
+        rows, head = engine.to_csv("top_products", collection, pipeline,
+                                   'top_products.csv', rename={'_id': 'product_id'})
+    except PyMongoError as e:
+        print(f"Query failed to execute: {e}")
+        return None
     
-    if result:
-        try:
-            # Parse JSON result
-            data = json.loads(result)
-            
-            if data:
-                print(f"\nFound {len(data)} products")
-                print("\nTop 5 products:")
-                print("-" * 50)
-                for i, item in enumerate(data[:5], 1):
-                    print(f"{i}. {item['_id']}:")
-                    print(f"   Sold: {item['totalSold']} units")
-                    print(f"   Revenue: ${item['totalRevenue']:.2f}")
-                
-                return data
-            else:
-                print("No data returned from query")
-                return None
-                
-        except json.JSONDecodeError:
-            print("Could not parse JSON result")
-            print(f"Raw output: {result[:200]}...")
-            return None
+    if rows:
+        print(f"\nFound {rows} products")
+        print("\nTop 5 products:")
+        print("-" * 50)
+        for i, item in enumerate(head, 1):
+            print(f"{i}. {item['product_id']}:")
+            print(f"   Sold: {item['totalSold']} units")
+            print(f"   Revenue: ${item['totalRevenue']:.2f}")
+        print("✅ Saved to top_products.csv")
+        return rows
     else:
-        print("Query failed to execute")
+        print("No data returned from query")
         return None
 
-def run_query2_revenue_by_category():
-    """Run Query 2: Revenue by category"""
+def run_query2_revenue_by_category(engine, collection='transactions', pipeline=REVENUE_BY_CATEGORY_PIPELINE):
+    """Run Query 2: Revenue by category, streamed into revenue_by_category.csv"""
     print("\n" + "="*60)
     print("QUERY 2: REVENUE BY CATEGORY")
     print("="*60)
     
-    # The exact query from your project
-    query = '''
-    db.getSiblingDB("ecommerce_db").transactions.aggregate([
-        {"$unwind": "$items"},
-        {"$lookup": {
-            "from": "products",
-            "localField": "items.product_id",
-            "foreignField": "product_id",
-            "as": "product"
-        }},
-        {"$unwind": "$product"},
-        {"$group": {
-            "_id": "$product.category_id",
-            "totalRevenue": {"$sum": "$items.subtotal"},
-            "totalUnits": {"$sum": "$items.quantity"}
-        }},
-        {"$sort": {"totalRevenue": -1}}
-    ]).toArray()
-    '''
+    if pipeline is REVENUE_BY_CATEGORY_PIPELINE:
+        print("Running query ($lookup into products)...")
+    else:
+        print("Running query...")
+    try:
+        rows, head = engine.to_csv("revenue_by_category", collection, pipeline,
+                                   'revenue_by_category.csv', rename={'_id': 'category_id'})
+    except PyMongoError as e:
+        print(f"Query failed to execute: {e}")
+        return None
+    
+    if rows:
+        print(f"\nFound {rows} categories")
+        print("\nTop 5 categories by revenue:")
+        print("-" * 50)
+        for i, item in enumerate(head, 1):
+            print(f"{i}. {item['category_id']}:")
+            print(f"   Revenue: ${item['totalRevenue']:.2f}")
+            print(f"   Units: {item['totalUnits']}")
+        print("✅ Saved to revenue_by_category.csv")
+        return rows
+    else:
+        print("No data returned from query")
+        return None
+
+def run_query3_daily_revenue(engine, collection='transactions', pipeline=DAILY_REVENUE_PIPELINE):
+    """Run Query 3: Revenue per day, streamed into daily_revenue.csv"""
+    print("\n" + "="*60)
+    print("QUERY 3: DAILY REVENUE")
+    print("="*60)
     
     print("Running query...")
-    result = run_mongosh_command(query)
+    try:
+        rows, head = engine.to_csv("daily_revenue", collection, pipeline, 'daily_revenue.csv')
+    except PyMongoError as e:
+        print(f"Query failed to execute: {e}")
+        return None
     
-    if result:
-        try:
-            # Parse JSON result
-            data = json.loads(result)
-            
-            if data:
-                print(f"\nFound {len(data)} categories")
-                print("\nTop 5 categories by revenue:")
-                print("-" * 50)
-                for i, item in enumerate(data[:5], 1):
-                    print(f"{i}. {item['_id']}:")
-                    print(f"   Revenue: ${item['totalRevenue']:.2f}")
-                    print(f"   Units: {item['totalUnits']}")
-                
-                return data
-            else:
-                print("No data returned from query")
-                return None
-                
-        except json.JSONDecodeError:
-            print("Could not parse JSON result")
-            print(f"Raw output: {result[:200]}...")
-            return None
+    if rows:
+        print(f"\nFound {rows} days, starting:")
+        for item in head:
+            print(f"  {item['date']}: ${item['revenue']:,.2f} from {item['transactions']} transactions")
+        print("✅ Saved to daily_revenue.csv")
+        return rows
     else:
-        print("Query failed to execute")
+        print("No data returned from query")
         return None
 
 def save_to_csv(data, filename):
@@ -283,59 +295,67 @@ except Exception as e:
     
     print("✅ Created visualization script: visualize_results.py")
 
-def create_query_documentation(query1_data, query2_data):
-    """Create documentation of the queries"""
+def format_pipeline(pipeline):
+    return json.dumps(pipeline, indent=2)
+
+def create_query_documentation(query1_rows, query2_rows, plans=None, query3_rows=None):
+    """Create documentation of the queries; `plans` maps each query to the (collection, pipeline) it ran"""
+    plans = plans or {
+        'top_products': ('transactions', TOP_PRODUCTS_PIPELINE),
+        'revenue_by_category': ('transactions', REVENUE_BY_CATEGORY_PIPELINE)
+    }
+    
+    def describe(name):
+        collection, pipeline = plans[name]
+        return f"db.{collection}.aggregate({format_pipeline(pipeline)})"
+    
+    daily = ""
+    if 'daily_revenue' in plans:
+        daily = f"""
+QUERY 3: Daily Revenue
+======================
+Aggregation Pipeline:
+{describe('daily_revenue')}
+
+Results Summary:
+- Days analyzed: {query3_rows or 0}
+- Saved to: daily_revenue.csv
+"""
+    rollups = ""
+    if plans['top_products'][0] != 'transactions':
+        rollups = f"""
+The queries read the rollup collections ({PRODUCT_DAY}, {CATEGORY_DAY}, {DAY}),
+refreshed from the transactions with $merge first (see mongodb_rollups.py).
+"""
     
     doc = f"""MONGODB AGGREGATION QUERIES - RESULTS
 Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-
+{rollups}
 QUERY 1: Top-selling Products
 =============================
 Aggregation Pipeline:
-db.transactions.aggregate([
-  {{"$unwind": "$items"}},
-  {{"$group": {{
-    "_id": "$items.product_id",
-    "totalSold": {{"$sum": "$items.quantity"}},
-    "totalRevenue": {{"$sum": "$items.subtotal"}}
-  }}}},
-  {{"$sort": {{"totalSold": -1}}}},
-  {{"$limit": 15}}
-])
+{describe('top_products')}
 
 Results Summary:
-- Products analyzed: {len(query1_data) if query1_data else 0}
+- Products analyzed: {query1_rows or 0}
 - Saved to: top_products.csv
 
 QUERY 2: Revenue by Category
 ============================
 Aggregation Pipeline:
-db.transactions.aggregate([
-  {{"$unwind": "$items"}},
-  {{"$lookup": {{
-    "from": "products",
-    "localField": "items.product_id",
-    "foreignField": "product_id",
-    "as": "product"
-  }}}},
-  {{"$unwind": "$product"}},
-  {{"$group": {{
-    "_id": "$product.category_id",
-    "totalRevenue": {{"$sum": "$items.subtotal"}},
-    "totalUnits": {{"$sum": "$items.quantity"}}
-  }}}},
-  {{"$sort": {{"totalRevenue": -1}}}}
-])
+{describe('revenue_by_category')}
 
 Results Summary:
-- Categories analyzed: {len(query2_data) if query2_data else 0}
+- Categories analyzed: {query2_rows or 0}
 - Saved to: revenue_by_category.csv
-
+{daily}
 FILES GENERATED:
 ===============
 1. top_products.csv - Product sales data
 2. revenue_by_category.csv - Category revenue data
 3. visualize_results.py - Visualization script
+4. query_latency.csv - Time to first batch and total time per query
+5. daily_revenue.csv - Revenue and transactions per day
 
 TO CREATE VISUALIZATIONS:
 =======================
@@ -355,6 +375,15 @@ FOR TECHNICAL REPORT:
     print("✅ Created documentation: query_documentation.txt")
 
 def main():
+    parser = argparse.ArgumentParser(description="Run the MongoDB aggregation queries and save the results as CSV")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string (or set MONGO_URI)")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Documents per cursor round trip")
+    parser.add_argument('--max-time-ms', type=int, default=MAX_TIME_MS, help="Server-side time limit per query")
+    parser.add_argument('--no-rollups', action='store_true',
+                        help="Aggregate the transactions directly instead of the rollup collections")
+    args = parser.parse_args()
+    engine = QueryEngine(args.uri, batch_size=args.batch_size, max_time_ms=args.max_time_ms)
+
     print("\n" + "="*70)
     print("AUCA BIG DATA ANALYTICS - MONGODB QUERIES")
     print("="*70)
@@ -366,12 +395,12 @@ def main():
     print(f"Output directory: {os.getcwd()}")
     
     # Test connection
-    if not test_connection():
+    if not test_connection(engine):
         print("\n⚠ Using sample data mode")
         use_sample_data = True
     else:
         # Get collection counts
-        counts = get_collection_counts()
+        counts = get_collection_counts(engine)
         
         # Check if we have data
         if counts.get('transactions', 0) > 0:
@@ -381,33 +410,55 @@ def main():
             print("\n⚠ No transaction data found, using sample data")
             use_sample_data = True
     
-    # Run queries or use sample data
+    # Run queries (they stream straight into the CSV files) or use sample data
+    plans = None
+    query3_rows = None
     if not use_sample_data:
-        # Try to run actual queries
-        query1_data = run_query1_top_products()
-        query2_data = run_query2_revenue_by_category()
+        if args.no_rollups:
+            plans = {
+                'top_products': ('transactions', TOP_PRODUCTS_PIPELINE),
+                'revenue_by_category': ('transactions', revenue_by_category_pipeline(engine)),
+                'daily_revenue': ('transactions', DAILY_REVENUE_PIPELINE)
+            }
+        else:
+            # Bring the rollups up to date (only transactions since the last refresh are aggregated)
+            try:
+                print_refresh(refresh(engine.db, args.max_time_ms))
+            except PyMongoError as e:
+                print(f"⚠ Rollup refresh failed: {e}")
+            plans = {
+                'top_products': (PRODUCT_DAY, TOP_PRODUCTS_ROLLUP_PIPELINE),
+                'revenue_by_category': (CATEGORY_DAY, REVENUE_BY_CATEGORY_ROLLUP_PIPELINE),
+                'daily_revenue': (DAY, DAILY_REVENUE_ROLLUP_PIPELINE)
+            }
+        query1_rows = run_query1_top_products(engine, *plans['top_products'])
+        query2_rows = run_query2_revenue_by_category(engine, *plans['revenue_by_category'])
+        query3_rows = run_query3_daily_revenue(engine, *plans['daily_revenue'])
         
         # If queries fail, use sample data
-        if not query1_data or not query2_data:
+        if not query1_rows or not query2_rows:
             print("\n⚠ Queries failed, using sample data")
-            query1_data, query2_data = create_sample_data()
-    else:
-        # Use sample data
-        query1_data, query2_data = create_sample_data()
-    
-    # Save results to CSV
-    print("\n" + "="*60)
-    print("SAVING RESULTS TO CSV FILES")
-    print("="*60)
+            use_sample_data = True
+            plans = None
+        
+        print("\nQuery latency:")
+        print(engine.latency_report())
+        engine.save_latencies('query_latency.csv')
     
-    save_to_csv(query1_data, 'top_products.csv')
-    save_to_csv(query2_data, 'revenue_by_category.csv')
+    if use_sample_data:
+        query1_data, query2_data = create_sample_data()
+        print("\n" + "="*60)
+        print("SAVING SAMPLE DATA TO CSV FILES")
+        print("="*60)
+        save_to_csv(query1_data, 'top_products.csv')
+        save_to_csv(query2_data, 'revenue_by_category.csv')
+        query1_rows, query2_rows = len(query1_data), len(query2_data)
     
     # Create visualization script
     create_visualization_script()
     
     # Create documentation
-    create_query_documentation(query1_data, query2_data)
+    create_query_documentation(query1_rows, query2_rows, plans, query3_rows)
     
     # Final summary
     print("\n" + "="*70)
@@ -419,6 +470,9 @@ def main():
     print("2. revenue_by_category.csv - Category revenue data")
     print("3. visualize_results.py - Visualization script")
     print("4. query_documentation.txt - Query documentation")
+    if not use_sample_data:
+        print("5. query_latency.csv - Per-query latency")
+        print("6. daily_revenue.csv - Revenue per day")
     
     print("\n🚀 Next steps:")
     print("1. Run visualizations:")
@@ -0,0 +1,151 @@
+# benchmark_revenue_by_category.py
+"""
+Revenue by category with the $lookup into products versus the $lookup-free
+pipeline over items stamped with their category (see mongodb_denormalize.py).
+
+Synthetic transactions are written to a separate database (ecommerce_bench by
+default) with the same indexes as mongodb_ingestion.py, growing through each
+--sizes step; at every step both pipelines run --repeat times and their
+results are compared.
+
+Usage:
+    python benchmark_revenue_by_category.py                       # 500k and 5M transactions
+    python benchmark_revenue_by_category.py --sizes 100000 500000 --products-file products.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+from aggregation_queries import REVENUE_BY_CATEGORY_PIPELINE, REVENUE_BY_CATEGORY_STAMPED_PIPELINE
+from mongodb_client import MONGO_URI, QueryEngine, get_client
+from mongodb_denormalize import product_categories, stamp_categories
+from mongodb_ingestion import INDEXES
+
+BENCH_DATABASE = 'ecommerce_bench'
+SIZES = [500_000, 5_000_000]
+NUM_PRODUCTS = 10_000
+NUM_CATEGORIES = 25
+INSERT_BATCH_SIZE = 10_000
+MAX_ITEMS = 4
+START = datetime(2025, 1, 1)
+RESULTS_FILE = os.path.join('mongodb_results', 'benchmark_revenue_by_category.csv')
+
+PIPELINES = {
+    'lookup': REVENUE_BY_CATEGORY_PIPELINE,
+    'stamped': REVENUE_BY_CATEGORY_STAMPED_PIPELINE
+}
+
+def synthetic_products(count=NUM_PRODUCTS, categories=NUM_CATEGORIES, seed=42):
+    rng = np.random.default_rng(seed)
+    prices = np.round(rng.uniform(5, 500, count), 2).tolist()
+    return [{'product_id': f"prod_{i:05d}", 'category_id': f"cat_{i % categories:03d}", 'base_price': prices[i]}
+            for i in range(count)]
+
+def synthetic_transactions(rng, first, count, products, categories):
+    """`count` transactions numbered from `first`, items stamped with their categories"""
+    item_counts = rng.integers(1, MAX_ITEMS + 1, count)
+    picks = rng.integers(0, len(products), int(item_counts.sum())).tolist()
+    quantities = rng.integers(1, 4, len(picks)).tolist()
+    seconds = rng.integers(0, 180 * 86400, count).tolist()
+    transactions = []
+    position = 0
+    for i, n in enumerate(item_counts.tolist()):
+        items = []
+        for j in range(position, position + n):
+            product = products[picks[j]]
+            items.append({'product_id': product['product_id'], 'quantity': quantities[j],
+                          'unit_price': product['base_price'],
+                          'subtotal': round(product['base_price'] * quantities[j], 2)})
+        position += n
+        transaction = {'transaction_id': f"txn_bench_{first + i:09d}", 'user_id': f"user_{(first + i) % 100_000:06d}",
+                       'timestamp': START + timedelta(seconds=seconds[i]), 'items': items, 'status': 'completed'}
+        stamp_categories(transaction, categories)
+        transactions.append(transaction)
+    return transactions
+
+def grow(db, target, products, categories, rng):
+    """Insert synthetic transactions until the collection holds `target`"""
+    have = db.transactions.estimated_document_count()
+    started = time.perf_counter()
+    while have < target:
+        n = min(INSERT_BATCH_SIZE, target - have)
+        db.transactions.insert_many(synthetic_transactions(rng, have, n, products, categories), ordered=False)
+        have += n
+    return time.perf_counter() - started
+
+def summarize(rows):
+    """{category: (revenue, units)} with revenue rounded, to compare the pipelines' results"""
+    return {row['_id']: (round(row['totalRevenue'], 2), row['totalUnits']) for row in rows}
+
+def main():
+    parser = argparse.ArgumentParser(description="Time revenue by category with and without $lookup")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string (or set MONGO_URI)")
+    parser.add_argument('--database', default=BENCH_DATABASE, help="Scratch database, dropped first")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help="Transaction counts to time at")
+    parser.add_argument('--products-file', help="products.json from the generator (default: synthetic products)")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per pipeline and size")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch database afterwards")
+    args = parser.parse_args()
+
+    try:
+        client = get_client(args.uri)
+        client.admin.command('ping')
+    except PyMongoError as e:
+        print(f"Connection failed: {e}")
+        exit()
+    client.drop_database(args.database)
+    db = client[args.database]
+    engine = QueryEngine(args.uri, args.database)
+
+    if args.products_file:
+        with open(args.products_file) as f:
+            products = json.load(f)
+    else:
+        products = synthetic_products(seed=args.seed)
+    categories = product_categories(products)
+    db.products.insert_many([dict(product) for product in products])
+    for name in ('products', 'transactions'):
+        db[name].create_indexes(INDEXES[name])
+    print(f"{len(products):,} products in {len({c['category_id'] for c in categories.values()})} categories")
+
+    rng = np.random.default_rng(args.seed)
+    results = []
+    for size in sorted(args.sizes):
+        seconds = grow(db, size, products, categories, rng)
+        print(f"\n{size:,} transactions (inserted in {seconds:.1f}s)")
+        outputs = {}
+        for name, pipeline in PIPELINES.items():
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                outputs[name] = engine.fetch(f"{name} {size}", 'transactions', pipeline)
+                timings.append(time.perf_counter() - started)
+            results.append({'transactions': size, 'pipeline': name, 'median_s': round(statistics.median(timings), 3),
+                            'min_s': round(min(timings), 3), 'max_s': round(max(timings), 3)})
+            print(f"  {name:<8} median {statistics.median(timings):8.2f}s  (min {min(timings):.2f}s, "
+                  f"max {max(timings):.2f}s)")
+        same = summarize(outputs['lookup']) == summarize(outputs['stamped'])
+        lookup, stamped = (result['median_s'] for result in results[-2:])
+        print(f"  {'✅ same results' if same else '⚠ results differ'}; "
+              f"stamped is {lookup / max(stamped, 1e-9):.1f}x faster")
+
+    os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+    with open(RESULTS_FILE, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['transactions', 'pipeline', 'median_s', 'min_s', 'max_s'])
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"\n✅ Saved to {RESULTS_FILE}")
+    if not args.keep:
+        client.drop_database(args.database)
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,83 @@
 # dataset_generator.py
+"""
+Synthetic e-commerce dataset generator.
+
+Usage:
+    python dataset_generator.py [--scale-factor SF] [--workers N] [--output-dir DIR]
+    python dataset_generator.py --scale-factor 10 --estimate-only
+    python dataset_generator.py --output-dir DIR --resume
+    python dataset_generator.py --delta-from DIR --days 1 --output-dir DELTA_DIR
+"""
 import json
+import hashlib
 import random
 import datetime
 import uuid
 import threading
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
 import numpy as np
 from faker import Faker
 
+from dedup import Deduplicator, COLLISION, remove_state, session_item, transaction_item
+
 fake = Faker()
 
 # --- Configuration ---
+# Entity counts at scale factor 1 (categories do not scale)
 NUM_USERS = 10000
 NUM_PRODUCTS = 5000
 NUM_CATEGORIES = 25
 NUM_TRANSACTIONS = 500000
 NUM_SESSIONS = 2000000
 TIMESPAN_DAYS = 90
-MAX_ITERATIONS = (NUM_SESSIONS + NUM_TRANSACTIONS) * 2  # Fail-safe
+CHUNK_SIZE = 100000  # Records per output file before the writer rotates
+SHARD_SIZE = 100000  # Sessions per shard (unit of work for one process)
+BATCH_SIZE = 10000  # Session skeletons drawn per vectorized batch
+TEXT_POOL_SIZE = 5000  # Values per Faker text pool (cities, names)
+NUM_WORKERS = os.cpu_count() or 1
+SEED = 42
+CALIBRATION_SESSIONS = 2000  # Sessions generated to extrapolate size, memory and time
+MEMORY_HEADROOM = 0.8  # Fraction of available RAM the generator plans to use
+CHECKPOINT_FILE = "generation_checkpoint.json"
+STATE_FILE = "dataset_state.json"  # Where a dataset's time window ends, read by delta runs
+DELTA_SPAWN_KEY = 1  # Separates delta seeds from shard seeds
+DEDUP_DIR = "dedup"  # Bloom filter + exact id store of the dataset, carried over to its deltas
+PAGE_FLOW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "page_flow.json")
+
+DEVICE_TYPES = ["mobile", "desktop", "tablet"]
+DEVICE_OS = ["iOS", "Android", "Windows", "macOS"]
+BROWSERS = ["Chrome", "Safari", "Firefox", "Edge"]
+REFERRERS = ["direct", "email", "social", "search_engine", "affiliate"]
 
 # --- Initialization ---
-np.random.seed(42)
-random.seed(42)
-Faker.seed(42)
+def seed_everything(seed):
+    """Seed every random source used by the generator"""
+    np.random.seed(seed % 2**32)
+    random.seed(seed)
+    Faker.seed(seed)
 
-print("Initializing dataset generation...")
+def derive_seed(seed, *key):
+    """
+    Derive a shard's seed from the global seed.
+    The seed depends only on the global seed and the key (the shard index,
+    or the delta number), so a shard produces the same output no matter
+    which worker runs it or how many workers there are.
+    """
+    return int(np.random.SeedSequence(seed, spawn_key=key).generate_state(1)[0])
 
 # --- ID Generators ---
+# IDs keep the uuid4 format but draw their bits from the seeded random module,
+# so reruns with the same seed produce the same IDs.
 def generate_session_id():
-    return f"sess_{uuid.uuid4().hex[:10]}"
+    return f"sess_{uuid.UUID(int=random.getrandbits(128), version=4).hex[:10]}"
 
 def generate_transaction_id():
-    return f"txn_{uuid.uuid4().hex[:12]}"
+    return f"txn_{uuid.UUID(int=random.getrandbits(128), version=4).hex[:12]}"
 
 # --- Inventory Management ---
 class InventoryManager:
@@ -38,93 +85,144 @@ class InventoryManager:
         self.products = {p["product_id"]: p for p in products}
         self.lock = threading.RLock()  # For thread safety
 
+        # Live pool of active, in-stock products so a random pick is O(1)
+        self.sellable = []
+        self.sellable_positions = {}
+        for p in products:
+            if p["is_active"] and p["current_stock"] > 0:
+                self.sellable_positions[p["product_id"]] = len(self.sellable)
+                self.sellable.append(p)
+
     def update_stock(self, product_id, quantity):
         with self.lock:
             if product_id not in self.products:
                 return False
             if self.products[product_id]["current_stock"] >= quantity:
                 self.products[product_id]["current_stock"] -= quantity
+                if self.products[product_id]["current_stock"] == 0:
+                    self._remove_sellable(product_id)
                 return True
             return False
 
+    def _remove_sellable(self, product_id):
+        """Drop a sold-out product from the pool by swapping in the last entry"""
+        position = self.sellable_positions.pop(product_id, None)
+        if position is None:
+            return
+        last = self.sellable.pop()
+        if position < len(self.sellable):
+            self.sellable[position] = last
+            self.sellable_positions[last["product_id"]] = position
+
     def get_product(self, product_id):
         with self.lock:
             return self.products.get(product_id)
 
-# --- Helper Functions ---
-def determine_page_type(position, previous_pages):
-    """
-    Determine page type based on position in user journey and previous pages viewed.
-    """
-    if position == 0:
-        # First page is usually homepage, search or category
-        return random.choice(["home", "search", "category_listing"])
-
-    if not previous_pages:
-        return "home"
-
-    prev_page = previous_pages[-1]["page_type"]
-
-    # Define realistic page flow transitions
-    if prev_page == "home":
-        return random.choices(
-            ["category_listing", "search", "product_detail"],
-            weights=[0.5, 0.3, 0.2]
-        )[0]
-    elif prev_page == "category_listing":
-        return random.choices(
-            ["product_detail", "category_listing", "search", "home"],
-            weights=[0.7, 0.1, 0.1, 0.1]
-        )[0]
-    elif prev_page == "search":
-        return random.choices(
-            ["product_detail", "search", "category_listing", "home"],
-            weights=[0.6, 0.2, 0.1, 0.1]
-        )[0]
-    elif prev_page == "product_detail":
-        return random.choices(
-            ["product_detail", "cart", "category_listing", "search", "home"],
-            weights=[0.3, 0.3, 0.2, 0.1, 0.1]
-        )[0]
-    elif prev_page == "cart":
-        return random.choices(
-            ["checkout", "product_detail", "category_listing", "home"],
-            weights=[0.6, 0.2, 0.1, 0.1]
-        )[0]
-    elif prev_page == "checkout":
-        return random.choices(
-            ["confirmation", "cart", "home"],
-            weights=[0.8, 0.1, 0.1]
-        )[0]
-    elif prev_page == "confirmation":
-        return random.choices(
-            ["home", "product_detail", "category_listing"],
-            weights=[0.6, 0.2, 0.2]
-        )[0]
-    else:
-        return "home"
+    def random_sellable_product(self):
+        """Pick a random active, in-stock product, or None once everything is sold out"""
+        with self.lock:
+            if not self.sellable:
+                return None
+            return self.sellable[random.randrange(len(self.sellable))]
+
+class ShardInventory(InventoryManager):
+    """
+    Inventory for a single shard.
+    Every product's stock is split across the shards up front, so each shard can
+    only sell its own slice and the combined stock never goes negative, without
+    any locking between processes. Sold quantities are tracked for the final merge.
+    """
+    def __init__(self, products, shard_index, num_shards):
+        allotted = []
+        for i, p in enumerate(products):
+            share, extra = divmod(p["current_stock"], num_shards)
+            # Rotate the remainder so small stocks don't all land on shard 0
+            if (shard_index - i) % num_shards < extra:
+                share += 1
+            allotted.append({**p, "current_stock": share})
+        super().__init__(allotted)
+        self.sold = {}
+
+    def update_stock(self, product_id, quantity):
+        with self.lock:
+            if super().update_stock(product_id, quantity):
+                self.sold[product_id] = self.sold.get(product_id, 0) + quantity
+                return True
+            return False
+
+# --- Page Flow Model ---
+def load_page_flow(path=None):
+    """
+    Load the page-flow Markov model from a JSON config and compile it into
+    cumulative transition tables indexed by page-type code.
+    Config format: {"page_types": [...], "start": {page: weight},
+    "transitions": {page: {next_page: weight}}}. Pages without transitions
+    fall back to "home".
+    """
+    with open(path or PAGE_FLOW_PATH) as f:
+        config = json.load(f)
+
+    page_types = config["page_types"]
+    codes = {name: code for code, name in enumerate(page_types)}
+
+    def cumulative(weights):
+        row = np.zeros(len(page_types))
+        for name, weight in weights.items():
+            row[codes[name]] = weight
+        row = np.cumsum(row)
+        row /= row[-1]
+        row[-1] = 1.0  # Guard against float drift so every draw lands on a page
+        return row
+
+    transitions = np.array([
+        cumulative(config["transitions"].get(name) or {"home": 1})
+        for name in page_types
+    ])
+    return {
+        "page_types": page_types,
+        "start": cumulative(config["start"]),
+        "transitions": transitions
+    }
 
-def get_page_content(page_type, products_list, categories_list, inventory):
+def simulate_page_chains(rng, page_flow, page_offsets):
+    """
+    Simulate the page-type chain of every session in a batch.
+    Each step advances all sessions that are still browsing at once: one
+    uniform draw per session, looked up in its current row of the cumulative
+    transition table. Returns the page-type codes as a flat array aligned
+    with page_offsets.
+    """
+    starts = page_offsets[:-1]
+    lengths = np.diff(page_offsets)
+    codes = np.empty(page_offsets[-1], dtype=np.int64)
+    last_code = len(page_flow["page_types"]) - 1
+
+    state = np.searchsorted(page_flow["start"], rng.random(len(starts)), side="right")
+    codes[starts] = state
+    for step in range(1, int(lengths.max(initial=0))):
+        active = np.flatnonzero(lengths > step)
+        cumulative = page_flow["transitions"][state[active]]
+        state[active] = np.minimum((rng.random((len(active), 1)) >= cumulative).sum(axis=1), last_code)
+        codes[starts[active] + step] = state[active]
+    return codes
+
+def build_category_index(categories_list):
+    """Index categories by category_id for O(1) lookups"""
+    return {c["category_id"]: c for c in categories_list}
+
+def get_page_content(page_type, products_list, categories_list, inventory, category_index):
     """
     Get appropriate product and category based on page type.
     Returns active products and categories with stock.
     """
     if page_type == "product_detail":
-        # Try to find an active product with stock
-        attempts = 0
-        while attempts < 10:  # Limit attempts to avoid infinite loop
+        # Draw from the inventory's live pool of active, in-stock products
+        product = inventory.random_sellable_product()
+
+        # If everything is sold out, just return any product
+        if product is None:
             product = random.choice(products_list)
-            if product["is_active"] and product["current_stock"] > 0:
-                category_id = product["category_id"]
-                category = next((c for c in categories_list if c["category_id"] == category_id), None)
-                return product, category
-            attempts += 1
-
-        # If we couldn't find a suitable product after attempts, just return any
-        product = random.choice(products_list)
-        category_id = product["category_id"]
-        category = next((c for c in categories_list if c["category_id"] == category_id), None)
-        return product, category
+        return product, category_index.get(product["category_id"])
 
     elif page_type == "category_listing":
         category = random.choice(categories_list)
@@ -133,287 +231,550 @@ def get_page_content(page_type, products_list, categories_list, inventory):
     else:
         return None, None
 
-# --- Category Generation ---
-categories = []
-for cat_id in range(NUM_CATEGORIES):
-    category = {
-        "category_id": f"cat_{cat_id:03d}",
-        "name": fake.company(),
-        "subcategories": []
+# --- Value Pools ---
+class ValuePools:
+    """
+    Large arrays of fake values generated once up front and served by index.
+    Faker is called once per pooled value instead of once per record, and
+    fields that can be vectorized skip Faker entirely. Build time is recorded
+    per field so the slowest generators show up in the report.
+    """
+    def __init__(self):
+        self.pools = {}
+        self.stats = {}
+
+    def build(self, name, size, generate):
+        started = time.perf_counter()
+        self.pools[name] = generate(size)
+        self.stats[name] = (size, time.perf_counter() - started)
+
+    def size(self, name):
+        return len(self.pools[name])
+
+    def take(self, name, indices):
+        """Serve pool values for an array of indices"""
+        pool = self.pools[name]
+        return [pool[i] for i in indices]
+
+    def report(self):
+        print("Value pools (build throughput per field):")
+        for name, (size, elapsed) in sorted(self.stats.items(), key=lambda item: -item[1][1]):
+            rate = size / elapsed if elapsed > 0 else float("inf")
+            print(f"  {name:<16} {size:>9,} values  {elapsed:7.3f}s  {rate:>12,.0f} values/s")
+
+def build_value_pools():
+    """
+    Build the Faker text pools from the seeded Faker instance. Numeric fields
+    (IPs, timestamps) are drawn directly with the NumPy Generator instead.
+    """
+    pools = ValuePools()
+    pools.build("city", TEXT_POOL_SIZE, lambda n: [fake.city() for _ in range(n)])
+    pools.build("state", TEXT_POOL_SIZE, lambda n: [fake.state_abbr() for _ in range(n)])
+    pools.build("country", TEXT_POOL_SIZE, lambda n: [fake.country_code() for _ in range(n)])
+    pools.build("product_name", TEXT_POOL_SIZE, lambda n: [fake.catch_phrase().title() for _ in range(n)])
+
+    pools.report()
+    return pools
+
+# --- Vectorized Session Skeletons ---
+def draw_session_batch(rng, size, num_users, page_flow, window_seconds):
+    """
+    Draw the random skeleton of `size` sessions at once with a NumPy Generator:
+    users, start times (seconds into the session window), durations, page
+    timelines and page types, device profiles, referrers and IP addresses.
+    Page views of the whole batch live in flat arrays; session i owns the
+    pages page_offsets[i]:page_offsets[i+1].
+    """
+    durations = rng.integers(30, 3601, size)  # 30 sec to 1 hour
+    interior = rng.integers(3, 16, size)  # Time slots between start and end
+    page_offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(interior + 1, out=page_offsets[1:])
+
+    # Interior time slots in [1, duration-1], sorted within each session
+    slot_owner = np.repeat(np.arange(size), interior)
+    slots = rng.integers(1, durations[slot_owner])
+    slots = slots[np.lexsort((slots, slot_owner))]
+
+    # Page k of a session starts at slot k (slot 0 is the session start) and
+    # ends at slot k+1 (the last page ends with the session)
+    page_starts = np.zeros(page_offsets[-1], dtype=np.int64)
+    page_starts[np.arange(len(slots)) + slot_owner + 1] = slots
+    page_ends = np.empty_like(page_starts)
+    page_ends[:-1] = page_starts[1:]
+    page_ends[page_offsets[1:] - 1] = durations
+    page_codes = simulate_page_chains(rng, page_flow, page_offsets)
+
+    return {
+        "size": size,
+        "users": rng.integers(0, num_users, size).tolist(),
+        "start_offsets": rng.integers(0, window_seconds, size).tolist(),
+        "ip_addresses": [".".join(map(str, octets)) for octets in rng.integers(1, 255, (size, 4)).tolist()],
+        "durations": durations.tolist(),
+        "page_offsets": page_offsets.tolist(),
+        "page_starts": page_starts.tolist(),
+        "view_durations": (page_ends - page_starts).tolist(),
+        "page_types": [page_flow["page_types"][code] for code in page_codes.tolist()],
+        "device_types": rng.integers(0, len(DEVICE_TYPES), size).tolist(),
+        "device_os": rng.integers(0, len(DEVICE_OS), size).tolist(),
+        "browsers": rng.integers(0, len(BROWSERS), size).tolist(),
+        "referrers": rng.integers(0, len(REFERRERS), size).tolist()
     }
 
-    for sub_id in range(random.randint(3, 5)):
-        subcategory = {
-            "subcategory_id": f"sub_{cat_id:03d}_{sub_id:02d}",
-            "name": fake.bs(),
-            "profit_margin": round(random.uniform(0.1, 0.4), 2)
+# --- Category Generation ---
+def generate_categories():
+    categories = []
+    for cat_id in range(NUM_CATEGORIES):
+        category = {
+            "category_id": f"cat_{cat_id:03d}",
+            "name": fake.company(),
+            "subcategories": []
         }
-        category["subcategories"].append(subcategory)
 
-    categories.append(category)
+        for sub_id in range(random.randint(3, 5)):
+            subcategory = {
+                "subcategory_id": f"sub_{cat_id:03d}_{sub_id:02d}",
+                "name": fake.bs(),
+                "profit_margin": round(random.uniform(0.1, 0.4), 2)
+            }
+            category["subcategories"].append(subcategory)
+
+        categories.append(category)
 
-print(f"Generated {len(categories)} categories")
+    print(f"Generated {len(categories)} categories")
+    return categories
 
 # --- Product Generation ---
-products = []
-product_creation_start = datetime.datetime.now() - datetime.timedelta(days=TIMESPAN_DAYS*2)
-
-for prod_id in range(NUM_PRODUCTS):
-    category = random.choice(categories)
-
-    # Generate price history with 1-3 price points
-    base_price = round(random.uniform(5, 500), 2)
-    price_history = []
-
-    # Initial price
-    initial_date = fake.date_time_between(
-        start_date=product_creation_start,
-        end_date=product_creation_start + datetime.timedelta(days=TIMESPAN_DAYS//3)
-    )
-    price_history.append({
-        "price": base_price,
-        "date": initial_date.isoformat()
-    })
-
-    # Add 0-2 more price changes
-    for _ in range(random.randint(0, 2)):
-        price_change_date = fake.date_time_between(
-            start_date=initial_date,
-            end_date="now"
+def generate_products(categories, reference_time, pools, num_products=NUM_PRODUCTS):
+    products = []
+    product_creation_start = reference_time - datetime.timedelta(days=TIMESPAN_DAYS*2)
+
+    for prod_id in range(num_products):
+        category = random.choice(categories)
+
+        # Generate price history with 1-3 price points
+        base_price = round(random.uniform(5, 500), 2)
+        price_history = []
+
+        # Initial price
+        initial_date = fake.date_time_between(
+            start_date=product_creation_start,
+            end_date=product_creation_start + datetime.timedelta(days=TIMESPAN_DAYS//3)
         )
-        new_price = round(base_price * random.uniform(0.8, 1.2), 2)  # +/- 20%
         price_history.append({
-            "price": new_price,
-            "date": price_change_date.isoformat()
+            "price": base_price,
+            "date": initial_date.isoformat()
         })
-        initial_date = price_change_date
 
-    # Sort price history by date
-    price_history.sort(key=lambda x: x["date"])
+        # Add 0-2 more price changes
+        for _ in range(random.randint(0, 2)):
+            price_change_date = fake.date_time_between(
+                start_date=initial_date,
+                end_date=reference_time
+            )
+            new_price = round(base_price * random.uniform(0.8, 1.2), 2)  # +/- 20%
+            price_history.append({
+                "price": new_price,
+                "date": price_change_date.isoformat()
+            })
+            initial_date = price_change_date
+
+        # Sort price history by date
+        price_history.sort(key=lambda x: x["date"])
+
+        # Get current price (most recent in history)
+        current_price = price_history[-1]["price"]
+
+        products.append({
+            "product_id": f"prod_{prod_id:05d}",
+            "name": pools.pools["product_name"][random.randrange(pools.size("product_name"))],
+            "category_id": category["category_id"],
+            "base_price": current_price,
+            "current_stock": random.randint(10, 1000),  # Minimum stock
+            "is_active": random.choices([True, False], weights=[0.95, 0.05])[0],
+            "price_history": price_history,
+            "creation_date": price_history[0]["date"]
+        })
 
-    # Get current price (most recent in history)
-    current_price = price_history[-1]["price"]
+    print(f"Generated {len(products)} products")
+    return products
 
-    products.append({
-        "product_id": f"prod_{prod_id:05d}",
-        "name": fake.catch_phrase().title(),
-        "category_id": category["category_id"],
-        "base_price": current_price,
-        "current_stock": random.randint(10, 1000),  # Minimum stock
-        "is_active": random.choices([True, False], weights=[0.95, 0.05])[0],
-        "price_history": price_history,
-        "creation_date": price_history[0]["date"]
-    })
+# --- User Generation ---
+def generate_users(reference_time, rng, pools, num_users=NUM_USERS, first_id=0,
+                   registration_start=None, registration_end=None):
+    # Registration between 3x and 1x TIMESPAN_DAYS ago by default, last activity after registration
+    if registration_start is None:
+        registration_start = reference_time - datetime.timedelta(days=TIMESPAN_DAYS*3)
+    if registration_end is None:
+        registration_end = reference_time - datetime.timedelta(days=TIMESPAN_DAYS)
+    registration_seconds = int((registration_end - registration_start).total_seconds())
+    active_seconds = int((reference_time - registration_start).total_seconds())
+
+    reg_offsets = rng.integers(0, registration_seconds, num_users)
+    active_offsets = reg_offsets + (rng.random(num_users) * (active_seconds - reg_offsets)).astype(np.int64)
+
+    geo = {field: pools.take(field, rng.integers(0, pools.size(field), num_users).tolist())
+           for field in ("city", "state", "country")}
+
+    users = []
+    for i, (reg_offset, active_offset) in enumerate(zip(reg_offsets.tolist(), active_offsets.tolist())):
+        users.append({
+            "user_id": f"user_{first_id + i:06d}",
+            "geo_data": {
+                "city": geo["city"][i],
+                "state": geo["state"][i],
+                "country": geo["country"][i]
+            },
+            "registration_date": (registration_start + datetime.timedelta(seconds=reg_offset)).isoformat(),
+            "last_active": (registration_start + datetime.timedelta(seconds=active_offset)).isoformat()
+        })
 
-print(f"Generated {len(products)} products")
+    print(f"Generated {len(users)} users")
+    return users
 
-# --- User Generation ---
-users = []
-for user_id in range(NUM_USERS):
-    reg_date = fake.date_time_between(
-        start_date=f"-{TIMESPAN_DAYS*3}d",
-        end_date=f"-{TIMESPAN_DAYS}d"
-    )
-
-    users.append({
-        "user_id": f"user_{user_id:06d}",
-        "geo_data": {
-            "city": fake.city(),
-            "state": fake.state_abbr(),
-            "country": fake.country_code()
-        },
-        "registration_date": reg_date.isoformat(),
-        "last_active": fake.date_time_between(start_date=reg_date, end_date="now").isoformat()
-    })
-
-print(f"Generated {len(users)} users")
+# --- Sharding ---
+def plan_shards(num_sessions, num_transactions, seed=SEED, shard_size=SHARD_SIZE,
+                chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE):
+    """
+    Split the session and transaction space into fixed-size shards.
+    Shards are sized by SHARD_SIZE rather than by worker count, so the shard
+    layout (and therefore the output) is the same for any number of workers.
+    Each shard also gets a fixed range of output file numbers, so files are
+    numbered globally without the shards talking to each other.
+    Settings travel with the shard so spawned workers never depend on
+    module globals changed by the command line.
+    """
+    num_shards = max(1, -(-num_sessions // shard_size))
+    txn_share, txn_extra = divmod(num_transactions, num_shards)
+    session_files = max(1, -(-shard_size // chunk_size))
+    transaction_files = max(1, -(-(txn_share + 1) // chunk_size))
+
+    shards = []
+    for index in range(num_shards):
+        start = index * shard_size
+        shards.append({
+            "index": index,
+            "num_shards": num_shards,
+            "num_sessions": max(0, min(shard_size, num_sessions - start)),
+            "num_transactions": txn_share + (1 if index < txn_extra else 0),
+            "first_session_file": index * session_files,
+            "first_transaction_file": index * transaction_files,
+            "seed": seed,
+            "chunk_size": chunk_size,
+            "batch_size": batch_size
+        })
+    return shards
+
+# Catalogue shared with worker processes (set by init_worker)
+_catalogue = None
+
+def init_worker(catalogue):
+    """Pool initializer: receive the users/products/categories once per worker"""
+    global _catalogue
+    _catalogue = catalogue
 
 # --- Session & Transaction Generation ---
-inventory = InventoryManager(products)
-sessions = []
-transactions = []
-transaction_counter = 0
-session_counter = 0
-iteration = 0
-
-print("Generating sessions and transactions...")
-while (session_counter < NUM_SESSIONS or transaction_counter < NUM_TRANSACTIONS) and iteration < MAX_ITERATIONS:
-    iteration += 1
-
-    # Session Generation
-    if session_counter < NUM_SESSIONS:
-        user = random.choice(users)
-        session_id = generate_session_id()
-        session_start = fake.date_time_between(
-            start_date=f"-{TIMESPAN_DAYS}d",
-            end_date="now"
-        )
-        session_duration = random.randint(30, 3600)  # 30 sec to 1 hour
-
-        # Generate realistic page flow
-        page_views = []
-        viewed_products = set()
-        cart_contents = {}
-
-        # Generate page view timeline with proper time distribution
-        time_slots = sorted([0] + [random.randint(1, session_duration-1) for _ in range(random.randint(3, 15))] + [session_duration])
-
-        for i in range(len(time_slots)-1):
-            view_duration = time_slots[i+1] - time_slots[i]
-            page_type = determine_page_type(i, page_views)
-            product, category = get_page_content(page_type, products, categories, inventory)
-
-            # Track product views and cart interactions
-            if page_type == "product_detail" and product:
-                product_id = product["product_id"]
-                viewed_products.add(product_id)
-
-                # Only allow adding to cart for products that were viewed
-                if random.random() < 0.3:
-                    if product_id not in cart_contents:
-                        cart_contents[product_id] = {
-                            "quantity": 0,
-                            "price": product["base_price"]
-                        }
-
-                    # Check current stock via inventory manager
-                    max_possible = min(3, inventory.get_product(product_id)["current_stock"] - cart_contents[product_id]["quantity"])
-                    if max_possible > 0:
-                        add_qty = random.randint(1, max_possible)
-                        cart_contents[product_id]["quantity"] += add_qty
-
-            page_views.append({
-                "timestamp": (session_start + datetime.timedelta(seconds=time_slots[i])).isoformat(),
-                "page_type": page_type,
-                "product_id": product["product_id"] if product else None,
-                "category_id": category["category_id"] if category else None,
-                "view_duration": view_duration
-            })
+def generate_shard(shard):
+    """
+    Generate the sessions and transactions of one shard, streaming them to
+    sessions_N.ndjson / transactions_N.ndjson as they are produced.
+    Returns the shard's counts, the stock it sold and its (id, identity)
+    pairs for the duplicate check in the parent process.
+    """
+    seed = derive_seed(shard["seed"], shard["index"])
+    seed_everything(seed)
+    rng = np.random.default_rng(seed)
+
+    users = _catalogue["users"]
+    categories = _catalogue["categories"]
+    category_index = build_category_index(categories)
+    page_flow = _catalogue["page_flow"]
+    window_start = _catalogue["window_start"]
+    window_seconds = _catalogue["window_seconds"]
+
+    inventory = ShardInventory(_catalogue["products"], shard["index"], shard["num_shards"])
+    products = list(inventory.products.values())
+
+    num_sessions = shard["num_sessions"]
+    num_transactions = shard["num_transactions"]
+    max_iterations = (num_sessions + num_transactions) * 2  # Fail-safe
+
+    session_writer = NDJSONWriter("sessions", shard["first_session_file"], shard["chunk_size"])
+    transaction_writer = NDJSONWriter("transactions", shard["first_transaction_file"], shard["chunk_size"])
+    ids = {"sessions": [], "transactions": []}
+    transaction_counter = 0
+    session_counter = 0
+    iteration = 0
+    batch = None
+    cursor = 0
+
+    while (session_counter < num_sessions or transaction_counter < num_transactions) and iteration < max_iterations:
+        iteration += 1
+
+        # Session Generation
+        if session_counter < num_sessions:
+            # Draw the next block of session skeletons when the current one is used up
+            if batch is None or cursor == batch["size"]:
+                batch = draw_session_batch(rng, min(shard["batch_size"], num_sessions - session_counter), len(users), page_flow, window_seconds)
+                cursor = 0
+            j = cursor
+            cursor += 1
+
+            user = users[batch["users"][j]]
+            session_id = generate_session_id()
+            session_start = window_start + datetime.timedelta(seconds=batch["start_offsets"][j])
+            session_duration = batch["durations"][j]
+
+            # Generate realistic page flow
+            page_views = []
+            viewed_products = {}  # Insertion-ordered set: set order varies with each process's hash seed
+            cart_contents = {}
+
+            first_page = batch["page_offsets"][j]
+            for i in range(batch["page_offsets"][j+1] - first_page):
+                page_offset = batch["page_starts"][first_page + i]
+                view_duration = batch["view_durations"][first_page + i]
+                page_type = batch["page_types"][first_page + i]
+                product, category = get_page_content(page_type, products, categories, inventory, category_index)
+
+                # Track product views and cart interactions
+                if page_type == "product_detail" and product:
+                    product_id = product["product_id"]
+                    viewed_products[product_id] = None
+
+                    # Only allow adding to cart for products that were viewed
+                    if random.random() < 0.3:
+                        if product_id not in cart_contents:
+                            cart_contents[product_id] = {
+                                "quantity": 0,
+                                "price": product["base_price"]
+                            }
+
+                        # Check current stock via inventory manager
+                        max_possible = min(3, inventory.get_product(product_id)["current_stock"] - cart_contents[product_id]["quantity"])
+                        if max_possible > 0:
+                            add_qty = random.randint(1, max_possible)
+                            cart_contents[product_id]["quantity"] += add_qty
+
+                page_views.append({
+                    "timestamp": (session_start + datetime.timedelta(seconds=page_offset)).isoformat(),
+                    "page_type": page_type,
+                    "product_id": product["product_id"] if product else None,
+                    "category_id": category["category_id"] if category else None,
+                    "view_duration": view_duration
+                })
 
-        # Determine conversion - only if they have cart contents and viewed checkout or confirmation pages
-        converted = False
-        if cart_contents and any(p["page_type"] in ["checkout", "confirmation"] for p in page_views):
-            converted = random.random() < 0.7  # 70% chance of completing checkout if reached checkout page
-
-        # Geographic consistency - use user's geo plus random IP
-        session_geo = user["geo_data"].copy()
-        session_geo["ip_address"] = fake.ipv4()
-
-        # Build session
-        sessions.append({
-            "session_id": session_id,
-            "user_id": user["user_id"],
-            "start_time": session_start.isoformat(),
-            "end_time": (session_start + datetime.timedelta(seconds=session_duration)).isoformat(),
-            "duration_seconds": session_duration,
-            "geo_data": session_geo,
-            "device_profile": {
-                "type": random.choice(["mobile", "desktop", "tablet"]),
-                "os": random.choice(["iOS", "Android", "Windows", "macOS"]),
-                "browser": random.choice(["Chrome", "Safari", "Firefox", "Edge"])
-            },
-            "viewed_products": list(viewed_products),
-            "page_views": page_views,
-            "cart_contents": {k:v for k,v in cart_contents.items() if v["quantity"] > 0},
-            "conversion_status": "converted" if converted else "abandoned" if cart_contents else "browsed",
-            "referrer": random.choice(["direct", "email", "social", "search_engine", "affiliate"])
-        })
+            # Determine conversion - only if they have cart contents and viewed checkout or confirmation pages
+            converted = False
+            if cart_contents and any(p["page_type"] in ["checkout", "confirmation"] for p in page_views):
+                converted = random.random() < 0.7  # 70% chance of completing checkout if reached checkout page
 
-        session_counter += 1
+            # Geographic consistency - use user's geo plus random IP
+            session_geo = user["geo_data"].copy()
+            session_geo["ip_address"] = batch["ip_addresses"][j]
+
+            # Build session
+            session = {
+                "session_id": session_id,
+                "user_id": user["user_id"],
+                "start_time": session_start.isoformat(),
+                "end_time": (session_start + datetime.timedelta(seconds=session_duration)).isoformat(),
+                "duration_seconds": session_duration,
+                "geo_data": session_geo,
+                "device_profile": {
+                    "type": DEVICE_TYPES[batch["device_types"][j]],
+                    "os": DEVICE_OS[batch["device_os"][j]],
+                    "browser": BROWSERS[batch["browsers"][j]]
+                },
+                "viewed_products": list(viewed_products),
+                "page_views": page_views,
+                "cart_contents": {k:v for k,v in cart_contents.items() if v["quantity"] > 0},
+                "conversion_status": "converted" if converted else "abandoned" if cart_contents else "browsed",
+                "referrer": REFERRERS[batch["referrers"][j]]
+            }
+            session_writer.write(session)
+            ids["sessions"].append(session_item(session))
+
+            session_counter += 1
+
+            # Create transaction if converted
+            if converted and transaction_counter < num_transactions:
+                transaction_items = []
+                valid = True
+
+                # Process each item in cart
+                for prod_id, details in cart_contents.items():
+                    quantity = details["quantity"]
+                    if quantity > 0:
+                        # Attempt to update inventory
+                        if inventory.update_stock(prod_id, quantity):
+                            transaction_items.append({
+                                "product_id": prod_id,
+                                "quantity": quantity,
+                                "unit_price": details["price"],
+                                "subtotal": round(quantity * details["price"], 2)
+                            })
+                        else:
+                            # If any item's inventory update fails, mark transaction as invalid
+                            valid = False
+                            break
+
+                if valid and transaction_items:
+                    # Calculate total with possible discount
+                    subtotal = sum(item["subtotal"] for item in transaction_items)
+                    discount = 0
+                    if random.random() < 0.2:  # 20% chance of discount
+                        discount_rate = random.choice([0.05, 0.1, 0.15, 0.2])
+                        discount = round(subtotal * discount_rate, 2)
+
+                    total = round(subtotal - discount, 2)
+
+                    transaction = {
+                        "transaction_id": generate_transaction_id(),
+                        "session_id": session_id,  # Link to the session
+                        "user_id": user["user_id"],
+                        "timestamp": (session_start + datetime.timedelta(seconds=session_duration)).isoformat(),
+                        "items": transaction_items,
+                        "subtotal": subtotal,
+                        "discount": discount,
+                        "total": total,
+                        "payment_method": random.choice(["credit_card", "paypal", "apple_pay", "crypto"]),
+                        "status": "completed"
+                    }
+                    transaction_writer.write(transaction)
+                    ids["transactions"].append(transaction_item(transaction))
+                    transaction_counter += 1
+
+        # Generate additional transactions if needed
+        if transaction_counter < num_transactions and random.random() < 0.2:
+            user = random.choice(users)
+            products_in_txn = random.sample(products, k=min(3, len(products)))
 
-        # Create transaction if converted
-        if converted and transaction_counter < NUM_TRANSACTIONS:
             transaction_items = []
-            valid = True
-
-            # Process each item in cart
-            for prod_id, details in cart_contents.items():
-                quantity = details["quantity"]
-                if quantity > 0:
-                    # Attempt to update inventory
-                    if inventory.update_stock(prod_id, quantity):
+            for product in products_in_txn:
+                if product["is_active"]:
+                    quantity = random.randint(1, 3)
+                    if inventory.update_stock(product["product_id"], quantity):
                         transaction_items.append({
-                            "product_id": prod_id,
+                            "product_id": product["product_id"],
                             "quantity": quantity,
-                            "unit_price": details["price"],
-                            "subtotal": round(quantity * details["price"], 2)
+                            "unit_price": product["base_price"],
+                            "subtotal": round(quantity * product["base_price"], 2)
                         })
-                    else:
-                        # If any item's inventory update fails, mark transaction as invalid
-                        valid = False
-                        break
 
-            if valid and transaction_items:
+            if transaction_items:
                 # Calculate total with possible discount
                 subtotal = sum(item["subtotal"] for item in transaction_items)
                 discount = 0
-                if random.random() < 0.2:  # 20% chance of discount
+                if random.random() < 0.2:
                     discount_rate = random.choice([0.05, 0.1, 0.15, 0.2])
                     discount = round(subtotal * discount_rate, 2)
 
                 total = round(subtotal - discount, 2)
 
-                transactions.append({
+                transaction = {
                     "transaction_id": generate_transaction_id(),
-                    "session_id": session_id,  # Link to the session
+                    "session_id": None,  # Not linked to a specific session
                     "user_id": user["user_id"],
-                    "timestamp": (session_start + datetime.timedelta(seconds=session_duration)).isoformat(),
+                    "timestamp": (window_start + datetime.timedelta(
+                        seconds=random.randrange(window_seconds)
+                    )).isoformat(),
                     "items": transaction_items,
                     "subtotal": subtotal,
                     "discount": discount,
                     "total": total,
-                    "payment_method": random.choice(["credit_card", "paypal", "apple_pay", "crypto"]),
-                    "status": "completed"
-                })
+                    "payment_method": random.choice(["credit_card", "paypal", "bank_transfer", "gift_card"]),
+                    "status": random.choice(["completed", "processing", "shipped", "delivered"])
+                }
+                transaction_writer.write(transaction)
+                ids["transactions"].append(transaction_item(transaction))
                 transaction_counter += 1
 
-    # Generate additional transactions if needed
-    if transaction_counter < NUM_TRANSACTIONS and random.random() < 0.2:
-        user = random.choice(users)
-        products_in_txn = random.sample(products, k=min(3, len(products)))
-
-        transaction_items = []
-        for product in products_in_txn:
-            if product["is_active"]:
-                quantity = random.randint(1, 3)
-                if inventory.update_stock(product["product_id"], quantity):
-                    transaction_items.append({
-                        "product_id": product["product_id"],
-                        "quantity": quantity,
-                        "unit_price": product["base_price"],
-                        "subtotal": round(quantity * product["base_price"], 2)
-                    })
-
-        if transaction_items:
-            # Calculate total with possible discount
-            subtotal = sum(item["subtotal"] for item in transaction_items)
-            discount = 0
-            if random.random() < 0.2:
-                discount_rate = random.choice([0.05, 0.1, 0.15, 0.2])
-                discount = round(subtotal * discount_rate, 2)
-
-            total = round(subtotal - discount, 2)
-
-            transactions.append({
-                "transaction_id": generate_transaction_id(),
-                "session_id": None,  # Not linked to a specific session
-                "user_id": user["user_id"],
-                "timestamp": fake.date_time_between(
-                    start_date=f"-{TIMESPAN_DAYS}d",
-                    end_date="now"
-                ).isoformat(),
-                "items": transaction_items,
-                "subtotal": subtotal,
-                "discount": discount,
-                "total": total,
-                "payment_method": random.choice(["credit_card", "paypal", "bank_transfer", "gift_card"]),
-                "status": random.choice(["completed", "processing", "shipped", "delivered"])
-            })
-            transaction_counter += 1
+    # Publish the shard's files only once it is complete
+    session_writer.commit()
+    transaction_writer.commit()
+
+    return {
+        "index": shard["index"],
+        "sessions": session_counter,
+        "transactions": transaction_counter,
+        "sold": inventory.sold,
+        "files": session_writer.paths + transaction_writer.paths,
+        "ids": ids
+    }
 
-    # Progress update
-    if iteration % 10000 == 0:
-        print(f"Progress: {session_counter:,}/{NUM_SESSIONS:,} sessions, {transaction_counter:,}/{NUM_TRANSACTIONS:,} transactions (iteration {iteration:,})")
+def open_id_checks(counts, fresh=True, base_dir=None):
+    """
+    Deduplicators for session and transaction ids, stored in DEDUP_DIR of the
+    current (output) directory and sized for `counts`. A fresh run starts
+    empty, or from the base dataset's state for a delta (which must exist,
+    so `base_dir` is absolute); a resumed run continues its own state.
+    """
+    checks = {}
+    for kind in ("sessions", "transactions"):
+        path = os.path.join(DEDUP_DIR, f"{kind}.sqlite")
+        if fresh:
+            remove_state(path)
+            if base_dir:
+                base_path = os.path.join(base_dir, DEDUP_DIR, f"{kind}.sqlite")
+                if not os.path.exists(base_path):
+                    # Starting empty would miss every collision with the base dataset
+                    raise SystemExit(f"{base_path} not found: the base dataset has no id state "
+                                     f"(generated with --no-dedup?). Pass --no-dedup to skip the id checks.")
+                base = Deduplicator.open(base_path)
+                base.copy_to(path)
+                base.close()
+        checks[kind] = Deduplicator.open(path, capacity=max(counts[kind], 1000))
+    return checks
+
+def check_ids(id_checks, result):
+    """Run a finished shard's ids through the duplicate check and report collisions"""
+    for kind, items in result.pop("ids").items():
+        if id_checks is None:
+            continue
+        statuses = id_checks[kind].check(items)
+        collided = [key for (key, _), status in zip(items, statuses) if status == COLLISION]
+        if collided:
+            print(f"⚠ Shard {result['index']}: {len(collided):,} {kind[:-1]} id collisions (e.g. {', '.join(collided[:3])})")
+        id_checks[kind].save()
+
+def print_id_report(id_checks):
+    if id_checks is None:
+        return
+    print("ID check:")
+    for kind, dedup in id_checks.items():
+        print(f"- {kind}: {dedup.report()}")
+        dedup.close()
+
+def run_shards(shards, catalogue, workers=NUM_WORKERS, checkpoint=None, id_checks=None):
+    """
+    Run the shards on a process pool (or in-process for a single worker),
+    checking each finished shard's ids and recording it in the checkpoint as
+    it comes in.
+    """
+    if workers <= 1:
+        init_worker(catalogue)
+        results = map(generate_shard, shards)
+    else:
+        pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(catalogue,))
+        results = pool.imap_unordered(generate_shard, shards)
+
+    completed = []
+    session_total = 0
+    transaction_total = 0
+    for result in results:
+        check_ids(id_checks, result)
+        completed.append(result)
+        if checkpoint is not None:
+            checkpoint.record(result)
+        session_total += result["sessions"]
+        transaction_total += result["transactions"]
+        print(f"Progress: shard {len(completed)}/{len(shards)} done - {session_total:,} sessions, {transaction_total:,} transactions")
+
+    if workers > 1:
+        pool.close()
+        pool.join()
+
+    return sorted(completed, key=lambda r: r["index"])
 
 # --- Data Export ---
 def json_serializer(obj):
@@ -422,34 +783,487 @@ def json_serializer(obj):
         return obj.isoformat()
     raise TypeError(f"Type {type(obj)} not serializable")
 
-print("Saving datasets...")
+class NDJSONWriter:
+    """
+    Streams records to newline-delimited JSON files as they are produced,
+    rotating to the next file number every `chunk_size` records.
+    Nothing is held in memory, so peak RSS does not grow with NUM_SESSIONS.
+    Files are written as *.partial and only renamed by commit(), so an
+    interrupted shard never leaves files that look complete.
+    """
+    def __init__(self, prefix, first_file, chunk_size=None):
+        self.prefix = prefix
+        self.file_number = first_file
+        self.chunk_size = chunk_size or CHUNK_SIZE
+        self.file = None
+        self.records_in_file = 0
+        self.paths = []
+
+    def write(self, record):
+        if self.file is None or self.records_in_file >= self.chunk_size:
+            self._rotate()
+        self.file.write(json.dumps(record, default=json_serializer))
+        self.file.write("\n")
+        self.records_in_file += 1
+
+    def _rotate(self):
+        self.close()
+        path = f"{self.prefix}_{self.file_number}.ndjson"
+        self.file = open(path + ".partial", "w")
+        self.paths.append(path)
+        self.file_number += 1
+        self.records_in_file = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def commit(self):
+        self.close()
+        for path in self.paths:
+            os.replace(path + ".partial", path)
+
+# --- Checkpointing ---
+class GenerationCheckpoint:
+    """
+    Progress record of a run, rewritten atomically after every finished shard.
+    A shard's RNG state is fully determined by the seed and its index, so an
+    unfinished shard is simply regenerated from scratch on resume. The
+    checkpoint therefore holds the run settings, the finished shards with
+    their counters and files, and the stock they sold, which is all that is
+    needed to continue and produce byte-identical output.
+    """
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.completed = {}
+        self.sold = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        checkpoint = cls(path, data["settings"])
+        checkpoint.completed = {int(index): shard for index, shard in data["completed"].items()}
+        checkpoint.sold = data["sold"]
+        return checkpoint
+
+    def record(self, result):
+        self.completed[result["index"]] = {
+            "sessions": result["sessions"],
+            "transactions": result["transactions"],
+            "files": result["files"]
+        }
+        for product_id, quantity in result["sold"].items():
+            self.sold[product_id] = self.sold.get(product_id, 0) + quantity
+        self.save()
+
+    def save(self):
+        data = {"settings": self.settings, "completed": self.completed, "sold": self.sold}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(data, f, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+def file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+# --- Planning & Calibration ---
+def available_memory():
+    """Available physical memory in bytes, or None if it cannot be determined"""
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def format_bytes(num_bytes):
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if num_bytes < 1024 or unit == "TB":
+            return f"{num_bytes:,.1f} {unit}"
+        num_bytes /= 1024
+
+def calibrate(catalogue, counts, seed, num_shards):
+    """
+    Generate a small shard in a scratch directory and measure it: output
+    bytes per session and per transaction and seconds per session. The heap
+    peak of a shard is measured separately on one full skeleton batch, since
+    tracing allocations would distort the timing.
+    """
+    sessions = CALIBRATION_SESSIONS
+    transactions = max(1, round(sessions * counts["transactions"] / max(1, counts["sessions"])))
+    shard = {
+        "index": 0,
+        "num_shards": num_shards,
+        "num_sessions": sessions,
+        "num_transactions": transactions,
+        "first_session_file": 0,
+        "first_transaction_file": 0,
+        "seed": seed,
+        "chunk_size": CHUNK_SIZE,
+        "batch_size": BATCH_SIZE
+    }
 
-# Save users
-with open("users.json", "w") as f:
-    json.dump(users, f, default=json_serializer)
+    cwd = os.getcwd()
+    init_worker(catalogue)
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            started = time.perf_counter()
+            result = generate_shard(shard)
+            elapsed = time.perf_counter() - started
+            session_bytes = sum(os.path.getsize(p) for p in os.listdir(scratch) if p.startswith("sessions_"))
+            transaction_bytes = sum(os.path.getsize(p) for p in os.listdir(scratch) if p.startswith("transactions_"))
+        finally:
+            os.chdir(cwd)
+
+    tracemalloc.start()
+    ShardInventory(catalogue["products"], 0, num_shards)
+    draw_session_batch(np.random.default_rng(seed), BATCH_SIZE, len(catalogue["users"]),
+                       catalogue["page_flow"], catalogue["window_seconds"])
+    shard_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "bytes_per_session": session_bytes / max(1, result["sessions"]),
+        "bytes_per_transaction": transaction_bytes / max(1, result["transactions"]),
+        "seconds_per_session": elapsed / max(1, result["sessions"]),
+        "shard_peak": shard_peak
+    }
 
-# Save products with updated stock levels
-with open("products.json", "w") as f:
-    json.dump(list(inventory.products.values()), f, default=json_serializer)
+def plan_resources(calibration, catalogue_memory, catalogue_bytes, counts, num_shards, workers=None, chunk_size=None,
+                   auto_chunk_size=False):
+    """
+    Extrapolate output size, peak memory and run time from the calibration
+    run, and pick the worker count from the available RAM and cores (unless
+    given explicitly). Files hold CHUNK_SIZE records unless a chunk size is
+    given, or auto_chunk_size asks for one derived from the available RAM.
+    """
+    memory = available_memory()
+    cores = os.cpu_count() or 1
+    worker_peak = catalogue_memory + calibration["shard_peak"]
+
+    if workers is None:
+        workers = min(cores, num_shards)
+        if memory is not None:
+            workers = min(workers, int((memory * MEMORY_HEADROOM - catalogue_memory) // worker_peak))
+        workers = max(1, workers)
+
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+        if auto_chunk_size and memory is not None:
+            # Keep one output file loadable as Python objects (~10x its JSON size) in a tenth of RAM
+            chunk_size = min(chunk_size, max(1000, int(memory * 0.1 // (calibration["bytes_per_session"] * 10))))
+
+    output_bytes = (catalogue_bytes
+                    + calibration["bytes_per_session"] * counts["sessions"]
+                    + calibration["bytes_per_transaction"] * counts["transactions"])
+    return {
+        "workers": workers,
+        "chunk_size": chunk_size,
+        "cores": cores,
+        "available_memory": memory,
+        "output_bytes": output_bytes,
+        "peak_memory": catalogue_memory + (workers if workers > 1 else 0) * worker_peak + calibration["shard_peak"],
+        "seconds": calibration["seconds_per_session"] * counts["sessions"] / workers
+    }
 
-# Save categories
-with open("categories.json", "w") as f:
-    json.dump(categories, f, default=json_serializer)
+def print_plan(args, counts, plan, num_shards):
+    memory = format_bytes(plan["available_memory"]) if plan["available_memory"] is not None else "unknown"
+    print(f"""
+Generation plan (scale factor {args.scale_factor:g}):
+- Users: {counts['users']:,} | Products: {counts['products']:,} | Categories: {NUM_CATEGORIES}
+- Sessions: {counts['sessions']:,} | Transactions: {counts['transactions']:,}
+- Shards: {num_shards:,} x {args.shard_size:,} sessions, {plan['chunk_size']:,} records per file
+- Workers: {plan['workers']} ({plan['cores']} cores, {memory} RAM available)
+- Expected output size: ~{format_bytes(plan['output_bytes'])}
+- Expected peak memory: ~{format_bytes(plan['peak_memory'])}
+- Expected time: ~{plan['seconds'] / 60:,.1f} min
+""")
+
+# --- Command Line ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the synthetic e-commerce dataset")
+    parser.add_argument("--scale-factor", type=float, default=1.0,
+                        help="Multiplier for users, products, sessions and transactions (1 = 2M sessions)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: chosen from cores and available RAM)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help=f"Records per output file (default: {CHUNK_SIZE:,})")
+    parser.add_argument("--auto-chunk-size", action="store_true",
+                        help="Shrink the records per output file to fit the available RAM; "
+                             "the file layout then depends on the machine")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE,
+                        help="Sessions per shard; changing it changes the generated data")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--end-date", type=datetime.datetime.fromisoformat, default=None,
+                        help="End of the generated time window (ISO format, default: now)")
+    parser.add_argument("--page-flow", default=PAGE_FLOW_PATH, help="Page-flow model config (JSON)")
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--estimate-only", action="store_true",
+                        help="Print the size, memory and time estimates and exit")
+    parser.add_argument("--resume", action="store_true",
+                        help=f"Continue an interrupted run from {CHECKPOINT_FILE} in the output directory")
+    parser.add_argument("--delta-from", default=None,
+                        help="Generate an incremental delta on top of the dataset (or previous delta) in this directory")
+    parser.add_argument("--days", type=int, default=1, help="Days covered by a delta")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Skip the Bloom filter check of session / transaction ids for collisions")
+    return parser.parse_args(argv)
+
+def apply_checkpoint_settings(args, checkpoint):
+    """Restore the settings that shape the data from the checkpoint, so the resumed run matches the original"""
+    settings = checkpoint.settings
+    args.seed = settings["seed"]
+    args.scale_factor = settings["scale_factor"]
+    args.shard_size = settings["shard_size"]
+    args.chunk_size = settings["chunk_size"]
+    args.end_date = datetime.datetime.fromisoformat(settings["reference_time"])
+    if file_sha256(args.page_flow) != settings["page_flow_sha256"]:
+        raise SystemExit(f"Page-flow config {args.page_flow} changed since the checkpoint was written; cannot resume")
+
+# --- Incremental Deltas ---
+def save_state(seed, scale_factor, window_end, delta_index=0):
+    with open(STATE_FILE, "w") as f:
+        json.dump({
+            "seed": seed,
+            "scale_factor": scale_factor,
+            "window_end": window_end.isoformat(),
+            "delta_index": delta_index
+        }, f)
+
+def apply_price_changes(products, count, window_start, window_seconds, rng):
+    """Give `count` random products a new price (+/- 20%) dated inside the window"""
+    changes = []
+    if count == 0:
+        return changes
+    picks = rng.choice(len(products), size=min(count, len(products)), replace=False).tolist()
+    offsets = np.sort(rng.integers(0, window_seconds, len(picks))).tolist()
+    factors = rng.uniform(0.8, 1.2, len(picks)).tolist()
+    for index, offset, factor in zip(picks, offsets, factors):
+        product = products[index]
+        change = {
+            "product_id": product["product_id"],
+            "price": round(product["base_price"] * factor, 2),
+            "date": (window_start + datetime.timedelta(seconds=offset)).isoformat()
+        }
+        product["price_history"].append({"price": change["price"], "date": change["date"]})
+        product["base_price"] = change["price"]
+        changes.append(change)
+    return changes
 
-# Save transactions
-with open("transactions.json", "w") as f:
-    json.dump(transactions, f, default=json_serializer)
+def generate_delta(args):
+    """
+    Generate the next `args.days` days on top of an existing dataset: the
+    sessions, transactions, new users and price changes of that window only.
+    Daily volumes match the base dataset's scale factor. The updated users,
+    products (current stock and prices) and state are written alongside the
+    delta files, so the output directory can itself be the base of the next
+    delta.
+    """
+    base_dir = os.path.abspath(args.delta_from)  # Still read after changing into the output directory
+    if os.path.abspath(args.output_dir) == base_dir:
+        raise SystemExit("--output-dir must differ from --delta-from")
+
+    with open(os.path.join(base_dir, STATE_FILE)) as f:
+        state = json.load(f)
+    with open(os.path.join(base_dir, "users.json")) as f:
+        users = json.load(f)
+    with open(os.path.join(base_dir, "products.json")) as f:
+        products = json.load(f)
+    with open(os.path.join(base_dir, "categories.json")) as f:
+        categories = json.load(f)
+
+    scale_factor = state["scale_factor"]
+    delta_index = state["delta_index"] + 1
+    seed = derive_seed(state["seed"], DELTA_SPAWN_KEY, delta_index)
+    window_start = datetime.datetime.fromisoformat(state["window_end"])
+    window_end = window_start + datetime.timedelta(days=args.days)
+    window_seconds = args.days * 86400
+
+    # Daily volumes of the base dataset (users registered over 2x TIMESPAN_DAYS,
+    # products change price about once per 2x TIMESPAN_DAYS)
+    per_day = lambda total, days: round(total * scale_factor * args.days / days)
+    counts = {
+        "sessions": per_day(NUM_SESSIONS, TIMESPAN_DAYS),
+        "transactions": per_day(NUM_TRANSACTIONS, TIMESPAN_DAYS),
+        "users": per_day(NUM_USERS, TIMESPAN_DAYS * 2),
+        "price_changes": per_day(len(products) / scale_factor, TIMESPAN_DAYS * 2)
+    }
+    print(f"Generating delta {delta_index}: {window_start} to {window_end}")
+
+    seed_everything(seed)
+    rng = np.random.default_rng(seed)
+    pools = build_value_pools()
+    new_users = generate_users(window_end, rng, pools, counts["users"], first_id=len(users),
+                               registration_start=window_start, registration_end=window_end)
+    price_changes = apply_price_changes(products, counts["price_changes"], window_start, window_seconds, rng)
+
+    catalogue = {
+        "users": users + new_users,
+        "products": products,
+        "categories": categories,
+        "page_flow": load_page_flow(args.page_flow),
+        "pools": pools,
+        "window_start": window_start,
+        "window_seconds": window_seconds
+    }
+    chunk_size = args.chunk_size or CHUNK_SIZE
+    shards = plan_shards(counts["sessions"], counts["transactions"], seed, args.shard_size, chunk_size, BATCH_SIZE)
+    workers = args.workers or max(1, min(os.cpu_count() or 1, len(shards)))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    os.chdir(args.output_dir)
+    id_checks = None if args.no_dedup else open_id_checks(counts, base_dir=base_dir)
+    print(f"Generating sessions and transactions ({len(shards)} shards, {workers} workers)...")
+    results = run_shards(shards, catalogue, workers, id_checks=id_checks)
+
+    inventory = InventoryManager(products)
+    for result in results:
+        for product_id, quantity in result["sold"].items():
+            inventory.products[product_id]["current_stock"] -= quantity
+
+    print("Saving delta...")
+    # Delta files
+    with open("new_users.json", "w") as f:
+        json.dump(new_users, f, default=json_serializer)
+    with open("price_changes.json", "w") as f:
+        json.dump(price_changes, f, default=json_serializer)
+
+    # State for the next delta
+    with open("users.json", "w") as f:
+        json.dump(users + new_users, f, default=json_serializer)
+    with open("products.json", "w") as f:
+        json.dump(list(inventory.products.values()), f, default=json_serializer)
+    with open("categories.json", "w") as f:
+        json.dump(categories, f, default=json_serializer)
+    save_state(state["seed"], scale_factor, window_end, delta_index)
+
+    print(f"""
+Delta {delta_index} complete!
+- Window: {window_start} to {window_end}
+- Sessions: {sum(r['sessions'] for r in results):,} (target: {counts['sessions']:,})
+- Transactions: {sum(r['transactions'] for r in results):,} (target: {counts['transactions']:,})
+- New users: {len(new_users):,}
+- Price changes: {len(price_changes):,}
+""")
+    print_id_report(id_checks)
+
+def main(argv=None):
+    args = parse_args(argv)
+    args.page_flow = os.path.abspath(args.page_flow)  # Still read after changing into the output directory
+    if args.delta_from:
+        generate_delta(args)
+        return
+
+    checkpoint = None
+    if args.resume:
+        checkpoint_path = os.path.join(args.output_dir, CHECKPOINT_FILE)
+        if not os.path.exists(checkpoint_path):
+            raise SystemExit(f"No checkpoint found at {checkpoint_path}")
+        checkpoint = GenerationCheckpoint.load(checkpoint_path)
+        apply_checkpoint_settings(args, checkpoint)
+        print(f"Resuming from checkpoint: {len(checkpoint.completed)} shards already complete")
+
+    counts = {
+        "users": max(1, round(NUM_USERS * args.scale_factor)),
+        "products": max(1, round(NUM_PRODUCTS * args.scale_factor)),
+        "sessions": round(NUM_SESSIONS * args.scale_factor),
+        "transactions": round(NUM_TRANSACTIONS * args.scale_factor)
+    }
 
-# Save sessions in chunks
-CHUNK_SIZE = 100000
-for i in range(0, len(sessions), CHUNK_SIZE):
-    chunk = sessions[i:i+CHUNK_SIZE]
-    with open(f"sessions_{i//CHUNK_SIZE}.json", "w") as f:
-        json.dump(chunk, f, default=json_serializer)
+    print("Initializing dataset generation...")
+    seed_everything(args.seed)
+    # Fixed anchor for every "now"-relative date, shared by all shards
+    reference_time = (args.end_date or datetime.datetime.now()).replace(microsecond=0)
+
+    rng = np.random.default_rng(args.seed)
+
+    tracemalloc.start()
+    pools = build_value_pools()
+    categories = generate_categories()
+    products = generate_products(categories, reference_time, pools, counts["products"])
+    users = generate_users(reference_time, rng, pools, counts["users"])
+    catalogue_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    catalogue = {
+        "users": users,
+        "products": products,
+        "categories": categories,
+        "page_flow": load_page_flow(args.page_flow),
+        "pools": pools,
+        "window_start": reference_time - datetime.timedelta(days=TIMESPAN_DAYS),
+        "window_seconds": TIMESPAN_DAYS * 86400
+    }
+    catalogue_bytes = sum(len(json.dumps(data, default=json_serializer)) for data in (users, products, categories))
+
+    num_shards = len(plan_shards(counts["sessions"], counts["transactions"], args.seed, args.shard_size))
+    calibration = calibrate(catalogue, counts, args.seed, num_shards)
+    plan = plan_resources(calibration, catalogue_memory, catalogue_bytes, counts, num_shards,
+                          args.workers, args.chunk_size, args.auto_chunk_size)
+    print_plan(args, counts, plan, num_shards)
+    if args.estimate_only:
+        return
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    os.chdir(args.output_dir)
+    shards = plan_shards(counts["sessions"], counts["transactions"], args.seed, args.shard_size,
+                         plan["chunk_size"], BATCH_SIZE)
+
+    if checkpoint is None:
+        checkpoint = GenerationCheckpoint(CHECKPOINT_FILE, {
+            "seed": args.seed,
+            "scale_factor": args.scale_factor,
+            "shard_size": args.shard_size,
+            "chunk_size": plan["chunk_size"],
+            "reference_time": reference_time.isoformat(),
+            "page_flow_sha256": file_sha256(args.page_flow)
+        })
+        checkpoint.save()
+    else:
+        checkpoint.path = CHECKPOINT_FILE
+    pending = [shard for shard in shards if shard["index"] not in checkpoint.completed]
+
+    id_checks = None if args.no_dedup else open_id_checks(counts, fresh=not args.resume)
+    print(f"Generating sessions and transactions ({len(pending)}/{len(shards)} shards, {plan['workers']} workers)...")
+    run_shards(pending, catalogue, plan["workers"], checkpoint, id_checks)
+
+    # Apply every shard's sales to the global stock
+    inventory = InventoryManager(products)
+    for product_id, quantity in checkpoint.sold.items():
+        inventory.products[product_id]["current_stock"] -= quantity
+
+    print("Saving datasets...")
+
+    # Save users
+    with open("users.json", "w") as f:
+        json.dump(users, f, default=json_serializer)
 
-print(f"""
+    # Save products with updated stock levels
+    with open("products.json", "w") as f:
+        json.dump(list(inventory.products.values()), f, default=json_serializer)
+
+    # Save categories
+    with open("categories.json", "w") as f:
+        json.dump(categories, f, default=json_serializer)
+
+    # Sessions and transactions were already streamed out by their shards
+
+    save_state(args.seed, args.scale_factor, reference_time)
+
+    print(f"""
 Dataset generation complete!
-- Sessions: {len(sessions):,} (target: {NUM_SESSIONS:,})
-- Transactions: {len(transactions):,} (target: {NUM_TRANSACTIONS:,})
+- Sessions: {sum(r['sessions'] for r in checkpoint.completed.values()):,} (target: {counts['sessions']:,})
+- Transactions: {sum(r['transactions'] for r in checkpoint.completed.values()):,} (target: {counts['transactions']:,})
 - Remaining products: {sum(p['current_stock'] for p in inventory.products.values()):,}
-""")
\ No newline at end of file
+""")
+    print_id_report(id_checks)
+
+if __name__ == "__main__":
+    main()
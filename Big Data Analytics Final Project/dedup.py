@@ -0,0 +1,227 @@
+# dedup.py
+"""
+Duplicate and collision detection for session and transaction ids, shared by
+the dataset generator and the loaders.
+
+Every id is checked against a scalable Bloom filter (about 10 bits per id at
+the default 1% error rate). Only Bloom positives are looked up in the exact
+store, a SQLite table of id -> 63-bit fingerprint of the record (e.g. its
+user and start time), which tells the cases apart:
+
+    NEW        never seen before
+    REPEAT     same id, same fingerprint: the same record again (a rerun)
+    COLLISION  same id, different fingerprint: two records share an id
+
+The filter, the exact store and the counters live in one SQLite file, so the
+state carries over between incremental loads and generator deltas.
+
+Usage:
+    dedup = Deduplicator.open("dedup/sessions.sqlite")
+    statuses = dedup.check([session_item(s) for s in sessions])
+    print(dedup.report())
+    dedup.save()
+"""
+
+import hashlib
+import json
+import math
+import os
+import sqlite3
+
+import numpy as np
+
+NEW, REPEAT, COLLISION = 0, 1, 2
+INITIAL_CAPACITY = 1_000_000
+ERROR_RATE = 0.01
+GROWTH = 2  # Each new filter stage holds GROWTH times more ids...
+TIGHTENING = 0.5  # ...at TIGHTENING times the error rate, so the overall rate stays bounded
+LOOKUP_CHUNK = 500  # Ids per exact-store query
+CACHE_KB = 65536  # SQLite page cache for the exact store
+
+def hash_keys(keys):
+    """Two 64-bit hashes per key, for double hashing"""
+    digests = b"".join(hashlib.blake2b(key.encode(), digest_size=16).digest() for key in keys)
+    hashes = np.frombuffer(digests, dtype="<u8").reshape(-1, 2).copy()
+    hashes[:, 1] |= np.uint64(1)  # An odd step visits distinct positions
+    return hashes
+
+def fingerprint(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little") >> 1
+
+def session_item(session):
+    """(id, identity) of a session: a repeated id is only a collision if the user or start time differ"""
+    return session["session_id"], f"{session['user_id']}|{session['start_time']}"
+
+def transaction_item(transaction):
+    return transaction["transaction_id"], f"{transaction['user_id']}|{transaction['timestamp']}"
+
+def remove_state(path):
+    """Delete a saved state (the SQLite file and its WAL files)"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bits if bits is not None else np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = count
+
+    def _positions(self, hashes):
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        positions = (hashes[:, :1] + steps * hashes[:, 1:]) % np.uint64(self.num_bits)
+        return (positions >> np.uint64(3)).astype(np.int64), np.left_shift(1, positions & np.uint64(7)).astype(np.uint8)
+
+    def contains(self, hashes):
+        index, mask = self._positions(hashes)
+        return np.all(self.bits[index] & mask, axis=1)
+
+    def add(self, hashes):
+        index, mask = self._positions(hashes)
+        np.bitwise_or.at(self.bits, index.ravel(), mask.ravel())
+        self.count += len(hashes)
+
+class ScalableBloomFilter:
+    """Bloom filter stages of growing capacity, so the number of ids need not be known up front"""
+
+    def __init__(self, capacity=INITIAL_CAPACITY, error_rate=ERROR_RATE):
+        self.stages = [BloomFilter(capacity, error_rate * (1 - TIGHTENING))]
+
+    def contains(self, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for stage in self.stages:
+            found |= stage.contains(hashes)
+        return found
+
+    def add(self, hashes):
+        while len(hashes):
+            stage = self.stages[-1]
+            room = stage.capacity - stage.count
+            if room <= 0:
+                self.stages.append(BloomFilter(stage.capacity * GROWTH, stage.error_rate * TIGHTENING))
+                continue
+            stage.add(hashes[:room])
+            hashes = hashes[room:]
+
+    @property
+    def nbytes(self):
+        return sum(stage.bits.nbytes for stage in self.stages)
+
+class Deduplicator:
+    """Bloom filter in front of an exact SQLite store; see the module docstring"""
+
+    def __init__(self, path=None, capacity=INITIAL_CAPACITY, error_rate=ERROR_RATE):
+        self.path = path
+        self.bloom = ScalableBloomFilter(capacity, error_rate)
+        # Counters of this run, and totals over every run that used the saved state
+        self.stats = dict.fromkeys(("checked", "new", "repeats", "collisions", "bloom_positives", "false_positives"), 0)
+        self.totals = dict(self.stats)
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path or ":memory:")
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(f"PRAGMA cache_size=-{CACHE_KB}")
+        self.db.execute("CREATE TABLE IF NOT EXISTS ids (key TEXT PRIMARY KEY, fingerprint INTEGER) WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS bloom (stage INTEGER PRIMARY KEY, capacity INTEGER, "
+                        "error_rate REAL, count INTEGER, bits BLOB)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+
+    @classmethod
+    def open(cls, path, capacity=INITIAL_CAPACITY, error_rate=ERROR_RATE):
+        """Continue from the state saved at `path`, or start empty if there is none"""
+        dedup = cls(path, capacity, error_rate)
+        stages = dedup.db.execute("SELECT capacity, error_rate, count, bits FROM bloom ORDER BY stage").fetchall()
+        if stages:
+            dedup.bloom.stages = [BloomFilter(capacity, error_rate, np.frombuffer(bits, dtype=np.uint8).copy(), count)
+                                  for capacity, error_rate, count, bits in stages]
+            row = dedup.db.execute("SELECT value FROM meta WHERE name = 'totals'").fetchone()
+            if row:
+                dedup.totals.update(json.loads(row[0]))
+        return dedup
+
+    def _lookup(self, keys):
+        found = {}
+        for i in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[i:i + LOOKUP_CHUNK]
+            query = f"SELECT key, fingerprint FROM ids WHERE key IN ({','.join('?' * len(chunk))})"
+            found.update(self.db.execute(query, chunk).fetchall())
+        return found
+
+    def check(self, items):
+        """
+        Check (id, fingerprint source) pairs, recording the new ones. Returns a
+        NEW / REPEAT / COLLISION status per pair; within a batch, the first
+        occurrence of an id counts as the earlier record.
+        """
+        if not items:
+            return []
+        keys = [key for key, _ in items]
+        fingerprints = [fingerprint(source) for _, source in items]
+        hashes = hash_keys(keys)
+        maybe = self.bloom.contains(hashes).tolist()
+        existing = self._lookup(list({key for key, hit in zip(keys, maybe) if hit}))
+
+        statuses = []
+        batch = {}
+        new = []
+        for i, (key, print_) in enumerate(zip(keys, fingerprints)):
+            if maybe[i]:
+                self._count("bloom_positives")
+                if key not in existing:
+                    self._count("false_positives")
+            known = batch.get(key, existing.get(key))
+            if known is None:
+                batch[key] = print_
+                new.append(i)
+                statuses.append(NEW)
+            elif known == print_:
+                statuses.append(REPEAT)
+            else:
+                statuses.append(COLLISION)
+
+        # Sorted inserts keep B-tree page splits local
+        self.db.executemany("INSERT INTO ids VALUES (?, ?)", sorted((keys[i], fingerprints[i]) for i in new))
+        self.bloom.add(hashes[new])
+        self._count("checked", len(items))
+        self._count("new", len(new))
+        self._count("repeats", statuses.count(REPEAT))
+        self._count("collisions", statuses.count(COLLISION))
+        return statuses
+
+    def _count(self, name, n=1):
+        self.stats[name] += n
+        self.totals[name] += n
+
+    def save(self):
+        self.db.execute("DELETE FROM bloom")
+        self.db.executemany("INSERT INTO bloom VALUES (?, ?, ?, ?, ?)",
+                            [(i, stage.capacity, stage.error_rate, stage.count, stage.bits.tobytes())
+                             for i, stage in enumerate(self.bloom.stages)])
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('totals', ?)", (json.dumps(self.totals),))
+        self.db.commit()
+
+    def copy_to(self, path):
+        """Save and write the whole state to another file (e.g. the next delta's directory)"""
+        self.save()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        target = sqlite3.connect(path)
+        self.db.backup(target)
+        target.close()
+
+    def close(self):
+        self.db.close()
+
+    def report(self):
+        """This run's counts, plus the size of the filter over all stored ids"""
+        stats = self.stats
+        stored = self.totals["new"]
+        return (f"{stats['checked']:,} ids checked: {stats['new']:,} new, {stats['repeats']:,} repeats, "
+                f"{stats['collisions']:,} collisions; {stats['bloom_positives']:,} Bloom positives "
+                f"({stats['false_positives']:,} false, cleared by the exact check); "
+                f"{stored:,} ids stored, filter {self.bloom.nbytes / 1e6:.1f} MB "
+                f"({self.bloom.nbytes * 8 / max(stored, 1):.1f} bits/id)")
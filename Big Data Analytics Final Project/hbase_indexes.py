@@ -0,0 +1,137 @@
+# hbase_indexes.py
+"""
+Secondary index tables for the HBase 'sessions' table.
+
+Each index is its own table, named <table>_by_<index>, with one row per
+(value, session) pair:
+
+    row key   <value>|<session row key>
+    k:r       the session row key
+
+so "sessions for value V" is a prefix scan over the index followed by
+batched multi-row gets on the sessions table. The loader writes index
+rows in the same pass as the sessions (see loadsessions.py).
+
+Indexes:
+    product   product_id -> sessions that viewed it (viewed_products)
+    user      user_id -> sessions of that user
+    day       YYYY-MM-DD of start_time -> sessions started that day
+
+Usage:
+    python hbase_indexes.py --product prod_00042
+    python hbase_indexes.py --user user_000042 --columns meta geo
+    python hbase_indexes.py --day 2025-03-04 --limit 100
+"""
+
+import argparse
+import time
+
+import happybase
+
+from hbase_queries import decode_sessions
+
+HBASE_HOST = 'localhost'
+HBASE_PORT = 9090
+TABLE_NAME = 'sessions'
+SEPARATOR = b'|'
+KEY_COLUMN = b'k:r'
+INDEX_FAMILY = 'k'
+GET_BATCH_SIZE = 500  # Row keys per table.rows() call
+SCAN_BATCH_SIZE = 1000
+
+class SecondaryIndex:
+    """An index table: `extract` returns the values a session is indexed under"""
+
+    def __init__(self, name, extract):
+        self.name = name
+        self.extract = extract
+
+    def table_name(self, base_table=TABLE_NAME):
+        return f"{base_table}_by_{self.name}"
+
+    def prefix(self, value):
+        return str(value).encode() + SEPARATOR
+
+    def rows(self, session, row_key):
+        """(index row key, data) pairs for one session"""
+        return [(self.prefix(value) + row_key, {KEY_COLUMN: row_key}) for value in self.extract(session)]
+
+INDEXES = {
+    index.name: index for index in (
+        SecondaryIndex('product', lambda s: dict.fromkeys(s.get('viewed_products') or [])),
+        SecondaryIndex('user', lambda s: [s['user_id']] if s.get('user_id') else []),
+        SecondaryIndex('day', lambda s: [s['start_time'][:10]] if s.get('start_time') else [])
+    )
+}
+
+def create_index_table_commands(base_table=TABLE_NAME, names=None):
+    """HBase shell 'create' statements for the index tables"""
+    return [f"create '{INDEXES[name].table_name(base_table)}', {{NAME => '{INDEX_FAMILY}', VERSIONS => 1}}"
+            for name in (names or INDEXES)]
+
+def lookup(connection, index_name, value, base_table=TABLE_NAME, limit=None):
+    """Session row keys indexed under `value`, from one prefix scan of the index table"""
+    index = INDEXES[index_name]
+    table = connection.table(index.table_name(base_table))
+    return [data[KEY_COLUMN] for _, data in table.scan(row_prefix=index.prefix(value), columns=[KEY_COLUMN],
+                                                       limit=limit, batch_size=SCAN_BATCH_SIZE)]
+
+def fetch_sessions(connection, row_keys, base_table=TABLE_NAME, columns=None, batch_size=GET_BATCH_SIZE,
+                   decode=False):
+    """
+    Yield (row_key, data) for `row_keys` using batched multi-row gets; missing
+    rows are skipped. With decode, yield decoded sessions instead (see
+    hbase_queries.decode_sessions), each multi-row get decoded in one batch.
+    """
+    table = connection.table(base_table)
+    for i in range(0, len(row_keys), batch_size):
+        rows = table.rows(row_keys[i:i + batch_size], columns=columns)
+        yield from decode_sessions(rows) if decode else rows
+
+def find_sessions(connection, index_name, value, base_table=TABLE_NAME, columns=None, limit=None, decode=False):
+    """Index lookup resolved into session rows"""
+    return fetch_sessions(connection, lookup(connection, index_name, value, base_table, limit), base_table, columns,
+                          decode=decode)
+
+def sessions_for_product(connection, product_id, **kwargs):
+    return find_sessions(connection, 'product', product_id, **kwargs)
+
+def sessions_for_user(connection, user_id, **kwargs):
+    return find_sessions(connection, 'user', user_id, **kwargs)
+
+def sessions_on_day(connection, day, **kwargs):
+    return find_sessions(connection, 'day', day, **kwargs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up sessions through the HBase index tables")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--product')
+    group.add_argument('--user')
+    group.add_argument('--day', help="YYYY-MM-DD")
+    parser.add_argument('--host', default=HBASE_HOST)
+    parser.add_argument('--port', type=int, default=HBASE_PORT)
+    parser.add_argument('--table', default=TABLE_NAME)
+    parser.add_argument('--columns', nargs='+', help="Families or family:qualifier columns to fetch")
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--show', type=int, default=5, help="Sessions to print")
+    args = parser.parse_args()
+
+    index_name, value = next((name, getattr(args, name)) for name in ('product', 'user', 'day') if getattr(args, name))
+    connection = happybase.Connection(args.host, port=args.port)
+
+    started = time.perf_counter()
+    row_keys = lookup(connection, index_name, value, args.table, args.limit)
+    looked_up = time.perf_counter()
+    sessions = list(fetch_sessions(connection, row_keys, args.table, args.columns, decode=True))
+    fetched = time.perf_counter()
+
+    print(f"{index_name} = {value}: {len(row_keys):,} index hits in {(looked_up - started) * 1000:.1f} ms, "
+          f"{len(sessions):,} sessions fetched and decoded in {(fetched - looked_up) * 1000:.1f} ms")
+    for row_key, session in sessions[:args.show]:
+        pages = len(session['events:log']['timestamp']) if 'events:log' in session else '-'
+        print(f"  {row_key.decode()}  user={session.get('meta:user_id', '-')}  "
+              f"start={session.get('meta:start_time', '-')}  pages={pages}")
+    connection.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# hbase_queries.py
+"""
+HBase queries over Thrift with happybase, instead of `hbase shell` through docker exec.
+
+- scan() streams rows as a generator; the scanner fetches `batch_size` rows
+  per round trip, and `columns`, `filter` and `limit` are applied server-side.
+- paginate() returns rows a page at a time with a resume key, for callers that
+  page through results across requests.
+- count_rows() splits the table into key ranges (its regions, or the row-key
+  salt buckets) and counts them in parallel with key-only scans.
+- Sessions are decoded a scanner batch at a time, with the events:log cells
+  of the whole batch decoded to numpy columns in one events_codec call.
+
+Usage:
+    connection = connect()
+    table = connection.table('sessions')
+    for key, session in user_sessions(table, 'user_000042', '2025-03-01', '2025-04-01'):
+        ...
+    print(count_rows('sessions'))
+"""
+
+import concurrent.futures
+import itertools
+import time
+
+import happybase
+from happybase.util import bytes_increment
+
+from events_codec import decode_columns_many
+from hbase_rowkeys import get_codec
+
+HBASE_HOST = 'localhost'
+HBASE_PORT = 9090
+TABLE_NAME = 'sessions'
+SCAN_BATCH_SIZE = 1000  # Rows per scanner round trip
+COUNT_WORKERS = 8
+COUNT_FILTER = "FirstKeyOnlyFilter() AND KeyOnlyFilter()"  # Return only the row key for counting
+
+def connect(host=HBASE_HOST, port=HBASE_PORT, **kwargs):
+    return happybase.Connection(host, port=port, **kwargs)
+
+# --- Filters (HBase filter language) ---
+def _quote(value):
+    value = value.decode() if isinstance(value, bytes) else str(value)
+    return "'" + value.replace("'", "''") + "'"
+
+def column_value_filter(family, qualifier, value, op='=', skip_missing=True):
+    """Rows whose family:qualifier compares `op` to value (rows without the column are dropped when skip_missing)"""
+    return (f"SingleColumnValueFilter({_quote(family)}, {_quote(qualifier)}, {op}, "
+            f"{_quote('binary:' + str(value))}, {str(skip_missing).lower()}, true)")
+
+def prefix_filter(prefix):
+    return f"PrefixFilter({_quote(prefix)})"
+
+def all_of(*filters):
+    return " AND ".join(f"({f})" for f in filters if f)
+
+def any_of(*filters):
+    return " OR ".join(f"({f})" for f in filters if f)
+
+# --- Scans ---
+def scan(table, row_start=None, row_stop=None, row_prefix=None, columns=None, filter=None,
+         limit=None, batch_size=SCAN_BATCH_SIZE):
+    """Generator of (row_key, data); only `columns` are returned and `filter` runs on the region servers"""
+    return table.scan(row_start=row_start, row_stop=row_stop, row_prefix=row_prefix, columns=columns,
+                      filter=filter, limit=limit, batch_size=batch_size)
+
+def paginate(table, page_size=100, after=None, **scan_kwargs):
+    """
+    One page of rows plus the key to pass as `after` for the next page
+    (None when there are no more rows). Resuming from a key costs one seek,
+    not a re-scan of the earlier pages.
+    """
+    prefix = scan_kwargs.pop('row_prefix', None)
+    if prefix is not None:
+        # happybase rejects row_prefix together with row_start, so turn it into a key range
+        scan_kwargs.setdefault('row_start', prefix)
+        scan_kwargs['row_stop'] = bytes_increment(prefix)
+    row_start = scan_kwargs.pop('row_start', None)
+    if after is not None:
+        row_start = after + b'\x00'  # Smallest key after `after`
+    rows = list(scan(table, row_start=row_start, limit=page_size + 1,
+                     batch_size=min(page_size + 1, SCAN_BATCH_SIZE), **scan_kwargs))
+    if len(rows) > page_size:
+        return rows[:page_size], rows[page_size - 1][0]
+    return rows, None
+
+def decode_sessions(rows):
+    """
+    (row_key, session) for each (row_key, data) row, the session being a dict
+    of 'family:qualifier' -> str with events:log decoded to the page views'
+    columns (see events_codec.decode_columns). The events:log cells of all
+    the rows are decoded in one batch.
+    """
+    rows = list(rows)
+    events = iter(decode_columns_many([data[b'events:log'] for _, data in rows if b'events:log' in data]))
+    return [(row_key, {column.decode(): next(events) if column == b'events:log' else value.decode()
+                       for column, value in data.items()})
+            for row_key, data in rows]
+
+def decode_session(data):
+    """decode_sessions for one row's data"""
+    return decode_sessions([(None, data)])[0][1]
+
+def user_sessions(table, user_id, start=None, end=None, codec=None, columns=None, filter=None, limit=None,
+                  batch_size=SCAN_BATCH_SIZE):
+    """Decoded sessions of user_id with start_time in [start, end), newest first, from one range scan"""
+    codec = codec or get_codec()
+    rows = scan(table, columns=columns, filter=filter, limit=limit, batch_size=batch_size,
+                **codec.user_scan(user_id, start, end))
+    while True:
+        page = list(itertools.islice(rows, batch_size))
+        if not page:
+            return
+        yield from decode_sessions(page)
+
+def get_sessions(table, row_keys, columns=None):
+    """Decoded sessions for known row keys, in one multi-row get"""
+    return decode_sessions(table.rows(row_keys, columns=columns))
+
+# --- Parallel counts ---
+def key_ranges(table, codec=None):
+    """[start, stop) key ranges to scan in parallel: the table's regions, or the codec's split keys"""
+    try:
+        boundaries = [region['start_key'] for region in table.regions() if region['start_key']]
+    except Exception:
+        boundaries = []
+    if not boundaries:
+        boundaries = [key.encode() for key in (codec or get_codec()).split_keys()]
+    edges = [None] + sorted(boundaries) + [None]
+    return list(zip(edges[:-1], edges[1:]))
+
+def _count_range(connection_factory, table_name, row_start, row_stop, filter):
+    connection = connection_factory()
+    try:
+        table = connection.table(table_name)
+        # FirstKeyOnlyFilter would hide the cell a column-value filter tests, so filtered counts use the filter alone
+        return sum(1 for _ in scan(table, row_start=row_start, row_stop=row_stop, filter=filter or COUNT_FILTER,
+                                   batch_size=SCAN_BATCH_SIZE * 10))
+    finally:
+        connection.close()
+
+def count_rows(table_name=TABLE_NAME, host=HBASE_HOST, port=HBASE_PORT, filter=None, workers=COUNT_WORKERS,
+               ranges=None, connection_factory=None):
+    """
+    Count rows with one key-only scan per key range, `workers` at a time, each
+    on its own connection. `filter` (e.g. column_value_filter(...)) counts only
+    matching rows. `connection_factory` replaces connect(host, port), e.g. to
+    count on the stand-in (hbase_standin.py). Returns (total, per-range
+    counts, seconds).
+    """
+    started = time.perf_counter()
+    connection_factory = connection_factory or (lambda: connect(host, port))
+    if ranges is None:
+        connection = connection_factory()
+        try:
+            ranges = key_ranges(connection.table(table_name))
+        finally:
+            connection.close()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        counts = list(pool.map(lambda r: _count_range(connection_factory, table_name, r[0], r[1], filter), ranges))
+    return sum(counts), counts, time.perf_counter() - started
@@ -0,0 +1,131 @@
+# hbase_rowkeys.py
+"""
+Row-key codecs for the HBase 'sessions' table.
+
+salted (default)  <salt>|<user_id>|<reversed start_time>|<session_id>
+    salt is crc32(user_id) modulo NUM_SALT_BUCKETS, written as two digits.
+    Writes spread evenly over the pre-split regions (one per bucket), while
+    all sessions of a user stay contiguous, newest first, so "sessions of
+    user X in [a, b)" is a single short range scan.
+session_id        the raw session_id, as the first loaders wrote it
+                  (random, so user/time reads need full scans)
+
+Usage:
+    codec = get_codec("salted")
+    table.put(codec.encode(session), payload)
+    for key, data in scan_user_sessions(table, "user_000042", start, end):
+        ...
+"""
+
+import calendar
+import datetime
+import zlib
+
+NUM_SALT_BUCKETS = 16
+SEPARATOR = "|"
+MAX_TIMESTAMP = 9999999999  # Reversed timestamps are MAX_TIMESTAMP - epoch seconds, zero-padded to 10 digits
+
+def to_epoch(value):
+    """Epoch seconds (UTC) of an ISO string, datetime or number; naive times are treated as UTC"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(value.timetuple())
+
+class RowKeyCodec:
+    """Interface: build a row key from a session, and turn user/time queries into scan arguments"""
+    name = None
+    ids_share_rows = False  # Whether different sessions with the same session_id get the same row key
+
+    def encode(self, session):
+        raise NotImplementedError
+
+    def decode(self, row_key):
+        raise NotImplementedError
+
+    def user_scan(self, user_id, start=None, end=None):
+        """Keyword arguments for table.scan() covering user_id's sessions in [start, end)"""
+        raise NotImplementedError(f"The {self.name!r} row key does not support user scans")
+
+    def split_keys(self):
+        """Region split points for pre-splitting the table (none by default)"""
+        return []
+
+class SessionIdKeyCodec(RowKeyCodec):
+    name = "session_id"
+    ids_share_rows = True
+
+    def encode(self, session):
+        return str(session["session_id"]).encode()
+
+    def decode(self, row_key):
+        return {"session_id": row_key.decode()}
+
+class SaltedUserTimeKeyCodec(RowKeyCodec):
+    name = "salted"
+
+    def __init__(self, buckets=NUM_SALT_BUCKETS):
+        if not 1 <= buckets <= 100:
+            raise ValueError("buckets must be between 1 and 100 (the salt is two digits)")
+        self.buckets = buckets
+
+    def salt(self, user_id):
+        return zlib.crc32(user_id.encode()) % self.buckets
+
+    def user_prefix(self, user_id):
+        return f"{self.salt(user_id):02d}{SEPARATOR}{user_id}{SEPARATOR}"
+
+    def encode(self, session):
+        reversed_ts = MAX_TIMESTAMP - to_epoch(session["start_time"])
+        return f"{self.user_prefix(session['user_id'])}{reversed_ts:010d}{SEPARATOR}{session['session_id']}".encode()
+
+    def decode(self, row_key):
+        salt, user_id, reversed_ts, session_id = row_key.decode().split(SEPARATOR, 3)
+        start_time = datetime.datetime.fromtimestamp(MAX_TIMESTAMP - int(reversed_ts), datetime.timezone.utc)
+        return {"salt": int(salt), "user_id": user_id, "start_time": start_time.replace(tzinfo=None),
+                "session_id": session_id}
+
+    def user_scan(self, user_id, start=None, end=None):
+        """
+        Keys sort newest first, so start_time in [start, end) is the reversed
+        range [MAX - end + 1, MAX - start]; row_stop is exclusive, hence the +1.
+        """
+        prefix = self.user_prefix(user_id)
+        if start is None and end is None:
+            return {"row_prefix": prefix.encode()}
+        first = MAX_TIMESTAMP - to_epoch(end) + 1 if end is not None else 0
+        row_start = f"{prefix}{first:010d}".encode()
+        if start is None:
+            row_stop = prefix[:-1] + chr(ord(SEPARATOR) + 1)  # End of this user's keys
+        else:
+            row_stop = f"{prefix}{MAX_TIMESTAMP - to_epoch(start) + 1:010d}"
+        return {"row_start": row_start, "row_stop": row_stop.encode()}
+
+    def split_keys(self):
+        return [f"{bucket:02d}" for bucket in range(1, self.buckets)]
+
+CODECS = {codec.name: codec for codec in (SaltedUserTimeKeyCodec, SessionIdKeyCodec)}
+DEFAULT_CODEC = "salted"
+
+def get_codec(name=DEFAULT_CODEC, **kwargs):
+    try:
+        return CODECS[name](**kwargs)
+    except KeyError:
+        raise ValueError(f"Unknown row key codec {name!r}; choose from {', '.join(CODECS)}") from None
+
+def scan_user_sessions(table, user_id, start=None, end=None, codec=None, **scan_kwargs):
+    """Yield (row_key, data) for user_id's sessions with start_time in [start, end), newest first"""
+    codec = codec or get_codec()
+    return table.scan(**codec.user_scan(user_id, start, end), **scan_kwargs)
+
+def create_table_command(table_name, families, codec=None):
+    """HBase shell 'create' statement with one region per salt bucket"""
+    codec = codec or get_codec()
+    spec = ", ".join(f"{{NAME => '{family}', VERSIONS => 1}}" for family in families)
+    splits = codec.split_keys()
+    if splits:
+        spec += ", SPLITS => [" + ", ".join(f"'{key}'" for key in splits) + "]"
+    return f"create '{table_name}', {spec}"
@@ -0,0 +1,508 @@
+# hbase_standin.py
+"""
+In-process stand-in for the HBase Thrift server, serving the happybase subset
+this project uses, so the loader and queries can be benchmarked without the
+container:
+
+    Connection      tables, create_table, delete_table, table, open, close
+    ConnectionPool  connection() context manager
+    Table           put, delete, batch (put/delete/send, context manager),
+                    row, rows, scan (row_start/row_stop/row_prefix, columns,
+                    filter, limit, batch_size), families, regions
+
+Rows live in SQLite, one table per HBase table with a (row, column) primary
+key, so scans walk the keys in sorted order like a region server. The store
+is a file shared by every connection, thread and process that opens it, or
+':memory:' (shared within the process only).
+
+Latency is injected per round trip (one batch send, one get, one scanner
+batch): `latency` seconds plus `row_latency` per row. `failure_rate` makes
+that share of round trips raise TTransportException, to exercise retries.
+
+Filters: FirstKeyOnlyFilter, KeyOnlyFilter, PrefixFilter and
+SingleColumnValueFilter (binary/substring comparators), combined with AND, OR
+and parentheses. Anything else raises ValueError.
+
+Usage:
+    python hbase_standin.py --path ./data --db /tmp/standin.sqlite --latency-ms 2
+    python loadsessions.py --path ./data --standin /tmp/standin.sqlite --standin-latency-ms 2
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import math
+import os
+import queue
+import random
+import re
+import sqlite3
+import statistics
+import threading
+import time
+
+from thriftpy2.transport import TTransportException
+
+from json_stream import iter_records
+
+MEMORY = ':memory:'
+BUSY_TIMEOUT = 60  # Seconds a writer waits for another process's write to finish
+SCAN_BATCH_SIZE = 1000
+
+# --- Store ---
+class Store:
+    """One SQLite database, shared by the connections of this process that open the same path"""
+
+    _open = {}
+    _open_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False, isolation_level=None)
+        if path != MEMORY:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("CREATE TABLE IF NOT EXISTS hbase_tables (name TEXT PRIMARY KEY, families TEXT)")
+
+    @classmethod
+    def get(cls, path=MEMORY):
+        with cls._open_lock:
+            if path not in cls._open:
+                cls._open[path] = cls(path)
+            return cls._open[path]
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+def _cells_table(name):
+    return '"cells:' + name.replace('"', '""') + '"'
+
+# --- Filters ---
+FILTER_TOKENS = re.compile(r"\s*(?:(\()|(\))|(,)|(AND|OR)\b|'((?:[^']|'')*)'|(\w+)|([=!<>]=?))")
+OPERATORS = {
+    '=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b, '>=': lambda a, b: a >= b
+}
+
+class RowFilter:
+    """A parsed filter: keep(row_key, cells) decides, transform(cells) trims what is returned"""
+
+    def __init__(self, keep=None, transform=None):
+        self.keep = keep or (lambda row_key, cells: True)
+        self.transform = transform or (lambda cells: cells)
+
+def _compare(comparator, op, value):
+    kind, _, operand = comparator.partition(':')
+    operand = operand.encode()
+    if kind == 'binary':
+        return OPERATORS[op](value, operand)
+    if kind == 'substring' and op in ('=', '!='):
+        return (operand.lower() in value.lower()) == (op == '=')
+    raise ValueError(f"Unsupported comparator {comparator!r} with {op}")
+
+def _single_filter(name, args):
+    if name == 'FirstKeyOnlyFilter':
+        return RowFilter(transform=lambda cells: dict(sorted(cells.items())[:1]))
+    if name == 'KeyOnlyFilter':
+        return RowFilter(transform=lambda cells: dict.fromkeys(cells, b''))
+    if name == 'PrefixFilter':
+        prefix = args[0].encode()
+        return RowFilter(keep=lambda row_key, cells: row_key.startswith(prefix))
+    if name == 'SingleColumnValueFilter':
+        family, qualifier, op, comparator = args[:4]
+        skip_missing = len(args) > 4 and args[4].lower() == 'true'
+        column = f"{family}:{qualifier}".encode()
+
+        def keep(row_key, cells):
+            if column not in cells:
+                return not skip_missing
+            return _compare(comparator, op, cells[column])
+        return RowFilter(keep=keep)
+    raise ValueError(f"Filter {name} is not supported by the stand-in")
+
+def parse_filter(text):
+    """Parse the filter language subset above into one RowFilter"""
+    tokens = []
+    pos = 0
+    while pos < len(text.rstrip()):
+        match = FILTER_TOKENS.match(text, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"Cannot parse filter at {text[pos:]!r}")
+        opening, closing, comma, logic, quoted, word, op = match.groups()
+        pos = match.end()
+        if comma:
+            continue  # Commas only separate arguments
+        if quoted is not None:
+            tokens.append(('str', quoted.replace("''", "'")))
+        else:
+            tokens.append(('sym', opening or closing or logic or word or op))
+    tokens.append(('end', None))
+    index = 0
+
+    def at(symbol):
+        return tokens[index] == ('sym', symbol)
+
+    def take():
+        nonlocal index
+        index += 1
+        return tokens[index - 1][1]
+
+    def expect(symbol, context):
+        if not at(symbol):
+            raise ValueError(f"Expected {symbol!r} {context} in filter {text!r}")
+        take()
+
+    def expression():
+        parts = [term()]
+        while at('OR'):
+            take()
+            parts.append(term())
+        if len(parts) == 1:
+            return parts[0]
+        return RowFilter(keep=lambda row_key, cells: any(p.keep(row_key, cells) for p in parts),
+                         transform=_chain(parts))
+
+    def term():
+        parts = [factor()]
+        while at('AND'):
+            take()
+            parts.append(factor())
+        if len(parts) == 1:
+            return parts[0]
+        return RowFilter(keep=lambda row_key, cells: all(p.keep(row_key, cells) for p in parts),
+                         transform=_chain(parts))
+
+    def factor():
+        if at('('):
+            take()
+            inner = expression()
+            expect(')', "to close a group")
+            return inner
+        name = take()
+        expect('(', f"after {name}")
+        args = []
+        while not at(')'):
+            if tokens[index][0] == 'end':
+                raise ValueError(f"Unterminated arguments in filter {text!r}")
+            args.append(take())
+        take()
+        return _single_filter(name, args)
+
+    result = expression()
+    if tokens[index][0] != 'end':
+        raise ValueError(f"Unexpected {tokens[index][1]!r} in filter {text!r}")
+    return result
+
+def _chain(parts):
+    def transform(cells):
+        for part in parts:
+            cells = part.transform(cells)
+        return cells
+    return transform
+
+# --- happybase subset ---
+class Connection:
+    """happybase.Connection over a Store; host and port are accepted and ignored"""
+
+    def __init__(self, host=None, port=None, path=MEMORY, latency=0.0, row_latency=0.0, failure_rate=0.0,
+                 seed=None, autoconnect=True, **kwargs):
+        self.path = path
+        self.latency = latency
+        self.row_latency = row_latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.store = None
+        if autoconnect:
+            self.open()
+
+    def open(self):
+        self.store = Store.get(self.path)
+
+    def close(self):
+        self.store = None
+
+    def round_trip(self, rows=0):
+        """Injected network cost of one Thrift call carrying `rows` rows"""
+        if self.store is None:
+            raise TTransportException(message="Connection is closed")
+        delay = self.latency + self.row_latency * rows
+        if delay:
+            time.sleep(delay)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise TTransportException(message="Injected failure")
+
+    def tables(self):
+        return [name.encode() for name, in self.store.execute("SELECT name FROM hbase_tables ORDER BY name")]
+
+    def create_table(self, name, families):
+        if self.store.execute("SELECT 1 FROM hbase_tables WHERE name = ?", (name,)):
+            raise ValueError(f"Table {name} already exists")
+        with self.store.lock:
+            self.store.db.execute(f"CREATE TABLE {_cells_table(name)} (row BLOB, col BLOB, value BLOB, "
+                                  f"PRIMARY KEY (row, col)) WITHOUT ROWID")
+            self.store.db.execute("INSERT INTO hbase_tables VALUES (?, ?)", (name, json.dumps(sorted(families))))
+
+    def delete_table(self, name, disable=False):
+        with self.store.lock:
+            self.store.db.execute(f"DROP TABLE IF EXISTS {_cells_table(name)}")
+            self.store.db.execute("DELETE FROM hbase_tables WHERE name = ?", (name,))
+
+    def table(self, name):
+        name = name.decode() if isinstance(name, bytes) else name
+        return Table(name, self)
+
+class ConnectionPool:
+    """happybase.ConnectionPool: up to `size` connections handed out one per thread"""
+
+    def __init__(self, size, **kwargs):
+        self._queue = queue.LifoQueue(maxsize=size)
+        for _ in range(size):
+            self._queue.put(Connection(autoconnect=False, **kwargs))
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        connection = self._queue.get(timeout=timeout)
+        try:
+            if connection.store is None:
+                connection.open()
+            yield connection
+        finally:
+            self._queue.put(connection)
+
+class Batch:
+    def __init__(self, table, batch_size=None):
+        self.table = table
+        self.batch_size = batch_size
+        self.puts = {}
+        self.deletes = []
+
+    def put(self, row, data):
+        self.puts.setdefault(row, {}).update(data)
+        if self.batch_size and len(self.puts) >= self.batch_size:
+            self.send()
+
+    def delete(self, row, columns=None):
+        self.deletes.append((row, columns))
+
+    def send(self):
+        if self.puts or self.deletes:
+            self.table._mutate(self.puts, self.deletes)
+        self.puts = {}
+        self.deletes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.send()
+
+class Table:
+    def __init__(self, name, connection):
+        self.name = name
+        self.connection = connection
+        self.cells = _cells_table(name)
+
+    def families(self):
+        row = self.connection.store.execute("SELECT families FROM hbase_tables WHERE name = ?", (self.name,))
+        if not row:
+            raise ValueError(f"Table {self.name} does not exist")
+        return {family.encode(): {} for family in json.loads(row[0][0])}
+
+    def regions(self):
+        return [{'start_key': b'', 'end_key': b'', 'name': self.name.encode(), 'id': 0}]
+
+    def _mutate(self, puts, deletes):
+        families = self.families()
+        for data in puts.values():
+            for column in data:
+                if column.split(b':', 1)[0] not in families:
+                    raise ValueError(f"Column family of {column!r} does not exist in table {self.name}")
+        self.connection.round_trip(len(puts) + len(deletes))
+        store = self.connection.store
+        with store.lock:
+            store.db.execute("BEGIN IMMEDIATE")
+            try:
+                for row, columns in deletes:
+                    if columns is None:
+                        store.db.execute(f"DELETE FROM {self.cells} WHERE row = ?", (row,))
+                    else:
+                        store.db.executemany(f"DELETE FROM {self.cells} WHERE row = ? AND col = ?",
+                                             [(row, column) for column in columns])
+                store.db.executemany(f"INSERT OR REPLACE INTO {self.cells} VALUES (?, ?, ?)",
+                                     [(row, column, value) for row, data in puts.items()
+                                      for column, value in data.items()])
+                store.db.execute("COMMIT")
+            except BaseException:
+                store.db.execute("ROLLBACK")
+                raise
+
+    def batch(self, batch_size=None, **kwargs):
+        return Batch(self, batch_size)
+
+    def put(self, row, data):
+        self._mutate({row: data}, [])
+
+    def delete(self, row, columns=None):
+        self._mutate({}, [(row, columns)])
+
+    def _read(self, rows_sql, params):
+        """{row: {column: value}} for the rows selected by `rows_sql`, in key order"""
+        result = {}
+        for row, column, value in self.connection.store.execute(
+                f"SELECT row, col, value FROM {self.cells} WHERE row IN ({rows_sql}) ORDER BY row, col", params):
+            result.setdefault(row, {})[column] = value
+        return result
+
+    @staticmethod
+    def _project(cells, columns):
+        if not columns:
+            return cells
+        wanted = [column if b':' in column else column + b':' for column in
+                  (c.encode() if isinstance(c, str) else c for c in columns)]
+        return {column: value for column, value in cells.items()
+                if any(column == w or (w.endswith(b':') and column.startswith(w)) for w in wanted)}
+
+    def row(self, row, columns=None):
+        self.connection.round_trip(1)
+        cells = self._read("?", (row,)).get(row, {})
+        return self._project(cells, columns)
+
+    def rows(self, rows, columns=None):
+        rows = list(rows)
+        self.connection.round_trip(len(rows))
+        found = {}
+        for i in range(0, len(rows), 500):
+            chunk = rows[i:i + 500]
+            found.update(self._read(','.join('?' * len(chunk)), chunk))
+        return [(row, self._project(found[row], columns)) for row in rows if row in found]
+
+    def scan(self, row_start=None, row_stop=None, row_prefix=None, columns=None, filter=None, limit=None,
+             batch_size=SCAN_BATCH_SIZE, **kwargs):
+        """Generator of (row_key, data) in key order, fetched `batch_size` rows per round trip"""
+        if row_prefix is not None:
+            if row_start is not None or row_stop is not None:
+                raise TypeError("'row_prefix' cannot be combined with 'row_start' or 'row_stop'")
+            row_start = row_prefix
+            row_stop = _increment(row_prefix)
+        row_filter = parse_filter(filter) if filter else None
+        start = row_start or b''
+        returned = 0
+        while limit is None or returned < limit:
+            stop_sql, params = ("AND row < ?", (start, row_stop)) if row_stop else ("", (start,))
+            page = self._read(f"SELECT DISTINCT row FROM {self.cells} WHERE row >= ? {stop_sql} ORDER BY row "
+                              f"LIMIT {batch_size}", params)
+            self.connection.round_trip(len(page))
+            for row, cells in page.items():
+                if row_filter is not None:
+                    if not row_filter.keep(row, cells):
+                        continue
+                    cells = row_filter.transform(cells)
+                yield row, self._project(cells, columns)
+                returned += 1
+                if limit is not None and returned >= limit:
+                    return
+            if len(page) < batch_size:
+                return
+            start = row + b'\x00'
+
+def _increment(prefix):
+    """Smallest key greater than every key starting with `prefix` (None if there is none)"""
+    stripped = prefix.rstrip(b'\xff')
+    return stripped[:-1] + bytes([stripped[-1] + 1]) if stripped else None
+
+# --- Benchmark ---
+def _timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return result, timings
+
+def _summary(timings):
+    ms = sorted(t * 1000 for t in timings)
+    return f"median {statistics.median(ms):.1f} ms, p95 {ms[math.ceil(0.95 * len(ms)) - 1]:.1f} ms"
+
+def main():
+    # Imported here: loadsessions and hbase_queries import happybase at module level
+    import hbase_indexes
+    import hbase_queries
+    import loadsessions
+    from hbase_rowkeys import get_codec
+
+    parser = argparse.ArgumentParser(description="Load sessions into the HBase stand-in and time the queries")
+    parser.add_argument('--path', required=True, help="Directory with sessions_*.json / sessions_*.ndjson")
+    parser.add_argument('--db', default=MEMORY, help="SQLite file for the store (default: in memory)")
+    parser.add_argument('--limit-files', type=int, help="Load only the first N session files")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Injected latency per round trip")
+    parser.add_argument('--row-latency-us', type=float, default=0.0, help="Injected latency per row sent or received")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Share of load round trips that fail")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--indexes', nargs='*', choices=sorted(hbase_indexes.INDEXES),
+                        default=sorted(hbase_indexes.INDEXES))
+    parser.add_argument('--repeat', type=int, default=20, help="Runs per timed query")
+    args = parser.parse_args()
+
+    if args.db != MEMORY and os.path.exists(args.db):
+        os.remove(args.db)
+    settings = dict(path=args.db, latency=args.latency_ms / 1000, row_latency=args.row_latency_us / 1e6,
+                    failure_rate=args.failure_rate, seed=args.seed)
+    connection = Connection(**settings)
+    codec = get_codec()
+    connection.create_table(hbase_queries.TABLE_NAME, {f: {} for f in ('meta', 'geo', 'device', 'stats', 'events')})
+    for name in args.indexes:
+        connection.create_table(hbase_indexes.INDEXES[name].table_name(), {hbase_indexes.INDEX_FAMILY: {}})
+
+    # 1. Load
+    file_paths = loadsessions.find_session_files(args.path)[:args.limit_files]
+    batcher = loadsessions.AdaptiveBatcher()
+    index_writers = [(hbase_indexes.INDEXES[name], loadsessions.AdaptiveBatcher(
+        connection.table(hbase_indexes.INDEXES[name].table_name()))) for name in args.indexes]
+    started = time.perf_counter()
+    rows = sum(loadsessions.load_file(connection.table(hbase_queries.TABLE_NAME), file_path, batcher=batcher,
+                                      codec=codec, index_writers=index_writers) for file_path in file_paths)
+    seconds = time.perf_counter() - started
+    print(f"Load: {rows:,} sessions from {len(file_paths)} files in {seconds:.1f}s "
+          f"({rows / max(seconds, 1e-9):,.0f} rows/s)")
+    print(f"  Flushes: {batcher.histogram.summary()}; {batcher.retries} retries; final batch size {batcher.batch_size:,}")
+
+    # 2. Queries (without injected failures: unlike the loader they do not retry), on values from the loaded data
+    settings['failure_rate'] = 0.0
+    connection = Connection(**settings)
+    table = connection.table(hbase_queries.TABLE_NAME)
+    sample = [session for _, session in zip(range(args.repeat),
+                                            iter_records(file_paths[0]))] if file_paths else []
+    if not sample:
+        return
+    users = itertools.cycle(session['user_id'] for session in sample)
+    print("\nQueries:")
+
+    _, timings = _timed(lambda: list(hbase_queries.user_sessions(table, next(users), codec=codec)), args.repeat)
+    print(f"  user_sessions (range scan):      {_summary(timings)}")
+
+    _, timings = _timed(lambda: hbase_queries.paginate(table, page_size=100, columns=[b'meta']), args.repeat)
+    print(f"  paginate, 100 rows of meta:      {_summary(timings)}")
+
+    factory = lambda: Connection(**settings)
+    (total, ranges, _), timings = _timed(lambda: hbase_queries.count_rows(connection_factory=factory),
+                                         max(1, args.repeat // 10))
+    print(f"  count_rows, {len(ranges)} ranges:           {_summary(timings)} ({total:,} rows)")
+
+    mobile = hbase_queries.column_value_filter('device', 'type', 'mobile')
+    (total, _, _), timings = _timed(lambda: hbase_queries.count_rows(filter=mobile, connection_factory=factory),
+                                    max(1, args.repeat // 10))
+    print(f"  count_rows, mobile filter:       {_summary(timings)} ({total:,} rows)")
+
+    if 'day' in args.indexes:
+        day = sample[0]['start_time'][:10]
+        found, timings = _timed(lambda: list(hbase_indexes.sessions_on_day(connection, day, columns=[b'meta'])),
+                                max(1, args.repeat // 4))
+        print(f"  sessions_on_day via index:       {_summary(timings)} ({len(found):,} sessions)")
+
+if __name__ == "__main__":
+    main()
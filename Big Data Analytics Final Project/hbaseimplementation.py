@@ -1,18 +1,31 @@
-# hbase_docker_commands.py
+# hbaseimplementation.py
 """
-HBase Implementation using Docker commands
-No Python connection needed - just Docker exec
+HBase Implementation over Thrift (happybase)
+Creates the tables, inserts sample sessions and runs the queries from Python;
+docker is only used to start the container and for the pre-split create,
+which the Thrift API cannot express.
 """
 
 import subprocess
 import time
 
-print("HBase Implementation - Using Docker Commands")
+from events_codec import encode_many
+from hbase_indexes import INDEXES, INDEX_FAMILY
+from hbase_queries import column_value_filter, connect, count_rows, scan, user_sessions
+from hbase_rowkeys import create_table_command, get_codec
+from loadsessions import session_to_payload
+
+TABLE_NAME = 'sessions'
+FAMILIES = ['meta', 'geo', 'device', 'stats', 'events']
+
+codec = get_codec()  # Salted user/time row keys, the same scheme loadsessions.py writes
+
+print("HBase Implementation - Using happybase")
 print("=" * 50)
 
 # 1. Start HBase if not running
 print("\n1. Checking HBase container...")
-result = subprocess.run("docker ps --filter name=hbase --format '{{.Names}}'", 
+result = subprocess.run("docker ps --filter name=hbase --format '{{.Names}}'",
                        shell=True, capture_output=True, text=True)
 
 if "hbase" not in result.stdout:
@@ -20,57 +33,71 @@ if "hbase" not in result.stdout:
     subprocess.run("docker start hbase", shell=True)
     time.sleep(30)  # Wait for startup
 
-# 2. Create sessions table
-print("\n2. Creating sessions table...")
-create_table = '''
-create 'sessions', 
-  {NAME => 'meta', VERSIONS => 1},
-  {NAME => 'geo', VERSIONS => 1},
-  {NAME => 'device', VERSIONS => 1}
-'''
-subprocess.run(f'docker exec hbase hbase shell <<< "{create_table}"', shell=True)
+connection = connect()
+
+# 2. Create sessions table, pre-split with one region per salt bucket
+print("\n2. Creating tables...")
+existing = {name.decode() for name in connection.tables()}
+if TABLE_NAME not in existing:
+    # Thrift's createTable takes no split keys, so this one statement still goes through the shell
+    create_table = create_table_command(TABLE_NAME, FAMILIES, codec)
+    subprocess.run(f'docker exec hbase hbase shell <<< "{create_table}"', shell=True)
+
+# Index tables maintained by loadsessions.py (product / user / day -> session row keys)
+for index in INDEXES.values():
+    if index.table_name(TABLE_NAME) not in existing:
+        connection.create_table(index.table_name(TABLE_NAME), {INDEX_FAMILY: dict(max_versions=1)})
+print(f"Tables: {', '.join(sorted(name.decode() for name in connection.tables()))}")
 
 # 3. Insert sample data
 print("\n3. Inserting sample sessions...")
-insert_data = '''
-put "sessions", "user_000042_001", "meta:user_id", "user_000042"
-put "sessions", "user_000042_001", "meta:session_id", "sess_001"
-put "sessions", "user_000042_001", "device:type", "mobile"
-put "sessions", "user_000042_001", "geo:country", "US"
-
-put "sessions", "user_000042_002", "meta:user_id", "user_000042"
-put "sessions", "user_000042_002", "meta:session_id", "sess_002"
-put "sessions", "user_000042_002", "device:type", "desktop"
-put "sessions", "user_000042_002", "geo:country", "US"
-
-put "sessions", "user_000173_001", "meta:user_id", "user_000173"
-put "sessions", "user_000173_001", "meta:session_id", "sess_003"
-put "sessions", "user_000173_001", "device:type", "tablet"
-put "sessions", "user_000173_001", "geo:country", "UK"
-'''
-subprocess.run(f'docker exec hbase hbase shell <<< "{insert_data}"', shell=True)
-
-# 4. Run queries and capture output
+sample_sessions = [
+    {"session_id": "sess_001", "user_id": "user_000042", "start_time": "2025-03-01T10:15:00",
+     "device_profile": {"type": "mobile"}, "geo_data": {"country": "US"}, "viewed_products": ["prod_00012"],
+     "page_views": [{"timestamp": "2025-03-01T10:15:00", "page_type": "product_detail", "product_id": "prod_00012",
+                     "category_id": "cat_001", "view_duration": 45}]},
+    {"session_id": "sess_002", "user_id": "user_000042", "start_time": "2025-03-04T18:40:00",
+     "device_profile": {"type": "desktop"}, "geo_data": {"country": "US"}, "viewed_products": [], "page_views": []},
+    {"session_id": "sess_003", "user_id": "user_000173", "start_time": "2025-03-02T09:05:00",
+     "device_profile": {"type": "tablet"}, "geo_data": {"country": "UK"}, "viewed_products": [], "page_views": []}
+]
+table = connection.table(TABLE_NAME)
+events = encode_many([session["page_views"] for session in sample_sessions])
+with table.batch() as batch:
+    for session, encoded in zip(sample_sessions, events):
+        row_key = codec.encode(session)
+        batch.put(row_key, session_to_payload(session, encoded))
+        for index in INDEXES.values():
+            index_table = connection.table(index.table_name(TABLE_NAME))
+            for index_key, data in index.rows(session, row_key):
+                index_table.put(index_key, data)
+
+# 4. Run queries
 print("\n4. Running queries...")
 
-print("\n--- QUERY 1: Get all sessions ---")
-result = subprocess.run('docker exec hbase hbase shell <<< "scan \'sessions\'"', 
-                       shell=True, capture_output=True, text=True)
-print(result.stdout[:500])  # First 500 characters
+print("\n--- QUERY 1: First sessions (meta and device columns only) ---")
+for row_key, data in scan(table, columns=[b'meta', b'device'], limit=5):
+    print(f"  {row_key.decode()}: {data[b'meta:user_id'].decode()} on {data[b'device:type'].decode()}")
 
-print("\n--- QUERY 2: Get sessions for user_000042 ---")
-result = subprocess.run('docker exec hbase hbase shell <<< "scan \'sessions\', {FILTER => \\"PrefixFilter(\\'user_000042\\')\\""}"',
-                       shell=True, capture_output=True, text=True)
-print(result.stdout[:500])
+print("\n--- QUERY 2: Get sessions for user_000042 in March 2025 ---")
+user_results = list(user_sessions(table, 'user_000042', '2025-03-01T00:00:00', '2025-04-01T00:00:00',
+                                  columns=[b'meta', b'events']))
+for row_key, session in user_results:
+    print(f"  {session['meta:session_id']} started {session['meta:start_time']}, {len(session['events:log']['timestamp'])} page views")
 
-print("\n--- QUERY 3: Count total sessions ---")
-result = subprocess.run('docker exec hbase hbase shell <<< "count \'sessions\'"',
-                       shell=True, capture_output=True, text=True)
-print(result.stdout[:200])
+print("\n--- QUERY 3: Count total sessions (parallel key-range scans) ---")
+total, per_range, seconds = count_rows(TABLE_NAME)
+print(f"  {total:,} sessions across {len(per_range)} key ranges in {seconds:.2f}s")
+
+print("\n--- QUERY 4: Count mobile sessions (server-side filter) ---")
+mobile, _, seconds = count_rows(TABLE_NAME, filter=column_value_filter('device', 'type', 'mobile'))
+print(f"  {mobile:,} mobile sessions in {seconds:.2f}s")
+
+connection.close()
 
 print("\n✅ HBase Implementation Complete!")
 print("\nFor your report:")
-print("- Table: 'sessions' created with 3 column families")
-print("- Data: 3 sample sessions inserted")
-print("- Query: Used PrefixFilter to get user_000042 sessions")
-print("- Result: Retrieved 2 sessions for user_000042")
\ No newline at end of file
+print(f"- Table: 'sessions' created with {len(FAMILIES)} column families, pre-split into {codec.buckets} regions")
+print(f"- Data: {len(sample_sessions)} sample sessions inserted under salted user/time row keys")
+print("- Query: Used a row-key range scan to get user_000042 sessions")
+print(f"- Result: Retrieved {len(user_results)} sessions for user_000042")
@@ -0,0 +1,101 @@
+# json_stream.py
+"""
+Streaming readers for the generator's JSON output, shared by the HBase and
+MongoDB loaders: JSON array files are decoded element by element and NDJSON
+files line by line, optionally over a byte range, so no file is read whole.
+
+A work unit is (path, start, end, resume): start and end are None for a
+whole file, or the byte range of an NDJSON file; resume is the last
+committed position of an earlier run (see iter_unit).
+"""
+
+import json
+import os
+
+READ_SIZE = 1 << 20  # Bytes read from disk per step of the streaming parser
+
+def iter_records(file_path):
+    """
+    Yield records one at a time from a JSON array file or an NDJSON file.
+    The file is read in READ_SIZE blocks and decoded incrementally, so only
+    the current block is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r') as f:
+        buffer = f.read(READ_SIZE)
+        pos = len(buffer) - len(buffer.lstrip())
+        in_array = buffer[pos:pos + 1] == '['
+        if in_array:
+            pos += 1
+        eof = not buffer
+
+        while True:
+            # Skip whitespace (and commas between array elements)
+            while pos < len(buffer) and (buffer[pos].isspace() or (in_array and buffer[pos] == ',')):
+                pos += 1
+            if pos < len(buffer) and in_array and buffer[pos] == ']':
+                return
+
+            if pos < len(buffer):
+                try:
+                    record, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    record = None  # Value continues in the next block
+                if record is not None:
+                    yield record
+                    pos = end
+                    continue
+            elif eof:
+                if in_array:
+                    raise ValueError(f"Unterminated JSON array in {file_path}")
+                return
+
+            # Need more data: keep the unparsed tail and read the next block
+            chunk = f.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+def iter_records_range(file_path, start, end, positions=False):
+    """
+    Yield the records of an NDJSON file whose lines start inside [start, end).
+    Adjacent ranges therefore split the file at line boundaries without
+    overlap, wherever the byte offsets fall. With `positions`, yield
+    (record, offset just past its line) pairs instead.
+    """
+    with open(file_path, 'rb') as f:
+        if start > 0:
+            # Skip the line that straddles `start`; it belongs to the previous range
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield (json.loads(line), f.tell()) if positions else json.loads(line)
+
+def iter_unit(unit):
+    """
+    (record, position) pairs of a work unit: (path, None, None, skip) for a
+    whole JSON array file, where position counts records, or
+    (path, start, end, resume) for an NDJSON byte range, where position is
+    the byte offset past the record's line. `skip` / `resume` continue
+    after an earlier run's last committed position.
+    """
+    file_path, start, end, resume = unit
+    if start is None:
+        skip = resume or 0
+        return ((record, i + 1) for i, record in enumerate(iter_records(file_path)) if i >= skip)
+    return iter_records_range(file_path, max(start, resume or 0), end, positions=True)
+
+def describe(unit):
+    file_path, start, end = unit[:3]
+    name = os.path.basename(file_path)
+    name = name if start is None else f"{name}[{start:,}:{end:,}]"
+    resume = unit[3] if len(unit) > 3 else None
+    if resume and resume != start:
+        name += f" (resuming at {'record' if start is None else 'byte'} {resume:,})"
+    return name
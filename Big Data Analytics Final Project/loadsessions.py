@@ -1,52 +1,795 @@
+"""
+Load generated sessions into the HBase 'sessions' table.
+
+Usage:
+    python loadsessions.py [--path DIR] [--processes N] [--threads N] [--host HOST] [--port PORT] [--row-key salted]
+
+Progress is recorded in a manifest (load_manifest.json in --path by default)
+after every flushed batch, so rerunning the same command after a failure
+skips finished files and resumes partial ones where they stopped.
+
+With the session_id row key, where two sessions sharing an id would share a
+row, every session id is checked before loading against the saved dedup
+state (dedup/hbase_sessions.sqlite in --path by default, see dedup.py).
+Sessions that reuse an id with a different user or start time are reported,
+and left out with --on-collision skip (which also turns the check on for the
+salted key). Each file's result is kept in the manifest, so a rerun only
+checks files it has not seen. The state belongs to the manifest: it is
+cleared whenever a new manifest is started (--fresh, or no manifest yet), so
+ids from an earlier dataset never count against a new one.
+
+With --standin DB the sessions go to the in-process HBase stand-in
+(hbase_standin.py) instead of a server, for benchmarks without the container.
+"""
 import happybase
+import hbase_standin
+import argparse
+import bisect
+import hashlib
 import json
 import os
 import glob
+import queue
+import threading
+import time
+import multiprocessing
+import re
+from thriftpy2.thrift import TException
+
+from dedup import COLLISION, Deduplicator, remove_state, session_item
+from events_codec import encode_many
+from hbase_indexes import INDEX_FAMILY, INDEXES
+from hbase_rowkeys import CODECS, DEFAULT_CODEC, get_codec
+from json_stream import READ_SIZE, describe, iter_records, iter_unit
 
-# 1. Connect to HBase (Ensure container is running and port 9090 is open)
-try:
-    connection = happybase.Connection('localhost', port=9090)
-    connection.open()
-    table = connection.table('sessions')
-    print("Connected to HBase successfully!")
-except Exception as e:
-    print(f"Connection failed: {e}")
-    exit()
-
-# 2. Path to your 20 session files
+HBASE_HOST = 'localhost'
+HBASE_PORT = 9090
+TABLE_NAME = 'sessions'
+WRITE_BATCH_SIZE = 1000  # Initial puts per flush; adapted from flush latency while loading
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 20000
+MAX_BATCH_BYTES = 8 << 20  # Flush early when the buffered puts reach this many bytes
+TARGET_FLUSH_LATENCY = 0.25  # Seconds; batches grow while flushes are faster than this and shrink when slower
+MAX_RETRIES = 5  # Attempts per batch after the first, on Thrift/socket errors
+BACKOFF_BASE = 0.5  # Seconds before the first retry, doubled on each further retry
+MAX_BACKOFF = 30
+ENCODE_BATCH_SIZE = 500  # Sessions whose page views are encoded together (see events_codec.py)
+PARSE_QUEUE_SIZE = 10000  # Sessions buffered between the parser thread and the HBase writer
+RANGE_SIZE = 64 << 20  # NDJSON files larger than this are split into byte ranges
+MANIFEST_FILE = 'load_manifest.json'
+DEDUP_STATE = os.path.join('dedup', 'hbase_sessions.sqlite')
+DEDUP_CHUNK = 50000  # Ids per Deduplicator.check call in the pre-pass
+SIZE_SAMPLE = 100  # Sessions read to estimate the bytes per session of the input
+RESULT_TIMEOUT = 10  # Seconds without a worker message before checking that the workers are still alive
+NUM_PROCESSES = os.cpu_count() or 1
+THREADS_PER_PROCESS = 2
+
+# Path to your session files (JSON arrays or NDJSON shards from the generator)
 project_path = r'C:\Users\nicolas.shyaka\Documents\Personal\AUCA\Big Data Analytics Final Project'
-json_files = glob.glob(os.path.join(project_path, 'sessions_*.json'))
 
-# 3. Process each file
-for file_path in json_files:
-    print(f"Processing {os.path.basename(file_path)}...")
-    with open(file_path, 'r') as f:
+# The generator writes these three fields first on every NDJSON line
+SESSION_KEYS = re.compile(rb'^\{"session_id": "([^"]*)", "user_id": "([^"]*)", "start_time": "([^"]*)"')
+
+def iter_session_items(file_path):
+    """
+    session_item() of every session in a file. NDJSON lines are matched with
+    SESSION_KEYS instead of being decoded, falling back to json.loads for
+    lines in another layout; JSON array files are parsed in full.
+    """
+    if file_path.endswith('.json'):
+        yield from (session_item(session) for session in iter_records(file_path))
+        return
+    with open(file_path, 'rb') as f:
+        for line in f:
+            match = SESSION_KEYS.match(line)
+            if match:
+                session_id, user_id, start_time = (value.decode() for value in match.groups())
+                yield session_id, f"{user_id}|{start_time}"
+            elif line.strip():
+                yield session_item(json.loads(line))
+
+def find_collisions(file_paths, dedup):
+    """
+    Check every session id against `dedup` (recording the new ones) and
+    return {session_id: identities} for the sessions whose id already
+    belongs to another session; the first session seen keeps the id.
+    """
+    collisions = {}
+    for file_path in file_paths:
+        items = []
+        for item in iter_session_items(file_path):
+            items.append(item)
+            if len(items) >= DEDUP_CHUNK:
+                _record_collisions(dedup, items, collisions)
+        _record_collisions(dedup, items, collisions)
+    return collisions
+
+def _record_collisions(dedup, items, collisions):
+    for (session_id, identity), status in zip(items, dedup.check(items)):
+        if status == COLLISION:
+            collisions.setdefault(session_id, set()).add(identity)
+    items.clear()
+
+def estimate_sessions(file_paths):
+    """Sessions in the files, extrapolated from the size of the first SIZE_SAMPLE sessions of the first file"""
+    if not file_paths:
+        return 0
+    sample = [len(json.dumps(session)) + 1 for _, session in zip(range(SIZE_SAMPLE), iter_records(file_paths[0]))]
+    if not sample:
+        return 0
+    return int(sum(os.path.getsize(path) for path in file_paths) * len(sample) / sum(sample))
+
+def check_session_ids(file_paths, manifest, dedup_state):
+    """
+    find_collisions over the files the manifest has no result for, their
+    results stored in the manifest; returns the collisions of all the files
+    """
+    pending = [path for path in file_paths if manifest.file(path).get('collisions') is None]
+    if pending:
+        dedup = Deduplicator.open(dedup_state, capacity=max(estimate_sessions(pending), 1000))
+        for file_path in pending:
+            collisions = find_collisions([file_path], dedup)
+            dedup.save()
+            manifest.file(file_path)['collisions'] = {key: sorted(ids) for key, ids in collisions.items()}
+            manifest.save()
+        print(f"Session ids ({len(pending)} files checked, {len(file_paths) - len(pending)} from the manifest): "
+              f"{dedup.report()}")
+        dedup.close()
+    else:
+        print(f"Session ids: all {len(file_paths)} files checked by an earlier run")
+    collisions = {}
+    for file_path in file_paths:
+        for key, ids in manifest.file(file_path)['collisions'].items():
+            collisions.setdefault(key, set()).update(ids)
+    return collisions
+
+def is_skipped(session, skip):
+    if session['session_id'] not in skip:
+        return False
+    return session_item(session)[1] in skip[session['session_id']]
+
+def session_to_payload(session, events):
+    """Map JSON fields to your Column Families (HBase requires bytes/strings); `events` is the encoded page views"""
+    geo = session.get('geo_data', {})
+    device = session.get('device_profile', {})
+    return {
+        b'meta:session_id': str(session.get('session_id', '')).encode(),
+        b'meta:user_id': str(session.get('user_id', '')).encode(),
+        b'meta:start_time': str(session.get('start_time', '')).encode(),
+        b'meta:end_time': str(session.get('end_time', '')).encode(),
+        b'geo:city': str(geo.get('city', '')).encode(),
+        b'geo:country': str(geo.get('country', '')).encode(),
+        b'device:type': str(device.get('type', '')).encode(),
+        b'stats:duration': str(session.get('duration_seconds', '0')).encode(),
+        b'stats:conversion_status': str(session.get('conversion_status', '')).encode(),
+        b'events:log': events
+    }
+
+class LatencyHistogram:
+    """Flush latencies counted in fixed millisecond buckets, so histograms from threads and processes can be summed"""
+    BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        return self
+
+    def percentile(self, p):
+        """Upper bound (ms) of the bucket holding the p-th percentile"""
+        target = p / 100 * self.count
+        seen = 0
+        for bound, n in zip(self.BUCKETS_MS + [float('inf')], self.counts):
+            seen += n
+            if n and seen >= target:
+                return bound
+        return 0
+
+    def summary(self):
+        if not self.count:
+            return "no batches flushed"
+        return (f"{self.count:,} batches, mean {self.total / self.count * 1000:.1f} ms, "
+                f"p50 <= {self.percentile(50)} ms, p95 <= {self.percentile(95)} ms, "
+                f"p99 <= {self.percentile(99)} ms, max {self.max * 1000:.1f} ms")
+
+    def format(self, width=40):
+        """Text histogram, one line per non-empty bucket"""
+        peak = max(self.counts) or 1
+        lines = []
+        for i, n in enumerate(self.counts):
+            if not n:
+                continue
+            label = f"<= {self.BUCKETS_MS[i]:>5} ms" if i < len(self.BUCKETS_MS) else f" > {self.BUCKETS_MS[-1]:>5} ms"
+            lines.append(f"  {label} | {'#' * max(1, round(n / peak * width)):<{width}} {n:,}")
+        return "\n".join(lines)
+
+class AdaptiveBatcher:
+    """
+    Buffers puts and sends them in one mutateRows call when the buffer reaches
+    `batch_size` rows or `max_bytes` bytes. After each flush the row limit is
+    tuned from the flush latency: it grows while flushes finish well under
+    `target_latency` and halves when they take longer, so a slow server gets
+    smaller batches instead of ever larger stalls.
+
+    Thrift and socket errors are retried up to `max_retries` times with
+    exponential backoff, reopening the connection in between. Puts are
+    idempotent, so re-sending a batch that partly landed is safe.
+    """
+
+    def __init__(self, table=None, batch_size=WRITE_BATCH_SIZE, max_bytes=MAX_BATCH_BYTES,
+                 target_latency=TARGET_FLUSH_LATENCY, max_retries=MAX_RETRIES, adaptive=True):
+        self.table = table
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.adaptive = adaptive
+        self.histogram = LatencyHistogram()
+        self.retries = 0
+        self.rows_flushed = 0
+        self.discard()
+
+    def put(self, row_key, data):
+        self.pending.append((row_key, data))
+        self.pending_bytes += len(row_key) + sum(len(column) + len(value) for column, value in data.items())
+        if len(self.pending) >= self.batch_size or self.pending_bytes >= self.max_bytes:
+            self.flush()
+
+    def discard(self):
+        """Drop buffered puts (after a failed unit, so they do not leak into the next one)"""
+        self.pending = []
+        self.pending_bytes = 0
+
+    def flush(self):
+        if not self.pending:
+            return
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                batch = self.table.batch()
+                for row_key, data in self.pending:
+                    batch.put(row_key, data)
+                batch.send()
+                break
+            except (TException, OSError) as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                delay = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** attempt)
+                print(f"  ⚠ Flush of {len(self.pending):,} rows failed ({e}); retrying in {delay:.1f}s")
+                time.sleep(delay)
+                self._reconnect()
+        latency = time.perf_counter() - started
+        self.histogram.record(latency)
+        self.rows_flushed += len(self.pending)
+        if self.adaptive:
+            self._tune(latency)
+        self.discard()
+
+    def _tune(self, latency):
+        if latency > self.target_latency:
+            self.batch_size = max(MIN_BATCH_SIZE, self.batch_size // 2)
+        elif latency < self.target_latency / 2 and len(self.pending) >= self.batch_size:
+            # Only grow when the batch was actually full, not a short tail or a byte-limited flush
+            self.batch_size = min(MAX_BATCH_SIZE, self.batch_size + self.batch_size // 4 + 1)
+
+    def _reconnect(self):
+        connection = self.table.connection
+        try:
+            connection.close()
+        except Exception:
+            pass
+        try:
+            connection.open()
+        except (TException, OSError):
+            pass  # Still down; the next attempt fails and backs off again
+
+    def stats(self):
+        return {'histogram': self.histogram, 'retries': self.retries, 'batch_size': self.batch_size}
+
+_DONE = object()
+
+def parse_into_queue(unit, sessions_queue):
+    """Parser thread: stream sessions into the bounded queue, then signal the end (or the error)"""
+    try:
+        for item in iter_unit(unit):
+            sessions_queue.put(item)
+    except Exception as e:
+        sessions_queue.put(e)
+    finally:
+        sessions_queue.put(_DONE)
+
+def load_file(table, file_path, start=None, end=None, resume=None, batcher=None, codec=None, index_writers=(),
+              on_commit=None, skip=None):
+    """
+    Load one session file (or one byte range of an NDJSON file). Parsing runs
+    in a background thread while this thread sends the puts, so JSON decoding
+    and Thrift network I/O overlap. Pass a `batcher` to keep its tuned batch
+    size and latency histogram across files; `codec` builds the row keys
+    (salted user/time keys by default, see hbase_rowkeys.py).
+
+    `index_writers` are (SecondaryIndex, AdaptiveBatcher) pairs, with each
+    batcher bound to its index table; index rows are written in the same pass
+    (see hbase_indexes.py).
+
+    Whenever the sessions batch flushes, the index batches are flushed too and
+    on_commit(position, rows) is called: every session up to `position` (see
+    iter_unit) is then stored, with `rows` of them loaded by this call.
+
+    Sessions listed in `skip` (find_collisions output) are passed over.
+    """
+    codec = codec or get_codec()
+    if batcher is None:
+        batcher = AdaptiveBatcher()
+    batcher.table = table
+    batchers = [batcher] + [index_batcher for _, index_batcher in index_writers]
+
+    sessions_queue = queue.Queue(maxsize=PARSE_QUEUE_SIZE)
+    parser = threading.Thread(target=parse_into_queue, args=((file_path, start, end, resume), sessions_queue),
+                              daemon=True)
+    parser.start()
+
+    rows = 0
+    position = resume
+    pending = []
+
+    def commit():
+        for _, index_batcher in index_writers:
+            index_batcher.flush()
+        if on_commit:
+            on_commit(position, rows)
+
+    def put_pending():
+        nonlocal rows, position
+        events = encode_many([session.get('page_views', []) for session, _ in pending])
+        for (session, position), encoded in zip(pending, events):
+            if skip and is_skipped(session, skip):
+                continue
+            row_key = codec.encode(session)
+            # Index rows go first, so a sessions flush always covers the index rows of the same sessions
+            for index, index_batcher in index_writers:
+                for index_key, data in index.rows(session, row_key):
+                    index_batcher.put(index_key, data)
+            flushed = batcher.rows_flushed
+            batcher.put(row_key, session_to_payload(session, encoded))
+            rows += 1
+            if batcher.rows_flushed != flushed:
+                commit()
+        pending.clear()
+
+    try:
+        while True:
+            item = sessions_queue.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            pending.append(item)
+            if len(pending) >= ENCODE_BATCH_SIZE:
+                put_pending()
+        put_pending()
+        batcher.flush()
+        commit()
+    except Exception:
+        for b in batchers:
+            b.discard()
+        raise
+    finally:
+        # Unblock the parser if we stopped early, then wait for it
+        while parser.is_alive():
+            try:
+                sessions_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+    return rows
+
+def find_session_files(path):
+    return sorted(glob.glob(os.path.join(path, 'sessions_*.json')) +
+                  glob.glob(os.path.join(path, 'sessions_*.ndjson')))
+
+def plan_work(file_paths, range_size=RANGE_SIZE):
+    """
+    Split the input into work units. JSON arrays are loaded whole; large
+    NDJSON files are cut into byte ranges so several workers can share them.
+    """
+    units = []
+    for file_path in file_paths:
+        size = os.path.getsize(file_path)
+        if not file_path.endswith('.ndjson') or size <= range_size:
+            units.append((file_path, None, None))
+            continue
+        for start in range(0, size, range_size):
+            units.append((file_path, start, min(start + range_size, size)))
+    return units
+
+def file_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class LoadManifest:
+    """
+    Load progress per input file, rewritten atomically after every committed
+    batch. Each file has its checksum and its work units; each unit has the
+    last committed position (byte offset for NDJSON ranges, session count
+    for JSON arrays), the rows committed so far and whether it finished.
+
+    Row keys are derived from the sessions, so a rerun that re-sends rows
+    after the last committed position overwrites them instead of
+    duplicating them. A file is only hashed again when its size or
+    modification time changed, and loaded again from the start when its
+    checksum did. Files also keep their session id check result
+    ('collisions', see check_session_ids).
+    """
+    def __init__(self, path, settings):
+        self.path = path
+        self.settings = settings
+        self.files = {}
+        self.base_rows = {}  # Rows each unit had committed before this run
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        manifest = cls(path, data["settings"])
+        manifest.files = data["files"]
+        return manifest
+
+    @staticmethod
+    def unit_key(unit):
+        return 'whole' if unit[1] is None else str(unit[1])
+
+    def file(self, file_path):
+        return self.files[os.path.basename(file_path)]
+
+    def plan(self, file_paths, range_size=RANGE_SIZE):
+        """Work units still to do, each with its resume position, plus the number of finished units skipped"""
+        units = []
+        skipped = 0
+        for file_path in file_paths:
+            name = os.path.basename(file_path)
+            stat = os.stat(file_path)
+            entry = self.files.get(name)
+            if entry and (entry['size'], entry.get('mtime')) != (stat.st_size, stat.st_mtime_ns):
+                checksum = file_checksum(file_path)
+                if entry['checksum'] != checksum:
+                    print(f"⚠ {name} changed since the last run; loading it again from the start")
+                    entry = None
+                else:
+                    entry['mtime'] = stat.st_mtime_ns
+            if entry is None:
+                entry = self.files[name] = {
+                    'checksum': file_checksum(file_path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                    'collisions': None, 'units': {
+                        self.unit_key(unit): {'start': unit[1], 'end': unit[2], 'position': None, 'rows': 0,
+                                              'done': False}
+                        for unit in plan_work([file_path], range_size)
+                    }}
+            for state in entry['units'].values():
+                if state['done']:
+                    skipped += 1
+                else:
+                    units.append((file_path, state['start'], state['end'], state['position']))
+        self.save()
+        return units, skipped
+
+    def state(self, unit):
+        return self.files[os.path.basename(unit[0])]['units'][self.unit_key(unit)]
+
+    def record(self, unit, position=None, rows=None, done=False, error=None):
+        """
+        Commit progress of a unit; `rows` are the rows committed by this run,
+        on top of earlier runs. Without rows, only the done/error flags change.
+        """
+        state = self.state(unit)
+        key = (unit[0], self.unit_key(unit))
+        base = self.base_rows.setdefault(key, state['rows'])
+        if rows is not None:
+            state['position'] = position
+            state['rows'] = base + rows
+        state['done'] = done
+        state['error'] = error
+        self.save()
+
+    def save(self):
+        data = {"settings": self.settings, "files": self.files}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(data, f, sort_keys=True, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+# --- Parallel Loader ---
+def loader_thread(pool, table_name, work_queue, result_queue, worker_id, batcher, codec, index_writers, skip):
+    """
+    Take units from the shared work queue until the sentinel, loading each
+    through a pooled connection. Reports to `result_queue`:
+        ('progress', worker, unit, position, rows)  after every committed batch
+        ('finished', worker, unit, rows, seconds)   when the unit is loaded
+        ('error', worker, unit, message)            when it failed
+    """
+    while True:
+        unit = work_queue.get()
+        if unit is None:
+            return
+        started = time.perf_counter()
+        try:
+            with pool.connection() as connection:
+                for index, index_batcher in index_writers:
+                    index_batcher.table = connection.table(index.table_name(table_name))
+                rows = load_file(connection.table(table_name), *unit, batcher=batcher, codec=codec,
+                                 index_writers=index_writers, skip=skip,
+                                 on_commit=lambda position, rows: result_queue.put(
+                                     ('progress', worker_id, unit, position, rows)))
+            result_queue.put(('finished', worker_id, unit, rows, time.perf_counter() - started))
+        except Exception as e:
+            result_queue.put(('error', worker_id, unit, str(e)))
+
+def connection_pool(size, host, port, standin=None):
+    """happybase pool, or a stand-in pool when `standin` holds hbase_standin.Connection settings"""
+    if standin is not None:
+        return hbase_standin.ConnectionPool(size, **standin)
+    return happybase.ConnectionPool(size=size, host=host, port=port)
+
+def loader_worker(worker_id, work_queue, result_queue, host, port, table_name, threads, batch_settings, codec,
+                  indexes, skip, standin):
+    """
+    Worker process: a happybase ConnectionPool shared by `threads` loader
+    threads, each with its own AdaptiveBatchers (sessions, plus one per index
+    table). Ends with ('done', worker, seconds, merged flush statistics).
+    """
+    pool = connection_pool(threads, host, port, standin)
+    started = time.perf_counter()
+    batchers = [AdaptiveBatcher(**batch_settings) for _ in range(threads)]
+    index_writers = [[(INDEXES[name], AdaptiveBatcher(**batch_settings)) for name in indexes] for _ in range(threads)]
+    workers = [threading.Thread(target=loader_thread,
+                                args=(pool, table_name, work_queue, result_queue, worker_id, b, codec, writers,
+                                      skip))
+               for b, writers in zip(batchers, index_writers)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    all_batchers = batchers + [b for writers in index_writers for _, b in writers]
+    stats = {
+        'histogram': LatencyHistogram(),
+        'retries': sum(b.retries for b in all_batchers),
+        'batch_sizes': [b.batch_size for b in batchers]
+    }
+    for b in all_batchers:
+        stats['histogram'].merge(b.histogram)
+    result_queue.put(('done', worker_id, time.perf_counter() - started, stats))
+
+def load_parallel(file_paths, host=HBASE_HOST, port=HBASE_PORT, table_name=TABLE_NAME,
+                  processes=NUM_PROCESSES, threads=THREADS_PER_PROCESS, range_size=RANGE_SIZE,
+                  batch_settings=None, codec=None, indexes=(), manifest=None, skip=None, standin=None,
+                  planned=None):
+    """
+    Load files with `processes` worker processes x `threads` threads pulling
+    units from one work queue. `batch_settings` are AdaptiveBatcher keyword
+    arguments; `indexes` names the index tables to maintain (see
+    hbase_indexes.py). With a LoadManifest, finished units are skipped,
+    partial ones resume, and progress is committed as batches flush;
+    `planned` is the manifest.plan() result when the caller already has it.
+    Sessions in `skip` (see find_collisions) are not loaded. `standin`
+    (hbase_standin.Connection settings) replaces the server.
+    Returns rows loaded per worker, elapsed seconds and the units that
+    failed; raises RuntimeError when a worker process dies without finishing.
+    """
+    batch_settings = batch_settings or {}
+    codec = codec or get_codec()
+    if manifest is None:
+        units = [unit + (None,) for unit in plan_work(file_paths, range_size)]
+    else:
+        units, skipped = planned or manifest.plan(file_paths, range_size)
+        resumed = sum(1 for unit in units if unit[3] is not None)
+        if skipped or resumed:
+            print(f"Manifest: skipping {skipped} finished units, resuming {resumed} partial ones")
+    work_queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    for unit in units:
+        work_queue.put(unit)
+    for _ in range(processes * threads):
+        work_queue.put(None)
+
+    started = time.perf_counter()
+    procs = [multiprocessing.Process(target=loader_worker,
+                                     args=(w, work_queue, result_queue, host, port, table_name, threads,
+                                           batch_settings, codec, indexes, skip, standin))
+             for w in range(processes)]
+    for proc in procs:
+        proc.start()
+
+    worker_rows = {w: 0 for w in range(processes)}
+    worker_seconds = {}
+    worker_stats = {}
+    failed = []
+    suspects = set()
+    while len(worker_seconds) < processes:
         try:
-            sessions_data = json.load(f)
-            
-            # Ensure data is a list (if your JSON is an array)
-            if not isinstance(sessions_data, list):
-                sessions_data = [sessions_data]
-            
-            with table.batch() as b:
-                for session in sessions_data:
-                    # Use session_id as the Row Key
-                    row_key = str(session.get('session_id', os.urandom(8).hex()))
-                    
-                    # Map JSON fields to your Column Families
-                    # Note: HBase requires bytes/strings
-                    payload = {
-                        b'meta:user_id': str(session.get('user_id', '')).encode(),
-                        b'meta:timestamp': str(session.get('timestamp', '')).encode(),
-                        b'geo:city': str(session.get('city', '')).encode(),
-                        b'geo:country': str(session.get('country', '')).encode(),
-                        b'device:type': str(session.get('device_type', '')).encode(),
-                        b'stats:duration': str(session.get('duration', '0')).encode(),
-                        b'events:log': json.dumps(session.get('events', [])).encode()
-                    }
-                    b.put(row_key, payload)
+            kind, worker_id, *message = result_queue.get(timeout=RESULT_TIMEOUT)
+        except queue.Empty:
+            # A worker that crashed or was killed never sends 'done'. It counts as dead once it has
+            # stayed gone for a whole further timeout, so anything it sent before exiting arrives first.
+            dead = {w for w, proc in enumerate(procs) if w not in worker_seconds and proc.exitcode is not None}
+            if dead & suspects:
+                for proc in procs:
+                    proc.terminate()
+                codes = ', '.join(f"worker {w} exit code {procs[w].exitcode}" for w in sorted(dead & suspects))
+                raise RuntimeError(f"Loader workers died ({codes}); committed progress is in the manifest, "
+                                   f"rerun to resume")
+            suspects = dead
+            continue
+        if kind == 'done':
+            worker_seconds[worker_id], worker_stats[worker_id] = message
+        elif kind == 'progress':
+            unit, position, rows = message
+            if manifest is not None:
+                manifest.record(unit, position, rows)
+        elif kind == 'error':
+            unit, error = message
+            failed.append(unit)
+            if manifest is not None:
+                manifest.record(unit, error=error)
+                position = manifest.state(unit)['position']
+                print(f"Error in {describe(unit)}: {error} (committed up to {position or 0:,}; rerun to resume)")
+            else:
+                print(f"Error skipping {describe(unit)}: {error}")
+        else:
+            unit, rows, seconds = message
+            if manifest is not None:
+                manifest.record(unit, manifest.state(unit)['position'], rows, done=True)
+            worker_rows[worker_id] += rows
+            print(f"  [worker {worker_id}] {describe(unit)}: {rows:,} sessions ({rows / max(seconds, 1e-9):,.0f} rows/s)")
+
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - started
+
+    print("\nThroughput:")
+    for w in range(processes):
+        seconds = max(worker_seconds[w], 1e-9)
+        print(f"  Worker {w}: {worker_rows[w]:,} rows in {seconds:.1f}s ({worker_rows[w] / seconds:,.0f} rows/s)")
+    total = sum(worker_rows.values())
+    print(f"  Total: {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s aggregate)")
+
+    print("\nFlush latency:")
+    histogram = LatencyHistogram()
+    for w in range(processes):
+        stats = worker_stats[w]
+        histogram.merge(stats['histogram'])
+        sizes = ', '.join(f"{size:,}" for size in stats['batch_sizes'])
+        print(f"  Worker {w}: {stats['histogram'].summary()}; {stats['retries']} retries; final batch sizes {sizes}")
+    print(f"  All workers: {histogram.summary()}")
+    if histogram.count:
+        print(histogram.format())
+    return worker_rows, elapsed, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Load session files into HBase")
+    parser.add_argument('--path', default=project_path, help="Directory with sessions_*.json / sessions_*.ndjson")
+    parser.add_argument('--host', default=HBASE_HOST)
+    parser.add_argument('--port', type=int, default=HBASE_PORT)
+    parser.add_argument('--table', default=TABLE_NAME)
+    parser.add_argument('--processes', type=int, default=NUM_PROCESSES)
+    parser.add_argument('--threads', type=int, default=THREADS_PER_PROCESS, help="Loader threads per process")
+    parser.add_argument('--range-size', type=int, default=RANGE_SIZE, help="Bytes per NDJSON work unit")
+    parser.add_argument('--batch-size', type=int, default=WRITE_BATCH_SIZE, help="Initial puts per flush")
+    parser.add_argument('--max-batch-bytes', type=int, default=MAX_BATCH_BYTES, help="Flush once buffered puts reach this size")
+    parser.add_argument('--target-latency-ms', type=float, default=TARGET_FLUSH_LATENCY * 1000,
+                        help="Flush latency the batch size is tuned towards")
+    parser.add_argument('--max-retries', type=int, default=MAX_RETRIES, help="Retries per batch on Thrift errors")
+    parser.add_argument('--fixed-batch-size', action='store_true', help="Disable latency-based batch tuning")
+    parser.add_argument('--row-key', choices=sorted(CODECS), default=DEFAULT_CODEC,
+                        help="Row key scheme (must match how the table was created, see hbase_rowkeys.py)")
+    parser.add_argument('--indexes', nargs='*', choices=sorted(INDEXES), default=sorted(INDEXES),
+                        help="Index tables to maintain while loading (pass no names to skip indexing)")
+    parser.add_argument('--manifest', help=f"Progress manifest (default: {MANIFEST_FILE} in --path)")
+    parser.add_argument('--fresh', action='store_true', help="Ignore an existing manifest and load everything again")
+    parser.add_argument('--dedup-state', help=f"Session id state for duplicate checks (default: {DEDUP_STATE} in --path)")
+    parser.add_argument('--no-dedup', action='store_true', help="Skip the session id check")
+    parser.add_argument('--on-collision', choices=['warn', 'skip'], default='warn',
+                        help="Report and load (default), or leave out, sessions whose id belongs to another session")
+    parser.add_argument('--standin', metavar='DB', help="Load into the HBase stand-in stored in this SQLite file")
+    parser.add_argument('--standin-latency-ms', type=float, default=0.0, help="Stand-in latency per round trip")
+    parser.add_argument('--standin-row-latency-us', type=float, default=0.0, help="Stand-in latency per row")
+    args = parser.parse_args()
+
+    # 1. Check HBase is reachable (Ensure container is running and port 9090 is open)
+    standin = None
+    if args.standin:
+        # The stand-in has no shell to create tables in, so create any that are missing here
+        standin = {'path': args.standin, 'latency': args.standin_latency_ms / 1000,
+                   'row_latency': args.standin_row_latency_us / 1e6}
+        connection = hbase_standin.Connection(**standin)
+        existing = {name.decode() for name in connection.tables()}
+        tables = {args.table: ['meta', 'geo', 'device', 'stats', 'events']}
+        tables.update({INDEXES[name].table_name(args.table): [INDEX_FAMILY] for name in args.indexes})
+        for name, families in tables.items():
+            if name not in existing:
+                connection.create_table(name, {family: {} for family in families})
+        print(f"Using the HBase stand-in at {args.standin}")
+    else:
+        try:
+            connection = happybase.Connection(args.host, port=args.port)
+            connection.open()
+            connection.close()
+            print("Connected to HBase successfully!")
         except Exception as e:
-            print(f"Error skipping {file_path}: {e}")
+            print(f"Connection failed: {e}")
+            exit()
+
+    # 2. Open (or start) the progress manifest
+    settings = {'table': args.table, 'row_key': args.row_key, 'indexes': sorted(args.indexes)}
+    manifest_path = args.manifest or os.path.join(args.path, MANIFEST_FILE)
+    fresh_state = False
+    if os.path.exists(manifest_path) and not args.fresh:
+        manifest = LoadManifest.load(manifest_path)
+        if manifest.settings != settings:
+            print(f"{manifest_path} was written with {manifest.settings}, not {settings}. "
+                  f"Rerun with the same settings, or pass --fresh to start over.")
+            exit()
+    else:
+        manifest = LoadManifest(manifest_path, settings)
+        fresh_state = True
+
+    # 3. Check session ids for collisions with earlier sessions, where they would share a row
+    file_paths = find_session_files(args.path)
+    planned = manifest.plan(file_paths, args.range_size)
+    codec = get_codec(args.row_key)
+    dedup_state = args.dedup_state or os.path.join(args.path, DEDUP_STATE)
+    if fresh_state:
+        remove_state(dedup_state)  # Ids from the dataset of an earlier manifest
+    skip = None
+    check_ids = not args.no_dedup and (codec.ids_share_rows or args.on_collision == 'skip')
+    if not args.no_dedup and not check_ids:
+        print(f"Session ids: not checked, the {codec.name} row key keeps sessions that share an id in separate rows")
+    if check_ids:
+        collisions = check_session_ids(file_paths, manifest, dedup_state)
+        if collisions:
+            examples = ', '.join(sorted(collisions)[:5])
+            print(f"⚠ {len(collisions):,} session ids are shared by different sessions (e.g. {examples}); "
+                  f"{'skipping' if args.on_collision == 'skip' else 'loading'} the later ones")
+            if args.on_collision == 'skip':
+                skip = collisions
+
+    # 4. Load every file in parallel
+    print(f"Loading {len(file_paths)} files with {args.processes} processes x {args.threads} threads...")
+    batch_settings = {
+        'batch_size': args.batch_size,
+        'max_bytes': args.max_batch_bytes,
+        'target_latency': args.target_latency_ms / 1000,
+        'max_retries': args.max_retries,
+        'adaptive': not args.fixed_batch_size
+    }
+    try:
+        _, _, failed = load_parallel(file_paths, args.host, args.port, args.table, args.processes, args.threads,
+                                     args.range_size, batch_settings, codec, args.indexes, manifest, skip, standin,
+                                     planned)
+    except RuntimeError as e:
+        print(f"⚠ {e}")
+        exit(1)
+    if failed:
+        print(f"⚠ {len(failed)} units failed to load (committed progress is in the manifest; rerun to resume):")
+        for unit in failed:
+            print(f"  {describe(unit)}")
+        exit(1)
+    print("Finished loading all sessions.")
 
-connection.close()
-print("Finished loading all sessions.")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# mongodb_denormalize.py
+"""
+Category ids stamped onto transaction items, so revenue by category is a
+plain $unwind + $group instead of a $lookup into products for every item.
+
+mongodb_ingestion.py --denormalize-categories stamps new transactions while
+loading; this script backfills transactions that are already in the
+database. Both use the product -> category map held in memory.
+
+Whether every item carries its category is recorded in the ingest_meta
+collection, and aggregation_queries.py only drops the $lookup when it is.
+
+Usage:
+    python mongodb_denormalize.py            # backfill, then mark the items as stamped
+    python mongodb_denormalize.py --check    # only count the items still missing a category
+"""
+
+import argparse
+import time
+from datetime import datetime, timezone
+
+from pymongo.errors import PyMongoError
+
+from mongodb_client import DATABASE, MAX_TIME_MS, MONGO_URI, get_client
+
+META_COLLECTION = 'ingest_meta'
+STAMPED = 'item_categories'  # ingest_meta _id of the "items carry category_id" flag
+CATEGORY_FIELDS = ('category_id', 'subcategory_id')  # Copied from the product when it has them
+
+def product_categories(products):
+    """{product_id: {category_id, subcategory_id}} from product documents"""
+    return {product['product_id']: {field: product[field] for field in CATEGORY_FIELDS if product.get(field)}
+            for product in products}
+
+def load_product_categories(db):
+    return product_categories(db.products.find({}, {'_id': 0, 'product_id': 1, **dict.fromkeys(CATEGORY_FIELDS, 1)}))
+
+def stamp_categories(transaction, categories):
+    """Copy each item's product category fields onto the item, in place; returns the items left without one"""
+    missing = 0
+    for item in transaction.get('items') or []:
+        fields = categories.get(item.get('product_id'))
+        if fields:
+            item.update(fields)
+        else:
+            missing += 1
+    return missing
+
+def set_stamped(db, complete):
+    db[META_COLLECTION].update_one({'_id': STAMPED},
+                                   {'$set': {'complete': complete, 'updated': datetime.now(timezone.utc)}},
+                                   upsert=True)
+
+def items_stamped(db):
+    """True once every transaction item is known to carry its category"""
+    flag = db[META_COLLECTION].find_one({'_id': STAMPED})
+    return bool(flag and flag.get('complete'))
+
+def missing_filter():
+    return {'items': {'$elemMatch': {'category_id': {'$exists': False}}}}
+
+def backfill(db, categories, max_time_ms=MAX_TIME_MS):
+    """
+    Stamp the items of existing transactions, one server-side update_many per
+    category: its products are matched through the items.product_id index
+    and the array filter sets the fields on exactly those items. Items that
+    already carry a category are left alone, so the job can be rerun.
+    Returns {category_id: transactions modified}.
+    """
+    by_category = {}
+    for product_id, fields in categories.items():
+        if fields.get('category_id'):
+            by_category.setdefault((fields['category_id'], fields.get('subcategory_id')), []).append(product_id)
+    modified = {}
+    for (category_id, subcategory_id), product_ids in by_category.items():
+        values = {'items.$[item].category_id': category_id}
+        if subcategory_id:
+            values['items.$[item].subcategory_id'] = subcategory_id
+        result = db.transactions.update_many(
+            {'items': {'$elemMatch': {'product_id': {'$in': product_ids}, 'category_id': {'$exists': False}}}},
+            {'$set': values},
+            array_filters=[{'item.product_id': {'$in': product_ids}, 'item.category_id': {'$exists': False}}],
+            maxTimeMS=max_time_ms)
+        modified[category_id] = modified.get(category_id, 0) + result.modified_count
+    return modified
+
+def main():
+    parser = argparse.ArgumentParser(description="Stamp product categories onto existing transaction items")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string (or set MONGO_URI)")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--check', action='store_true', help="Only count transactions with unstamped items")
+    args = parser.parse_args()
+
+    try:
+        db = get_client(args.uri)[args.database]
+        db.command('ping')
+    except PyMongoError as e:
+        print(f"Connection failed: {e}")
+        exit()
+
+    if not args.check:
+        categories = load_product_categories(db)
+        print(f"Loaded {len(categories):,} products into the category map")
+        started = time.perf_counter()
+        modified = backfill(db, categories)
+        print(f"Stamped {sum(modified.values()):,} transactions across {len(modified)} categories "
+              f"in {time.perf_counter() - started:.1f}s")
+
+    missing = db.transactions.count_documents(missing_filter())
+    if missing:
+        # Items whose product is not in the products collection cannot be stamped
+        print(f"⚠ {missing:,} transactions still have items without a category; "
+              f"revenue by category keeps using $lookup")
+    else:
+        print("✅ Every transaction item carries its category")
+    if not args.check:
+        set_stamped(db, not missing)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# mongodb_index_advisor.py
+"""
+Index check and explain-plan capture for the aggregation pipelines.
+
+1. Creates the declared indexes (mongodb_ingestion.INDEXES) that are missing.
+2. Runs explain("executionStats") for every registered pipeline and records
+   documents and keys examined, documents returned, the indexes used
+   (including those of $lookup stages), collection scans and execution time.
+3. Flags pipelines registered as indexed whose plan falls back to COLLSCAN,
+   and $lookup stages that scan the foreign collection. Full aggregations
+   (no $match) are registered as scans and only reported.
+
+Results go to mongodb_results/explain_report.csv, and the raw plans to
+explain_plans.json for diffing between runs. The exit status is 1 when
+anything is flagged, so the check can gate a CI job.
+
+Register further pipelines with register(); `pipeline` may be a function of
+the samples (a transaction, the latest timestamp and the rollups' high-water
+mark) for $match values, returning None when it does not apply yet.
+
+Usage:
+    python mongodb_index_advisor.py
+    python mongodb_index_advisor.py --no-create    # only report, e.g. against production
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+from bson import json_util
+from pymongo.errors import OperationFailure, PyMongoError
+
+from aggregation_queries import (DAILY_REVENUE_PIPELINE, REVENUE_BY_CATEGORY_PIPELINE,
+                                 REVENUE_BY_CATEGORY_STAMPED_PIPELINE, TOP_PRODUCTS_PIPELINE)
+from mongodb_client import DATABASE, MAX_TIME_MS, MONGO_URI, get_client
+from mongodb_ingestion import INDEXES
+from mongodb_rollups import (CATEGORY_DAY, DAILY_REVENUE_ROLLUP_PIPELINE, DAY, PRODUCT_DAY,
+                             REVENUE_BY_CATEGORY_ROLLUP_PIPELINE, TOP_PRODUCTS_ROLLUP_PIPELINE, high_water_mark,
+                             refresh_window, rollup_pipelines)
+
+RESULTS_DIR = 'mongodb_results'
+REPORT_FILE = 'explain_report.csv'
+PLANS_FILE = 'explain_plans.json'
+INDEXED, SCAN = 'indexed', 'scan'
+
+REGISTRY = {}
+
+def register(name, collection, pipeline, expect):
+    """Add a pipeline to check; `expect` is INDEXED (COLLSCAN is flagged) or SCAN (a full pass is expected)"""
+    REGISTRY[name] = (collection, pipeline, expect)
+
+register('top_products', 'transactions', TOP_PRODUCTS_PIPELINE, SCAN)
+register('revenue_by_category', 'transactions', REVENUE_BY_CATEGORY_PIPELINE, SCAN)
+register('revenue_by_category_stamped', 'transactions', REVENUE_BY_CATEGORY_STAMPED_PIPELINE, SCAN)
+register('daily_revenue', 'transactions', DAILY_REVENUE_PIPELINE, SCAN)
+register('top_products_rollup', PRODUCT_DAY, TOP_PRODUCTS_ROLLUP_PIPELINE, SCAN)
+register('revenue_by_category_rollup', CATEGORY_DAY, REVENUE_BY_CATEGORY_ROLLUP_PIPELINE, SCAN)
+register('daily_revenue_rollup', DAY, DAILY_REVENUE_ROLLUP_PIPELINE, SCAN)
+# The next incremental refresh of mongodb_rollups.py, without its $merge (explain cannot run writes with
+# executionStats); before the first refresh there is no mark, and the rebuild reads every transaction
+register('rollup_refresh_window', 'transactions',
+         lambda s: [refresh_window(s['mark'], s['latest'])[1]] + rollup_pipelines(True)[PRODUCT_DAY]
+         if s['mark'] is not None else None, INDEXED)
+register('user_transactions', 'transactions',
+         lambda s: [{"$match": {"user_id": s['transaction']['user_id']}}, {"$sort": {"timestamp": -1}},
+                    {"$limit": 20}], INDEXED)
+register('session_transactions', 'transactions',
+         lambda s: [{"$match": {"session_id": s['transaction']['session_id']}}], INDEXED)
+register('product_sales', 'transactions',
+         lambda s: [{"$match": {"items.product_id": s['transaction']['items'][0]['product_id']}},
+                    {"$unwind": "$items"},
+                    {"$match": {"items.product_id": s['transaction']['items'][0]['product_id']}},
+                    {"$group": {"_id": None, "units": {"$sum": "$items.quantity"}}}], INDEXED)
+
+def ensure_indexes(db, create=True):
+    """Declared indexes missing from the database; created unless `create` is False"""
+    missing = {}
+    existing_collections = set(db.list_collection_names())
+    for collection, models in INDEXES.items():
+        if collection not in existing_collections:
+            continue
+        existing = {tuple(info['key']) for info in db[collection].index_information().values()}
+        wanted = [model for model in models if tuple(model.document['key'].items()) not in existing]
+        if wanted:
+            missing[collection] = [model.document['name'] for model in wanted]
+            if create:
+                db[collection].create_indexes(wanted)
+    return missing
+
+def explain(db, collection, pipeline, max_time_ms=MAX_TIME_MS):
+    return db.command({'explain': {'aggregate': collection, 'pipeline': pipeline, 'cursor': {}},
+                       'verbosity': 'executionStats', 'maxTimeMS': max_time_ms})
+
+def _walk(node, visit, key=None):
+    if isinstance(node, dict):
+        visit(key, node)
+        for child_key, child in node.items():
+            _walk(child, visit, child_key)
+    elif isinstance(node, list):
+        for child in node:
+            _walk(child, visit, key)
+
+def summarize(plan):
+    """
+    Docs/keys examined, returned, stages, indexes and $lookup scans from an
+    explain document, whichever layout the server used (classic $cursor
+    stage, pushed-down slot-based plan, or per shard)
+    """
+    summary = {'docs_examined': 0, 'keys_examined': 0, 'returned': None, 'time_ms': 0,
+               'stages': set(), 'indexes': set(), 'lookup_scans': 0}
+
+    def visit(key, node):
+        if key == 'executionStats':
+            summary['docs_examined'] += node.get('totalDocsExamined', 0)
+            summary['keys_examined'] += node.get('totalKeysExamined', 0)
+            summary['time_ms'] = max(summary['time_ms'], node.get('executionTimeMillis', 0))
+            if summary['returned'] is None:
+                summary['returned'] = node.get('nReturned')
+        if key in ('winningPlan', 'queryPlan', 'inputStage', 'inputStages') and 'stage' in node:
+            summary['stages'].add(node['stage'])
+            if node.get('indexName'):
+                summary['indexes'].add(node['indexName'])
+        if '$lookup' in node and isinstance(node['$lookup'], dict):
+            summary['docs_examined'] += node.get('totalDocsExamined', 0)
+            summary['keys_examined'] += node.get('totalKeysExamined', 0)
+            summary['lookup_scans'] += node.get('collectionScans', 0)
+            summary['indexes'].update(f"{node['$lookup'].get('from')}.{index['index']}"
+                                      for index in node.get('indexesUsed', []) if isinstance(index, dict))
+            summary['indexes'].update(f"{node['$lookup'].get('from')}.{index}"
+                                      for index in node.get('indexesUsed', []) if isinstance(index, str))
+
+    _walk(plan, visit)
+    # With a classic pipeline the last stage's nReturned is what the aggregation returned
+    stages = plan.get('stages') or []
+    if stages and isinstance(stages[-1], dict) and 'nReturned' in stages[-1]:
+        summary['returned'] = stages[-1]['nReturned']
+    return summary
+
+def check(expect, summary):
+    """Reasons to flag a pipeline (empty when its plan looks right)"""
+    flags = []
+    if expect == INDEXED and 'COLLSCAN' in summary['stages']:
+        flags.append("COLLSCAN instead of an index")
+    if summary['lookup_scans']:
+        flags.append(f"$lookup ran {summary['lookup_scans']:,} collection scans")
+    return flags
+
+def samples(db):
+    """Values for the parameterized pipelines"""
+    latest = db.transactions.find_one({'timestamp': {'$type': 'date'}}, sort=[('timestamp', -1)])
+    return {'transaction': latest, 'latest': latest['timestamp'] if latest else None, 'mark': high_water_mark(db)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the declared indexes and check the pipelines' explain plans")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string (or set MONGO_URI)")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--no-create', action='store_true', help="Report missing indexes without creating them")
+    parser.add_argument('--pipelines', nargs='+', choices=sorted(REGISTRY), help="Check only these pipelines")
+    args = parser.parse_args()
+
+    try:
+        db = get_client(args.uri)[args.database]
+        db.command('ping')
+    except PyMongoError as e:
+        print(f"Connection failed: {e}")
+        exit()
+
+    # 1. Indexes
+    missing = ensure_indexes(db, create=not args.no_create)
+    for collection, names in missing.items():
+        print(f"{'Missing' if args.no_create else 'Created'} on {collection}: {', '.join(names)}")
+    if not missing:
+        print("✅ All declared indexes exist")
+
+    # 2. Explain every registered pipeline
+    values = samples(db)
+    existing = set(db.list_collection_names())
+    rows = []
+    plans = {}
+    flagged = 0
+    print(f"\n{'pipeline':<30} {'examined':>12} {'keys':>10} {'returned':>9} {'ms':>7}  indexes")
+    for name in args.pipelines or REGISTRY:
+        collection, pipeline, expect = REGISTRY[name]
+        if collection not in existing or (callable(pipeline) and values['transaction'] is None):
+            print(f"{name:<30} skipped: no data in {collection}")
+            continue
+        if callable(pipeline):
+            pipeline = pipeline(values)
+            if pipeline is None:
+                print(f"{name:<30} skipped: does not apply to this data yet")
+                continue
+        started = time.perf_counter()
+        try:
+            plan = explain(db, collection, pipeline)
+        except OperationFailure as e:
+            print(f"{name:<30} ⚠ explain failed: {e}")
+            flagged += 1
+            continue
+        wall_ms = (time.perf_counter() - started) * 1000
+        summary = summarize(plan)
+        flags = check(expect, summary)
+        flagged += bool(flags)
+        plans[name] = plan
+        indexes = ', '.join(sorted(summary['indexes'])) or ('-' if expect == SCAN else 'none')
+        print(f"{name:<30} {summary['docs_examined']:>12,} {summary['keys_examined']:>10,} "
+              f"{summary['returned'] if summary['returned'] is not None else '-':>9} {wall_ms:>7.0f}  {indexes}")
+        for flag in flags:
+            print(f"  ⚠ {flag}")
+        rows.append({
+            'pipeline': name, 'collection': collection, 'expect': expect,
+            'docs_examined': summary['docs_examined'], 'keys_examined': summary['keys_examined'],
+            'returned': summary['returned'], 'execution_ms': summary['time_ms'], 'wall_ms': round(wall_ms, 1),
+            'stages': ' '.join(sorted(summary['stages'])), 'indexes': ' '.join(sorted(summary['indexes'])),
+            'lookup_scans': summary['lookup_scans'], 'flags': '; '.join(flags)
+        })
+
+    # 3. Save the report and the raw plans
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(os.path.join(RESULTS_DIR, REPORT_FILE), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['pipeline', 'collection', 'expect', 'docs_examined', 'keys_examined',
+                                               'returned', 'execution_ms', 'wall_ms', 'stages', 'indexes',
+                                               'lookup_scans', 'flags'])
+        writer.writeheader()
+        writer.writerows(rows)
+    with open(os.path.join(RESULTS_DIR, PLANS_FILE), 'w') as f:
+        f.write(json_util.dumps(plans, indent=2))
+    print(f"\nSaved {REPORT_FILE} and {PLANS_FILE} to {RESULTS_DIR}")
+
+    if flagged:
+        print(f"⚠ {flagged} pipeline(s) flagged")
+        sys.exit(1)
+    print("✅ No pipeline falls back to a collection scan where an index is expected")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+# mongodb_ingestion.py
+"""
+Parallel bulk load of the generated dataset into MongoDB (ecommerce_db).
+
+    users         users.json
+    products      products.json
+    categories    categories.json
+    transactions  transactions.json, transactions_*.ndjson
+    sessions      sessions_*.json, sessions_*.ndjson
+
+Files are streamed, never read whole: JSON arrays element by element and
+NDJSON shards line by line, in byte ranges so several workers can share a
+large shard. A pool of worker processes converts ISO timestamps to BSON dates
+(naive times are stored as UTC) and writes unordered insert_many batches.
+The INDEXES are built once the data is in, which is much cheaper than
+maintaining them on every insert.
+
+Transaction and session ids are checked first (see dedup.py); repeated
+records and records reusing another one's id are not inserted.
+
+--denormalize-categories stamps each transaction item with its product's
+category (see mongodb_denormalize.py), so revenue by category needs no $lookup.
+
+--append loads a generator delta: users, products and categories are full
+snapshots there and are upserted by id with unordered bulk_write, while
+transactions and sessions are added, checked against the ids of earlier loads.
+Without it the collections are replaced, and so are the transaction rollups
+(see mongodb_rollups.py), which the next refresh rebuilds from scratch.
+
+Usage:
+    python mongodb_ingestion.py --path ./data
+    python mongodb_ingestion.py --path ./delta --append
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import re
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReplaceOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+
+from dedup import NEW, Deduplicator, remove_state
+from json_stream import describe, iter_records, iter_unit
+from mongodb_client import DATABASE, MONGO_URI, get_client
+from mongodb_denormalize import load_product_categories, product_categories, set_stamped, stamp_categories
+from mongodb_rollups import drop_rollups
+
+BATCH_SIZE = 1000  # Documents per insert_many / bulk_write call
+RANGE_SIZE = 32 << 20  # NDJSON bytes per work unit
+NUM_WORKERS = os.cpu_count() or 1
+DEDUP_DIR = 'mongo_dedup'
+DEDUP_CHUNK = 50000
+DUPLICATE_KEY = 11000
+
+# files: glob patterns; key: natural id (unique index, upsert key); dates: ISO string fields, dotted through
+# sub-documents and arrays; dedup: (id, user, time) fields of the dedup check
+COLLECTIONS = {
+    'users': {'files': ['users.json'], 'key': 'user_id', 'dates': ['registration_date', 'last_active']},
+    'products': {'files': ['products.json'], 'key': 'product_id', 'dates': ['creation_date', 'price_history.date']},
+    'categories': {'files': ['categories.json'], 'key': 'category_id', 'dates': []},
+    'transactions': {'files': ['transactions.json', 'transactions_*.ndjson'], 'key': 'transaction_id',
+                     'dates': ['timestamp'], 'dedup': ('transaction_id', 'user_id', 'timestamp')},
+    'sessions': {'files': ['sessions_*.json', 'sessions_*.ndjson'], 'key': 'session_id',
+                 'dates': ['start_time', 'end_time', 'page_views.timestamp'],
+                 'dedup': ('session_id', 'user_id', 'start_time')}
+}
+SNAPSHOTS = ('users', 'products', 'categories')  # Upserted rather than appended by --append
+
+# Built after the load; mongodb_index_advisor.py creates any that are missing and checks the pipelines use them
+INDEXES = {
+    'users': [IndexModel([('user_id', ASCENDING)], unique=True)],
+    'products': [IndexModel([('product_id', ASCENDING)], unique=True),
+                 IndexModel([('category_id', ASCENDING)])],
+    'categories': [IndexModel([('category_id', ASCENDING)], unique=True)],
+    'transactions': [IndexModel([('transaction_id', ASCENDING)], unique=True),
+                     IndexModel([('user_id', ASCENDING), ('timestamp', DESCENDING)]),
+                     IndexModel([('timestamp', ASCENDING)]),
+                     IndexModel([('session_id', ASCENDING)]),
+                     IndexModel([('items.product_id', ASCENDING)])],
+    'sessions': [IndexModel([('session_id', ASCENDING)], unique=True),
+                 IndexModel([('user_id', ASCENDING), ('start_time', DESCENDING)]),
+                 IndexModel([('start_time', ASCENDING)])]
+}
+
+def find_files(path, name):
+    return sorted({file_path for pattern in COLLECTIONS[name]['files']
+                   for file_path in glob.glob(os.path.join(path, pattern))})
+
+def plan_units(file_paths, range_size=RANGE_SIZE):
+    """
+    Work units in json_stream.iter_unit form. Every NDJSON file becomes byte
+    ranges (a single one when small), so positions are always byte offsets
+    there and session indexes in JSON arrays, as in iter_dedup_items.
+    """
+    units = []
+    for file_path in file_paths:
+        if not file_path.endswith('.ndjson'):
+            units.append((file_path, None, None, None))
+            continue
+        size = os.path.getsize(file_path)
+        units.extend((file_path, start, min(start + range_size, size), None)
+                     for start in range(0, max(size, 1), range_size))
+    return units
+
+# --- Dates ---
+def _convert(value, parts):
+    if isinstance(value, list):
+        for item in value:
+            _convert(item, parts)
+    elif isinstance(value, dict):
+        if len(parts) > 1:
+            _convert(value.get(parts[0]), parts[1:])
+        elif isinstance(value.get(parts[0]), str):
+            value[parts[0]] = datetime.fromisoformat(value[parts[0]])
+
+def convert_dates(document, paths):
+    """Replace the ISO strings at `paths` (split dotted paths) with datetimes, in place"""
+    for parts in paths:
+        _convert(document, parts)
+    return document
+
+# --- Duplicate check ---
+def iter_dedup_items(file_path, fields):
+    """
+    (position, (id, identity)) for every record of a file, positions as in
+    iter_unit. NDJSON lines are searched for the fields instead of being
+    decoded, falling back to json.loads when one is missing.
+    """
+    if not file_path.endswith('.ndjson'):
+        for i, document in enumerate(iter_records(file_path)):
+            yield i + 1, (document[fields[0]], f"{document.get(fields[1])}|{document.get(fields[2])}")
+        return
+    patterns = [re.compile(rb'"' + field.encode() + rb'": "([^"]*)"') for field in fields]
+    offset = 0
+    with open(file_path, 'rb') as f:
+        for line in f:
+            offset += len(line)
+            if not line.strip():
+                continue
+            matches = [pattern.search(line) for pattern in patterns]
+            if all(matches):
+                key, user, when = (match.group(1).decode() for match in matches)
+            else:
+                document = json.loads(line)
+                key, user, when = document[fields[0]], document.get(fields[1]), document.get(fields[2])
+            yield offset, (key, f"{user}|{when}")
+
+def find_duplicates(file_paths, fields, dedup):
+    """{file_path: positions} of the records that repeat an earlier one or reuse its id"""
+    skip = {}
+    for file_path in file_paths:
+        positions = []
+        items = []
+        for position, item in iter_dedup_items(file_path, fields):
+            positions.append(position)
+            items.append(item)
+            if len(items) >= DEDUP_CHUNK:
+                _check(dedup, file_path, positions, items, skip)
+        _check(dedup, file_path, positions, items, skip)
+    return skip
+
+def _check(dedup, file_path, positions, items, skip):
+    for position, status in zip(positions, dedup.check(items)):
+        if status != NEW:
+            skip.setdefault(file_path, set()).add(position)
+    positions.clear()
+    items.clear()
+
+# --- Workers ---
+_categories = None  # product -> category map of the worker, when stamping items
+
+def init_worker(categories):
+    global _categories
+    _categories = categories
+
+def write_batch(collection, documents, upsert_key=None):
+    """Unordered insert_many (or upserts by `upsert_key`); returns (written, duplicate-key rejections)"""
+    try:
+        if upsert_key:
+            collection.bulk_write([ReplaceOne({upsert_key: document[upsert_key]}, document, upsert=True)
+                                   for document in documents], ordered=False)
+        else:
+            collection.insert_many(documents, ordered=False)
+        return len(documents), 0
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY for error in errors):
+            raise
+        return len(documents) - len(errors), len(errors)
+
+def load_unit(task):
+    """Worker: stream one unit into its collection. Returns counts and wall-clock start/end times."""
+    name, unit, skip, uri, database, batch_size, upsert = task
+    started = time.time()
+    rows = skipped = duplicates = unstamped = 0
+    try:
+        collection = get_client(uri)[database][name]
+        date_paths = [path.split('.') for path in COLLECTIONS[name]['dates']]
+        upsert_key = COLLECTIONS[name]['key'] if upsert else None
+        stamp = _categories is not None and name == 'transactions'
+        batch = []
+        for document, position in iter_unit(unit):
+            if position in skip:
+                skipped += 1
+                continue
+            if stamp:
+                unstamped += stamp_categories(document, _categories)
+            batch.append(convert_dates(document, date_paths))
+            if len(batch) >= batch_size:
+                written, rejected = write_batch(collection, batch, upsert_key)
+                rows += written
+                duplicates += rejected
+                batch = []
+        if batch:
+            written, rejected = write_batch(collection, batch, upsert_key)
+            rows += written
+            duplicates += rejected
+        error = None
+    except (PyMongoError, OSError, ValueError) as e:
+        error = str(e)
+    return name, unit, rows, skipped, duplicates, unstamped, started, time.time(), error
+
+def build_indexes(db, names):
+    """Build the INDEXES of `names`; returns {collection: [(index, error)]} for those that could not be built"""
+    print("\nBuilding indexes...")
+    failed = {}
+    for name in names:
+        started = time.perf_counter()
+        try:
+            created = db[name].create_indexes(INDEXES[name])
+        except OperationFailure:
+            # Usually a unique index over repeated ids; build them one at a time to tell which
+            created = []
+            for model in INDEXES[name]:
+                try:
+                    created += db[name].create_indexes([model])
+                except OperationFailure as e:
+                    failed.setdefault(name, []).append((model.document['name'], str(e)))
+        print(f"  {name}: {', '.join(created) or 'no indexes'} in {time.perf_counter() - started:.1f}s")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load the generated dataset into MongoDB")
+    parser.add_argument('--path', default='.', help="Directory with the generator output")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string (or set MONGO_URI)")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--collections', nargs='+', choices=list(COLLECTIONS), default=list(COLLECTIONS))
+    parser.add_argument('--workers', type=int, default=NUM_WORKERS)
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Documents per bulk write")
+    parser.add_argument('--range-size', type=int, default=RANGE_SIZE, help="Bytes per NDJSON work unit")
+    parser.add_argument('--append', action='store_true',
+                        help="Load a delta on top of the existing data instead of replacing it")
+    parser.add_argument('--dedup-dir', default=DEDUP_DIR, help="Where the id check keeps its state between loads")
+    parser.add_argument('--no-dedup', action='store_true', help="Insert every record without the id check")
+    parser.add_argument('--denormalize-categories', action='store_true',
+                        help="Stamp each transaction item with its product's category")
+    args = parser.parse_args()
+
+    # 1. Check MongoDB is reachable
+    client = get_client(args.uri)
+    try:
+        client.admin.command('ping')
+        print("Connected to MongoDB successfully!")
+    except PyMongoError as e:
+        print(f"Connection failed: {e}")
+        exit()
+    db = client[args.database]
+
+    files = {name: find_files(args.path, name) for name in args.collections}
+    names = [name for name in args.collections if files[name]]
+    for name in args.collections:
+        if not files[name]:
+            print(f"⚠ No files for {name} in {args.path}")
+
+    # 2. Start from empty collections, unless appending a delta
+    if not args.append:
+        for name in names:
+            db.drop_collection(name)
+        if 'transactions' in names:
+            drop_rollups(db)  # They summarize the dropped transactions; the next refresh rebuilds them
+
+    # 3. Check transaction and session ids
+    skip = {}
+    for name in names:
+        if args.no_dedup or 'dedup' not in COLLECTIONS[name]:
+            continue
+        state = os.path.join(args.dedup_dir, f"{args.database}_{name}.sqlite")
+        if not args.append:
+            remove_state(state)
+        dedup = Deduplicator.open(state)
+        started = time.perf_counter()
+        skip.update(find_duplicates(files[name], COLLECTIONS[name]['dedup'], dedup))
+        dedup.save()
+        print(f"{name} ids ({time.perf_counter() - started:.1f}s): {dedup.report()}")
+        dedup.close()
+
+    # 4. Load, largest collections first so the small ones fill in at the end
+    categories = None
+    if args.denormalize_categories and 'transactions' in names:
+        product_files = find_files(args.path, 'products')
+        # The products of this load, or those already in the database when appending transactions alone
+        categories = (product_categories(p for f in product_files for p in iter_records(f)) if product_files
+                      else load_product_categories(db))
+        print(f"Stamping transaction items from a map of {len(categories):,} products")
+    tasks = [(name, unit, skip.get(unit[0], set()), args.uri, args.database, args.batch_size,
+              args.append and name in SNAPSHOTS)
+             for name in sorted(names, key=lambda n: -sum(os.path.getsize(p) for p in files[n]))
+             for unit in plan_units(files[name], args.range_size)]
+    print(f"\nLoading {len(tasks)} units into {args.database} with {args.workers} workers...")
+    totals = {name: {'rows': 0, 'skipped': 0, 'duplicates': 0, 'unstamped': 0, 'failed': 0, 'start': None,
+                     'end': None}
+              for name in names}
+    started = time.perf_counter()
+    # Spawned, not forked: a MongoClient must not be shared across a fork
+    with multiprocessing.get_context('spawn').Pool(args.workers, initializer=init_worker,
+                                                   initargs=(categories,)) as pool:
+        for name, unit, rows, skipped, duplicates, unstamped, unit_start, unit_end, error in pool.imap_unordered(
+                load_unit, tasks):
+            total = totals[name]
+            if error:
+                print(f"Error in {describe(unit)}: {error}")
+                total['failed'] += 1
+            total['rows'] += rows
+            total['skipped'] += skipped
+            total['duplicates'] += duplicates
+            total['unstamped'] += unstamped
+            total['start'] = min(unit_start, total['start'] or unit_start)
+            total['end'] = max(unit_end, total['end'] or unit_end)
+    elapsed = time.perf_counter() - started
+
+    print("\nThroughput:")
+    for name in names:
+        total = totals[name]
+        seconds = max(total['end'] - total['start'], 1e-9)
+        notes = f"; {total['skipped']:,} duplicates skipped" if total['skipped'] else ""
+        if total['duplicates']:
+            notes += f"; {total['duplicates']:,} rejected by the unique index"
+        if total['failed']:
+            notes += f"; {total['failed']:,} units failed"
+        print(f"  {name:<13} {total['rows']:>10,} documents in {seconds:6.1f}s "
+              f"({total['rows'] / seconds:,.0f} rows/s){notes}")
+    rows = sum(total['rows'] for total in totals.values())
+    print(f"  Total: {rows:,} documents in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s aggregate)")
+    failed_units = sum(total['failed'] for total in totals.values())
+    if failed_units:
+        incomplete = ', '.join(name for name in names if totals[name]['failed'])
+        print(f"⚠ {failed_units:,} of {len(tasks):,} units failed to load (errors above); incomplete: {incomplete}")
+
+    # 5. Record whether every transaction item now carries its category
+    if 'transactions' in names:
+        unstamped = totals['transactions']['unstamped']
+        if categories is None:
+            set_stamped(db, False)
+        elif unstamped:
+            print(f"⚠ {unstamped:,} items have a product missing from products; revenue by category keeps $lookup")
+            set_stamped(db, False)
+        elif not args.append:
+            set_stamped(db, True)
+        # Appending stamped transactions leaves the flag as it was
+
+    # 6. Indexes, now that the data is in
+    failed = build_indexes(db, names)
+    if failed:
+        for name, errors in failed.items():
+            for index, error in errors:
+                print(f"⚠ {name}: index {index} was not built: {error}")
+        print("Records sharing an id keep the unique indexes from building "
+              "(loaded with --no-dedup, or an id repeated across --append loads). "
+              "Remove the duplicates, or reload without --no-dedup.")
+    if failed or failed_units:
+        exit(1)
+    print("\n✅ MongoDB ingestion complete!")
+
+if __name__ == "__main__":
+    main()
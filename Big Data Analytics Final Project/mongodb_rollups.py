@@ -0,0 +1,184 @@
+# mongodb_rollups.py
+"""
+Pre-aggregated rollups of the transactions, kept up to date incrementally.
+
+    rollup_product_day   _id {product_id, day}:  totalSold, totalRevenue
+    rollup_category_day  _id {category_id, day}: totalUnits, totalRevenue
+    rollup_day           _id day:                revenue, transactions, items
+
+Each refresh aggregates only the transactions after the high-water mark (the
+latest timestamp seen by the previous refresh, kept in ingest_meta) and
+$merges the result into the rollups. The window starts at midnight of the
+high-water mark's day and whole days are recomputed and replaced, so a
+refresh that fails half way can simply run again without counting anything
+twice, and late transactions within the last day are picked up.
+
+The reports (top products, revenue by category, daily revenue) then read
+these collections, whose size grows with days rather than with transactions.
+Category rollups use the category stamped on the items when every item has
+one (see mongodb_denormalize.py), or a $lookup into products for the window.
+
+Usage:
+    python mongodb_rollups.py              # refresh from the high-water mark
+    python mongodb_rollups.py --rebuild    # drop the rollups and rebuild them from all transactions
+"""
+
+import argparse
+import time
+from datetime import datetime, timezone
+
+from pymongo.errors import PyMongoError
+
+from mongodb_client import DATABASE, MAX_TIME_MS, MONGO_URI, get_client
+from mongodb_denormalize import META_COLLECTION, items_stamped
+
+STATE_ID = 'rollups'  # ingest_meta _id of the high-water mark
+PRODUCT_DAY = 'rollup_product_day'
+CATEGORY_DAY = 'rollup_category_day'
+DAY = 'rollup_day'
+ROLLUPS = (PRODUCT_DAY, CATEGORY_DAY, DAY)
+
+DAY_KEY = {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}}
+
+def rollup_pipelines(stamped):
+    """Grouping stages of each rollup, run after the window $match"""
+    if stamped:
+        category = [{"$unwind": "$items"}]
+        category_id = "$items.category_id"
+    else:
+        category = [
+            {"$unwind": "$items"},
+            {"$lookup": {"from": "products", "localField": "items.product_id",
+                         "foreignField": "product_id", "as": "product"}},
+            {"$unwind": "$product"}
+        ]
+        category_id = "$product.category_id"
+    return {
+        PRODUCT_DAY: [
+            {"$unwind": "$items"},
+            {"$group": {
+                "_id": {"product_id": "$items.product_id", "day": DAY_KEY},
+                "totalSold": {"$sum": "$items.quantity"},
+                "totalRevenue": {"$sum": "$items.subtotal"}
+            }}
+        ],
+        CATEGORY_DAY: category + [
+            {"$group": {
+                "_id": {"category_id": category_id, "day": DAY_KEY},
+                "totalUnits": {"$sum": "$items.quantity"},
+                "totalRevenue": {"$sum": "$items.subtotal"}
+            }}
+        ],
+        DAY: [
+            {"$group": {
+                "_id": DAY_KEY,
+                "revenue": {"$sum": "$total"},
+                "transactions": {"$sum": 1},
+                "items": {"$sum": {"$size": {"$ifNull": ["$items", []]}}}
+            }}
+        ]
+    }
+
+# --- Reports over the rollups ---
+TOP_PRODUCTS_ROLLUP_PIPELINE = [
+    {"$group": {"_id": "$_id.product_id", "totalSold": {"$sum": "$totalSold"},
+                "totalRevenue": {"$sum": "$totalRevenue"}}},
+    {"$sort": {"totalSold": -1}},
+    {"$limit": 15}
+]
+
+REVENUE_BY_CATEGORY_ROLLUP_PIPELINE = [
+    {"$group": {"_id": "$_id.category_id", "totalRevenue": {"$sum": "$totalRevenue"},
+                "totalUnits": {"$sum": "$totalUnits"}}},
+    {"$sort": {"totalRevenue": -1}}
+]
+
+DAILY_REVENUE_ROLLUP_PIPELINE = [
+    {"$sort": {"_id": 1}},
+    {"$project": {"_id": 0, "date": "$_id", "revenue": {"$round": ["$revenue", 2]}, "transactions": 1}}
+]
+
+# --- Refresh ---
+def high_water_mark(db):
+    state = db[META_COLLECTION].find_one({'_id': STATE_ID})
+    return state.get('high_water_mark') if state else None
+
+def rollups_available(db):
+    return high_water_mark(db) is not None
+
+def refresh_window(mark, end):
+    """
+    Start of a refresh from the high-water mark `mark` (None: from the first
+    transaction) up to `end`, and the $match stage selecting its transactions
+    """
+    start = datetime(mark.year, mark.month, mark.day) if mark is not None else None
+    window = {'$gte': start, '$lte': end} if start is not None else {'$lte': end}
+    return start, {"$match": {"timestamp": window}}
+
+def refresh(db, max_time_ms=MAX_TIME_MS):
+    """
+    Merge the transactions after the high-water mark into the rollups.
+    Returns (window start, window end, {rollup: seconds}), or None when
+    there is nothing new.
+    """
+    latest = db.transactions.find_one({'timestamp': {'$type': 'date'}}, {'timestamp': 1},
+                                      sort=[('timestamp', -1)])
+    if latest is None:
+        return None
+    end = latest['timestamp']
+    mark = high_water_mark(db)
+    if mark is not None and mark >= end:
+        return None
+    start, match = refresh_window(mark, end)
+
+    timings = {}
+    stamped = items_stamped(db)
+    for name, stages in rollup_pipelines(stamped).items():
+        started = time.perf_counter()
+        db.transactions.aggregate(
+            [match] + stages +
+            [{"$merge": {"into": name, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}}],
+            allowDiskUse=True, maxTimeMS=max_time_ms)
+        timings[name] = time.perf_counter() - started
+    # Only once every rollup holds the window; a failed refresh starts from the old mark again
+    db[META_COLLECTION].update_one({'_id': STATE_ID},
+                                   {'$set': {'high_water_mark': end, 'updated': datetime.now(timezone.utc)}},
+                                   upsert=True)
+    return start, end, timings
+
+def drop_rollups(db):
+    for name in ROLLUPS:
+        db.drop_collection(name)
+    db[META_COLLECTION].delete_one({'_id': STATE_ID})
+
+def print_refresh(result):
+    if result is None:
+        print("Rollups are up to date")
+        return
+    start, end, timings = result
+    print(f"Rollups refreshed for {start or 'the beginning'} .. {end}:")
+    for name, seconds in timings.items():
+        print(f"  {name}: {seconds:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the transaction rollup collections")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string (or set MONGO_URI)")
+    parser.add_argument('--database', default=DATABASE)
+    parser.add_argument('--rebuild', action='store_true', help="Drop the rollups and rebuild them from scratch")
+    args = parser.parse_args()
+
+    try:
+        db = get_client(args.uri)[args.database]
+        db.command('ping')
+    except PyMongoError as e:
+        print(f"Connection failed: {e}")
+        exit()
+
+    if args.rebuild:
+        drop_rollups(db)
+    print_refresh(refresh(db))
+    for name in ROLLUPS:
+        print(f"  {name}: {db[name].estimated_document_count():,} documents")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+# parquet_export.py
+"""
+Convert the generator's JSON output into columnar Parquet datasets.
+
+Tables (each partitioned by day, Hive-style: <table>/day=YYYY-MM-DD/):
+- sessions          one row per session
+- page_views        page views exploded from sessions, keyed by session_id
+                    (partitioned by the session's day so they stay co-located)
+- transactions      one row per transaction
+- transaction_items items exploded from transactions, keyed by transaction_id
+
+Low-cardinality string columns are dictionary-encoded, so analytics can
+read only the columns they need instead of re-parsing nested JSON. Each day
+partition holds a single file: input files are converted into a staging
+directory first, then compacted.
+
+Usage:
+    python parquet_export.py --input-dir . --output-dir parquet
+"""
+
+import argparse
+import glob
+import io
+import itertools
+import json
+import os
+import shutil
+import time
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.json as pj
+
+from json_stream import iter_records
+
+ROW_GROUP_SIZE = 128000
+STAGING_DIR = "_staging"  # Per-input-file output awaiting compaction, under the output directory
+PARSE_BATCH_SIZE = 10000  # Records handed to Arrow's JSON reader at a time
+MAX_OPEN_FILES = 512
+
+# Schemas used to parse the JSON input (fields not listed, like cart_contents, are skipped)
+PAGE_VIEW_TYPE = pa.struct([
+    ("timestamp", pa.timestamp("us")),
+    ("page_type", pa.string()),
+    ("product_id", pa.string()),
+    ("category_id", pa.string()),
+    ("view_duration", pa.int32())
+])
+
+SESSION_INPUT_SCHEMA = pa.schema([
+    ("session_id", pa.string()),
+    ("user_id", pa.string()),
+    ("start_time", pa.timestamp("us")),
+    ("end_time", pa.timestamp("us")),
+    ("duration_seconds", pa.int32()),
+    ("geo_data", pa.struct([
+        ("city", pa.string()),
+        ("state", pa.string()),
+        ("country", pa.string()),
+        ("ip_address", pa.string())
+    ])),
+    ("device_profile", pa.struct([
+        ("type", pa.string()),
+        ("os", pa.string()),
+        ("browser", pa.string())
+    ])),
+    ("viewed_products", pa.list_(pa.string())),
+    ("page_views", pa.list_(PAGE_VIEW_TYPE)),
+    ("conversion_status", pa.string()),
+    ("referrer", pa.string())
+])
+
+ITEM_TYPE = pa.struct([
+    ("product_id", pa.string()),
+    ("quantity", pa.int32()),
+    ("unit_price", pa.float64()),
+    ("subtotal", pa.float64())
+])
+
+TRANSACTION_INPUT_SCHEMA = pa.schema([
+    ("transaction_id", pa.string()),
+    ("session_id", pa.string()),
+    ("user_id", pa.string()),
+    ("timestamp", pa.timestamp("us")),
+    ("items", pa.list_(ITEM_TYPE)),
+    ("subtotal", pa.float64()),
+    ("discount", pa.float64()),
+    ("total", pa.float64()),
+    ("payment_method", pa.string()),
+    ("status", pa.string())
+])
+
+DICT = pa.dictionary(pa.int32(), pa.string())
+
+# Output schemas
+SESSIONS_SCHEMA = pa.schema([
+    ("session_id", pa.string()),
+    ("user_id", pa.string()),
+    ("start_time", pa.timestamp("us")),
+    ("end_time", pa.timestamp("us")),
+    ("duration_seconds", pa.int32()),
+    ("city", pa.string()),
+    ("state", DICT),
+    ("country", DICT),
+    ("ip_address", pa.string()),
+    ("device_type", DICT),
+    ("device_os", DICT),
+    ("browser", DICT),
+    ("referrer", DICT),
+    ("conversion_status", DICT),
+    ("page_view_count", pa.int16()),
+    ("viewed_products", pa.list_(pa.string())),
+    ("day", pa.string())
+])
+
+PAGE_VIEWS_SCHEMA = pa.schema([
+    ("session_id", pa.string()),
+    ("position", pa.int16()),
+    ("timestamp", pa.timestamp("us")),
+    ("page_type", DICT),
+    ("product_id", pa.string()),
+    ("category_id", DICT),
+    ("view_duration", pa.int32()),
+    ("day", pa.string())
+])
+
+TRANSACTIONS_SCHEMA = pa.schema([
+    ("transaction_id", pa.string()),
+    ("session_id", pa.string()),
+    ("user_id", pa.string()),
+    ("timestamp", pa.timestamp("us")),
+    ("subtotal", pa.float64()),
+    ("discount", pa.float64()),
+    ("total", pa.float64()),
+    ("payment_method", DICT),
+    ("status", DICT),
+    ("item_count", pa.int16()),
+    ("day", pa.string())
+])
+
+TRANSACTION_ITEMS_SCHEMA = pa.schema([
+    ("transaction_id", pa.string()),
+    ("position", pa.int16()),
+    ("product_id", pa.string()),
+    ("quantity", pa.int32()),
+    ("unit_price", pa.float64()),
+    ("subtotal", pa.float64()),
+    ("day", pa.string())
+])
+
+def read_records(path, schema):
+    """
+    Read one generator output file as a single Arrow table.
+    NDJSON shards go through Arrow's native JSON reader. Legacy JSON array
+    files (sessions_N.json, transactions.json) are streamed with
+    json_stream.iter_records and re-serialized as NDJSON PARSE_BATCH_SIZE
+    records at a time, so both formats share the same parsing rules and an
+    array file is never loaded whole as text or Python objects.
+    """
+    options = pj.ParseOptions(explicit_schema=schema, unexpected_field_behavior="ignore")
+    if path.endswith(".ndjson"):
+        if os.path.getsize(path) == 0:
+            return schema.empty_table()
+        return pj.read_json(path, parse_options=options)
+
+    records = iter_records(path)
+    batches = []
+    while True:
+        batch = list(itertools.islice(records, PARSE_BATCH_SIZE))
+        if not batch:
+            break
+        ndjson = "\n".join(json.dumps(r) for r in batch).encode()
+        batches.append(pj.read_json(io.BytesIO(ndjson), parse_options=options))
+    return pa.concat_tables(batches) if batches else schema.empty_table()
+
+def find_inputs(input_dir, prefix):
+    """Generator output files for one entity, NDJSON shards first, then legacy JSON"""
+    paths = sorted(glob.glob(os.path.join(input_dir, f"{prefix}_*.ndjson")))
+    paths += sorted(glob.glob(os.path.join(input_dir, f"{prefix}_*.json")))
+    legacy = os.path.join(input_dir, f"{prefix}.json")
+    if os.path.exists(legacy):
+        paths.append(legacy)
+    return paths
+
+def day_of(timestamps):
+    return pc.strftime(timestamps, format="%Y-%m-%d")
+
+def explode(table, list_column, key_column):
+    """
+    Explode a list column into one row per element, carrying the parent's key
+    and day plus the element's position within its parent.
+    """
+    lists = table.column(list_column).combine_chunks()
+    parents = pc.list_parent_indices(lists)
+    starts = pc.take(lists.offsets, parents)
+    positions = pc.subtract(pa.array(range(len(parents)), pa.int64()), starts)
+    values = pc.list_flatten(lists)
+    columns = {
+        key_column: pc.take(table.column(key_column), parents),
+        "position": positions.cast(pa.int16())
+    }
+    for field in values.type:
+        columns[field.name] = values.field(field.name)
+    columns["day"] = pc.take(table.column("day"), parents)
+    return columns
+
+def session_tables(path):
+    raw = read_records(path, SESSION_INPUT_SCHEMA)
+    geo = raw.column("geo_data").combine_chunks()
+    device = raw.column("device_profile").combine_chunks()
+    day = day_of(raw.column("start_time"))
+
+    sessions = pa.table({
+        "session_id": raw.column("session_id"),
+        "user_id": raw.column("user_id"),
+        "start_time": raw.column("start_time"),
+        "end_time": raw.column("end_time"),
+        "duration_seconds": raw.column("duration_seconds"),
+        "city": geo.field("city"),
+        "state": geo.field("state").dictionary_encode(),
+        "country": geo.field("country").dictionary_encode(),
+        "ip_address": geo.field("ip_address"),
+        "device_type": device.field("type").dictionary_encode(),
+        "device_os": device.field("os").dictionary_encode(),
+        "browser": device.field("browser").dictionary_encode(),
+        "referrer": pc.dictionary_encode(raw.column("referrer")),
+        "conversion_status": pc.dictionary_encode(raw.column("conversion_status")),
+        "page_view_count": pc.list_value_length(raw.column("page_views")).cast(pa.int16()),
+        "viewed_products": raw.column("viewed_products"),
+        "day": day
+    }, schema=SESSIONS_SCHEMA)
+
+    views = explode(raw.append_column("day", day), "page_views", "session_id")
+    views["page_type"] = pc.dictionary_encode(views["page_type"])
+    views["category_id"] = pc.dictionary_encode(views["category_id"])
+    page_views = pa.table(views).select(PAGE_VIEWS_SCHEMA.names).cast(PAGE_VIEWS_SCHEMA)
+    return sessions, page_views
+
+def transaction_tables(path):
+    raw = read_records(path, TRANSACTION_INPUT_SCHEMA)
+    day = day_of(raw.column("timestamp"))
+
+    transactions = pa.table({
+        "transaction_id": raw.column("transaction_id"),
+        "session_id": raw.column("session_id"),
+        "user_id": raw.column("user_id"),
+        "timestamp": raw.column("timestamp"),
+        "subtotal": raw.column("subtotal"),
+        "discount": raw.column("discount"),
+        "total": raw.column("total"),
+        "payment_method": pc.dictionary_encode(raw.column("payment_method")),
+        "status": pc.dictionary_encode(raw.column("status")),
+        "item_count": pc.list_value_length(raw.column("items")).cast(pa.int16()),
+        "day": day
+    }, schema=TRANSACTIONS_SCHEMA)
+
+    items = explode(raw.append_column("day", day), "items", "transaction_id")
+    transaction_items = pa.table(items).select(TRANSACTION_ITEMS_SCHEMA.names).cast(TRANSACTION_ITEMS_SCHEMA)
+    return transactions, transaction_items
+
+DAY_PARTITIONING = ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive")
+
+def write_table(table, schema, output_dir, name, basename_template):
+    """
+    Add a table (or a dataset, streamed) to a day-partitioned,
+    dictionary-encoded Parquet dataset, as files named after basename_template
+    """
+    dictionary_columns = [f.name for f in schema if pa.types.is_dictionary(f.type)]
+    file_options = ds.ParquetFileFormat().make_write_options(
+        compression="zstd",
+        use_dictionary=dictionary_columns
+    )
+    ds.write_dataset(
+        table,
+        os.path.join(output_dir, name),
+        schema=schema,
+        format="parquet",
+        file_options=file_options,
+        partitioning=DAY_PARTITIONING,
+        basename_template=basename_template,
+        existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=ROW_GROUP_SIZE,
+        min_rows_per_group=ROW_GROUP_SIZE // 4,
+        max_open_files=MAX_OPEN_FILES,
+        preserve_order=True
+    )
+
+def compact(schema, staging_dir, output_dir, name):
+    """
+    Rewrite a staged table as one file per day partition. The staged files
+    are streamed through a single write, which keeps one file open per day
+    (up to MAX_OPEN_FILES days), so memory stays bounded by the row groups.
+    """
+    staged = ds.dataset(os.path.join(staging_dir, name), schema=schema, format="parquet",
+                        partitioning=DAY_PARTITIONING)
+    write_table(staged, schema, output_dir, name, "part-{i}.parquet")
+
+# Input files of each source, the function that parses one into its tables, and their output schemas
+SOURCES = {
+    "sessions": (session_tables, [("sessions", SESSIONS_SCHEMA), ("page_views", PAGE_VIEWS_SCHEMA)]),
+    "transactions": (transaction_tables, [("transactions", TRANSACTIONS_SCHEMA),
+                                          ("transaction_items", TRANSACTION_ITEMS_SCHEMA)])
+}
+
+def export(input_dir, output_dir, tables=("sessions", "page_views", "transactions", "transaction_items")):
+    """
+    Convert every session and transaction file in input_dir, one input file
+    at a time: each file is parsed once and both of its tables are staged
+    from that pass. The staged tables are then compacted into one
+    part-0.parquet per day partition.
+    """
+    staging_dir = os.path.join(output_dir, STAGING_DIR)
+    for prefix, (convert, outputs) in SOURCES.items():
+        wanted = [name for name, _ in outputs if name in tables]
+        if not wanted:
+            continue
+        paths = find_inputs(input_dir, prefix)
+        if not paths:
+            print(f"⚠ No input files for {', '.join(wanted)}, skipping")
+            continue
+
+        # The files of each run are added to the partitions, so start from empty tables
+        for name in wanted:
+            shutil.rmtree(os.path.join(output_dir, name), ignore_errors=True)
+            shutil.rmtree(os.path.join(staging_dir, name), ignore_errors=True)
+        rows = dict.fromkeys(wanted, 0)
+        started = time.perf_counter()
+        for index, path in enumerate(paths):
+            for (name, schema), table in zip(outputs, convert(path)):
+                if name in rows:
+                    rows[name] += table.num_rows
+                    write_table(table, schema, staging_dir, name, f"part-{index}-{{i}}.parquet")
+        converted = time.perf_counter()
+        for name, schema in outputs:
+            if name in rows and rows[name]:
+                compact(schema, staging_dir, output_dir, name)
+            shutil.rmtree(os.path.join(staging_dir, name), ignore_errors=True)
+        compacted = time.perf_counter()
+        for name in wanted:
+            print(f"✅ {name}: {rows[name]:,} rows from {len(paths)} files")
+        print(f"   {prefix} files converted in {converted - started:.1f}s, "
+              f"compacted in {compacted - converted:.1f}s")
+    if os.path.isdir(staging_dir) and not os.listdir(staging_dir):
+        os.rmdir(staging_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert generator JSON output to Parquet")
+    parser.add_argument("--input-dir", default=".")
+    parser.add_argument("--output-dir", default="parquet")
+    parser.add_argument("--tables", nargs="+",
+                        default=["sessions", "page_views", "transactions", "transaction_items"])
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    export(args.input_dir, args.output_dir, args.tables)
+
+if __name__ == "__main__":
+    main()